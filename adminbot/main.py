@@ -7,33 +7,62 @@ import os
 import sys
 from dotenv import load_dotenv
 from telethon import TelegramClient
-import boto3
 from telethon.tl import types
 import json
+from datetime import datetime
 
 # Add parent directory to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Now you can import the database module
-from database.db import Session, engine
+from database.middleware import DbSessionMiddleware
 from database.models import UserBot
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from userbot_manager import session_cache, extract_session_name, storage, check_spambot
+from rpc_scheduler import rpc_scheduler
+from peer_cache import peer_cache
+from string_sessions import is_configured, encrypt_session_string, session_to_string
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN_ADMIN")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 
-# AWS S3 (Bucketeer) configuration
-AWS_BUCKET_NAME = os.getenv("BUCKETEER_BUCKET_NAME")
-AWS_ACCESS_KEY_ID = os.getenv("BUCKETEER_AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("BUCKETEER_AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("BUCKETEER_REGION")
-
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+# Одна сессия базы данных на обновление
+dp.update.outer_middleware(DbSessionMiddleware())
+
 def is_admin(user_id: int) -> bool:
     return user_id == ADMIN_ID
 
+def format_health_label(health) -> str:
+    """Формирует краткое описание состояния аккаунта по результату фонового мониторинга."""
+    if health is None or health.last_check_at is None:
+        return "❔ не проверен"
+    if health.is_authorized is False:
+        return "❌ сессия недействительна"
+    if health.is_authorized is None:
+        return "⚠️ не удалось подключиться"
+    if health.is_restricted:
+        return "⚠️ аккаунт ограничен"
+    if health.spam_status == 'limited':
+        return "⚠️ спам-блок"
+    if health.flood_wait_until and health.flood_wait_until > datetime.now():
+        return f"⚠️ FloodWait до {health.flood_wait_until.strftime('%H:%M')}"
+    return "✅ активен"
+
+def format_spam_status(spam_code: str, spam_text: str):
+    """Формирует текст статуса и детали по результату проверки через SpamBot."""
+    if spam_code == 'ok':
+        return "✅ Аккаунт не заблокирован", f"\n\nДетали от SpamBot:\n{spam_text}"
+    if spam_code == 'limited':
+        return "❌ Обнаружены ограничения: возможен спам-блок", f"\n\nДетали от SpamBot:\n{spam_text}"
+    if spam_code == 'answered':
+        return f"⚠️ Ответ от SpamBot получен: {spam_text[:100]}...", ""
+    return "⚠️ Статус блокировки неизвестен (не получен ответ от SpamBot)", ""
+
 @dp.message(CommandStart())
 async def start_cmd(message: Message):
     if not is_admin(message.from_user.id):
@@ -92,7 +121,7 @@ async def handle_add_button(message: Message):
     await message.answer("Пожалуйста, отправьте файл сессии.")
 
 @dp.message(F.content_type == ContentType.DOCUMENT)
-async def handle_session_file(message: Message):
+async def handle_session_file(message: Message, session):
     print("Получен документ")
     if not is_admin(message.from_user.id):
         return
@@ -110,7 +139,8 @@ async def handle_session_file(message: Message):
     await bot.download_file(file.file_path, local_path)
 
     # Выполняем вход с помощью Telethon без использования api_id и api_hash
-    client = TelegramClient(local_path, api_id=1, api_hash="1")
+    account = extract_session_name(document.file_name)
+    client = TelegramClient(local_path, api_id=1, api_hash="1", flood_sleep_threshold=0)
 
     try:
         await client.connect()
@@ -119,40 +149,31 @@ async def handle_session_file(message: Message):
             return
 
         # Получаем ID аккаунта
-        me = await client.get_me()
+        me = await rpc_scheduler.call(account, 'default', lambda: client.get_me())
         account_id = me.id
         
+        # Сохраняем сессию как зашифрованную StringSession, чтобы подключаться без файла
+        session_string = None
+        if is_configured():
+            session_string = encrypt_session_string(session_to_string(client.session))
+        else:
+            print("SESSION_ENCRYPTION_KEY не задан, сессия будет доступна только из файла")
+        
         # Попытка отправить сообщение администратору
         try:
-            # Для отправки сообщения от имени юзербота администратору
-            # нам нужно сначала получить информацию о пользователе
-            # Используем getDialogs() для получения списка диалогов и поиска админа
-            dialogs = await client.get_dialogs()
-            
-            # Попробуем найти пользователя с нужным ID в диалогах
-            admin_found = False
-            for dialog in dialogs:
-                if dialog.entity.id == ADMIN_ID:
-                    await client.send_message(dialog.entity, f"Привет! Успешный вход. Мой ID: {account_id}")
-                    admin_found = True
-                    break
-            
-            # Если админа нет в диалогах, попробуем найти его по ID
-            if not admin_found:
-                # Создаем сущность админа через API
-                # Для этого сначала найдем пользователя по ID
-                try:
-                    # Пробуем получить информацию об админе
-                    admin = await client.get_entity(ADMIN_ID)
-                    await client.send_message(admin, f"Привет! Успешный вход. Мой ID: {account_id}")
-                    admin_found = True
-                except Exception as e:
-                    print(f"Не удалось получить информацию об админе: {e}")
+            # Сущность админа берем из общего кэша; если аккаунт админа еще не видел,
+            # ищем его в диалогах и сохраняем все найденные сущности в кэш
+            try:
+                admin = await peer_cache.get_input_entity(client, account, ADMIN_ID)
+            except ValueError:
+                admin = ADMIN_ID
+                dialogs = await rpc_scheduler.call(account, 'messages', lambda: client.get_dialogs())
+                await peer_cache.remember_many(account, [dialog.entity for dialog in dialogs])
+                for dialog in dialogs:
+                    if dialog.entity.id == ADMIN_ID:
+                        admin = dialog.entity
             
-            # Если админа все равно не нашли, попробуем создать чат и отправить сообщение
-            if not admin_found:
-                # Создаем новый диалог с админом
-                await client.send_message(ADMIN_ID, f"Привет! Успешный вход. Мой ID: {account_id}")
+            await rpc_scheduler.call(account, 'messages', lambda: client.send_message(admin, f"Привет! Успешный вход. Мой ID: {account_id}"))
                 
             await message.answer(f"Аккаунт успешно авторизован, ID: {account_id}. Отправлено тестовое сообщение.")
         except Exception as e:
@@ -162,56 +183,45 @@ async def handle_session_file(message: Message):
     finally:
         await client.disconnect()
 
-    # Загружаем файл в бакет на Heroku
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION
-    )
-    bucket_name = AWS_BUCKET_NAME
+    # Загружаем файл в общее хранилище (бакет на Heroku)
     s3_key = f"sessions/{document.file_name}"
 
-    s3.upload_file(local_path, bucket_name, s3_key)
-    heroku_url = f"https://{bucket_name}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
+    await storage.put(local_path, s3_key)
+    heroku_url = storage.url(s3_key)
 
     # Сохраняем запись в базе данных
-    session = Session(bind=engine)
-    
     # Проверяем, есть ли уже аккаунт с таким же account_id
-    existing_userbot = session.query(UserBot).filter(UserBot.account_id == account_id).first()
+    existing_userbot = await session.scalar(select(UserBot).where(UserBot.account_id == account_id))
     
     if (existing_userbot):
         # Если аккаунт с таким ID уже существует, удаляем его
-        session.delete(existing_userbot)
-        session.commit()
+        await session.delete(existing_userbot)
+        await session.commit()
         await message.answer(f"Аккаунт с ID {account_id} уже существовал в базе и был заменен на новый.")
     
     # Добавляем новый аккаунт
     new_userbot = UserBot(
         owner_id=message.from_user.id,
         account_id=account_id,
-        session_name=heroku_url
+        session_name=heroku_url,
+        session_string=session_string
     )
     session.add(new_userbot)
-    session.commit()
-    session.close()
+    await session.commit()
 
     await message.answer(f"Файл сессии успешно добавлен, ID аккаунта: {account_id}. Успешно выполнен вход.")
 
 @dp.message(F.text == "Статус")
-async def handle_status_button(message: Message):
+async def handle_status_button(message: Message, session):
     print(f"Получено сообщение: {message.text}")
     if not is_admin(message.from_user.id):
         return
 
-    # Получаем все записи из базы данных
-    session = Session(bind=engine)
-    userbots = session.query(UserBot).all()
+    # Получаем все записи из базы данных вместе с результатами фонового мониторинга
+    userbots = (await session.scalars(select(UserBot).options(joinedload(UserBot.health)))).all()
     
     if not userbots:
         await message.answer("Нет добавленных аккаунтов.")
-        session.close()
         return
     
     # Добавляем кнопку возврата
@@ -222,13 +232,26 @@ async def handle_status_button(message: Message):
         resize_keyboard=True
     )
     
+    # Сводка по результатам мониторинга
+    health_labels = [format_health_label(userbot.health) for userbot in userbots]
+    summary = (
+        f"📊 Статус аккаунтов: {len(userbots)}\n"
+        f"✅ Активны: {sum(1 for label in health_labels if label.startswith('✅'))}\n"
+        f"❌ Недоступны: {sum(1 for label in health_labels if label.startswith('❌'))}\n"
+        f"⚠️ Ограничены: {sum(1 for label in health_labels if label.startswith('⚠️'))}\n"
+        f"❔ Не проверены: {sum(1 for label in health_labels if label.startswith('❔'))}"
+    )
+    
     # Отправляем сообщение со списком аккаунтов
-    await message.answer("📊 Статус аккаунтов:", reply_markup=keyboard_reply)
+    await message.answer(summary, reply_markup=keyboard_reply)
     
     # Для каждого аккаунта отправляем отдельное сообщение с инлайн кнопкой
-    for i, userbot in enumerate(userbots, 1):
+    for i, (userbot, health_label) in enumerate(zip(userbots, health_labels), 1):
         account_info = f"{i}. ID аккаунта: {userbot.account_id}\n"
         account_info += f"   Добавлен: {userbot.created_at}\n"
+        account_info += f"   Состояние: {health_label}\n"
+        if userbot.health and userbot.health.last_check_at:
+            account_info += f"   Проверен: {userbot.health.last_check_at.strftime('%d.%m.%Y %H:%M')} ({userbot.health.last_latency_ms} мс)\n"
         
         # Создаем инлайн клавиатуру с кнопкой проверки
         inline_kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -237,18 +260,15 @@ async def handle_status_button(message: Message):
         
         # Отправляем сообщение с инлайн-кнопкой
         await message.answer(account_info, reply_markup=inline_kb)
-    
-    session.close()
 
 @dp.message(F.text == "Удалить")
-async def handle_delete_button(message: Message):
+async def handle_delete_button(message: Message, session):
     print(f"Получено сообщение: {message.text}")
     if not is_admin(message.from_user.id):
         return
 
     # Получаем все записи из базы данных
-    session = Session(bind=engine)
-    userbots = session.query(UserBot).all()
+    userbots = (await session.scalars(select(UserBot))).all()
     
     if not userbots:
         # Если нет аккаунтов для удаления
@@ -257,7 +277,6 @@ async def handle_delete_button(message: Message):
             resize_keyboard=True
         )
         await message.answer("Нет добавленных аккаунтов для удаления.", reply_markup=keyboard)
-        session.close()
         return
     
     # Отправляем сообщение со списком аккаунтов для удаления
@@ -285,10 +304,9 @@ async def handle_delete_button(message: Message):
     )
     
     await message.answer("Нажмите на кнопку рядом с аккаунтом для удаления или вернитесь назад", reply_markup=keyboard_reply)
-    session.close()
 
 @dp.callback_query(lambda call: call.data.startswith("delete_account:"))
-async def delete_account_callback(call: CallbackQuery):
+async def delete_account_callback(call: CallbackQuery, session):
     print(f"Получен колбэк: {call.data}")
     if not is_admin(call.from_user.id):
         await call.answer("Недостаточно прав")
@@ -302,12 +320,10 @@ async def delete_account_callback(call: CallbackQuery):
     await call.message.edit_text(call.message.text + "\n\n🔄 Удаление аккаунта...", reply_markup=None)
     
     # Получаем информацию об аккаунте из базы данных
-    session = Session(bind=engine)
-    userbot = session.query(UserBot).filter(UserBot.id == userbot_id).first()
+    userbot = await session.get(UserBot, userbot_id)
     
     if not userbot:
         await call.message.edit_text(call.message.text + "\n\n❌ Ошибка: Аккаунт не найден в базе данных.")
-        session.close()
         return
     
     try:
@@ -318,24 +334,20 @@ async def delete_account_callback(call: CallbackQuery):
         
         # Удаляем файл из S3
         try:
-            s3 = boto3.client(
-                's3',
-                aws_access_key_id=AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                region_name=AWS_REGION
-            )
-            
             # Предполагаем, что URL имеет формат https://<bucket>.s3.<region>.amazonaws.com/sessions/<filename>
             session_key = f"sessions/{session_filename}"
             
             # Удаляем файл из S3
-            s3.delete_object(Bucket=AWS_BUCKET_NAME, Key=session_key)
+            await storage.delete(session_key)
             s3_deleted = True
             
         except Exception as e:
             s3_deleted = False
             print(f"Ошибка при удалении файла из S3: {e}")
         
+        # Удаляем закэшированную копию сессии
+        session_cache.invalidate(extract_session_name(session_filename))
+        
         # Удаляем локальный файл, если он существует
         if os.path.exists(local_path):
             try:
@@ -349,8 +361,8 @@ async def delete_account_callback(call: CallbackQuery):
             
         # Удаляем аккаунт из базы данных
         account_id = userbot.account_id
-        session.delete(userbot)
-        session.commit()
+        await session.delete(userbot)
+        await session.commit()
         db_deleted = True
         
         # Формируем сообщение об успешном удалении
@@ -368,11 +380,9 @@ async def delete_account_callback(call: CallbackQuery):
         await call.message.edit_text(
             call.message.text.split("\n\n")[0] + f"\n\n❌ Ошибка при удалении аккаунта: {str(e)}"
         )
-    finally:
-        session.close()
 
 @dp.callback_query(lambda call: call.data.startswith("check_session:"))
-async def check_session_callback(call: CallbackQuery):
+async def check_session_callback(call: CallbackQuery, session):
     print(f"Получен колбэк: {call.data}")
     if not is_admin(call.from_user.id):
         await call.answer("Недостаточно прав")
@@ -386,54 +396,31 @@ async def check_session_callback(call: CallbackQuery):
     await call.message.edit_text(call.message.text + "\n\n🔄 Проверка сессии...", reply_markup=None)
     
     # Получаем информацию о сессии из базы данных
-    session = Session(bind=engine)
-    userbot = session.query(UserBot).filter(UserBot.id == userbot_id).first()
+    userbot = await session.get(UserBot, userbot_id)
     
     if not userbot:
         await call.message.edit_text(call.message.text + "\n\n❌ Ошибка: Сессия не найдена в базе данных.")
-        session.close()
         return
     
     try:
-        # Загружаем сессию из S3
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION
-        )
-        
-        # Получаем имя файла из URL
-        session_filename = userbot.session_name.split("/")[-1]
-        local_path = f"adminbot/sessions/{session_filename}"
-        
-        # Ensure sessions directory exists
-        os.makedirs("adminbot/sessions", exist_ok=True)
-        
-        # Предполагаем, что URL имеет формат https://<bucket>.s3.<region>.amazonaws.com/sessions/<filename>
-        session_key = f"sessions/{session_filename}"
-        
-        # Загружаем файл
-        try:
-            # Define local_path before using it
-            local_path = f"adminbot/sessions/{session_filename}"
-            s3.download_file(AWS_BUCKET_NAME, session_key, local_path)
-        except Exception as e:
+        # Получаем файл сессии через общий кэш (скачивается из S3 только при изменении)
+        local_path = await session_cache.get(extract_session_name(userbot.session_name))
+        if not local_path:
             await call.message.edit_text(
-                call.message.text + f"\n\n❌ Ошибка загрузки файла сессии: {str(e)}"
+                call.message.text + "\n\n❌ Ошибка загрузки файла сессии: файл не найден в хранилище"
             )
-            session.close()
             return
         
         # Пробуем авторизоваться
-        client = TelegramClient(local_path.replace(".session", ""), api_id=1, api_hash="1")
+        account = extract_session_name(userbot.session_name)
+        client = TelegramClient(local_path[:-len(".session")], api_id=1, api_hash="1", flood_sleep_threshold=0)
         
         try:
             await client.connect()
             
             if await client.is_user_authorized():
                 # Получаем информацию о пользователе
-                me = await client.get_me()
+                me = await rpc_scheduler.call(account, 'default', lambda: client.get_me())
                 status = f"✅ Сессия действительна!\nИмя пользователя: {me.first_name}"
                 if me.username:
                     status += f"\nUsername: @{me.username}"
@@ -446,65 +433,11 @@ async def check_session_callback(call: CallbackQuery):
                 )
                 
                 try:
-                    # Тестовый канал для проверки возможности отправки сообщений
-                    test_chat_user = "SpamBot"  # Официальный бот для проверки статуса аккаунта
-                    
-                    try:
-                        # Пытаемся найти SpamBot в диалогах
-                        spam_bot = None
-                        dialogs = await client.get_dialogs(limit=100)
-                        for dialog in dialogs:
-                            if dialog.entity.username == test_chat_user:
-                                spam_bot = dialog.entity
-                                break
-                        
-                        # Если не нашли в диалогах, ищем по username
-                        if not spam_bot:
-                            spam_bot = await client.get_entity(test_chat_user)
-                        
-                        # Отправляем сообщение /start спам-боту
-                        await client.send_message(spam_bot, "/start")
-                        
-                        # Ждем ответа от спам-бота
-                        timeout = 5  # секунд
-                        start_time = asyncio.get_event_loop().time()
-                        spam_status = "⚠️ Статус блокировки неизвестен (не получен ответ от SpamBot)"
-                        
-                        # Ждем сообщения от SpamBot
-                        while (asyncio.get_event_loop().time() - start_time) < timeout:
-                            # Читаем последнее сообщение от SpamBot
-                            async for message in client.iter_messages(spam_bot, limit=1):
-                                if message.date.timestamp() > start_time:
-                                    # Если сообщение свежее (пришло после нашего запроса)
-                                    spam_message = message.text.lower()
-                                    
-                                    if "good news" in spam_message or "не ограничен" in spam_message:
-                                        spam_status = "✅ Аккаунт не заблокирован"
-                                    elif "спам" in spam_message or "spam" in spam_message:
-                                        spam_status = "❌ Обнаружены ограничения: возможен спам-блок"
-                                    else:
-                                        spam_status = f"⚠️ Ответ от SpamBot получен: {message.text[:100]}..."
-                                    
-                                    break
-                            
-                            # Если уже получили статус, выходим
-                            if spam_status != "⚠️ Статус блокировки неизвестен (не получен ответ от SpamBot)":
-                                break
-                                
-                            await asyncio.sleep(0.5)
-                            
-                        # Получаем дополнительные детали о SpamBot ответе, если доступны
-                        details = ""
-                        if "⚠️" not in spam_status:  # Если получили конкретный статус
-                            async for message in client.iter_messages(spam_bot, limit=1):
-                                if message.date.timestamp() > start_time:
-                                    details = f"\n\nДетали от SpamBot:\n{message.text}"
-                        
-                        status += f"\n\n👮‍♂️ Проверка спам-блока: {spam_status}{details}"
-                    except Exception as e:
-                        status += f"\n\n👮‍♂️ Проверка спам-блока: ⚠️ Ошибка при проверке: {str(e)}"
+                    spam_code, spam_text = await check_spambot(client, account)
+                    spam_status, details = format_spam_status(spam_code, spam_text)
+                    status += f"\n\n👮‍♂️ Проверка спам-блока: {spam_status}{details}"
                 except Exception as e:
-                    status += f"\n\n👮‍♂️ Проверка спам-блока: ⚠️ Невозможно проверить: {str(e)}"
+                    status += f"\n\n👮‍♂️ Проверка спам-блока: ⚠️ Ошибка при проверке: {str(e)}"
                 
                 # Обновляем сообщение с результатом
                 inline_kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -543,11 +476,9 @@ async def check_session_callback(call: CallbackQuery):
                 [InlineKeyboardButton(text="Проверить сессию снова", callback_data=f"check_session:{userbot_id}")]
             ])
         )
-    finally:
-        session.close()
 
 @dp.callback_query(lambda call: call.data.startswith("check_spam:"))
-async def check_spam_callback(call: CallbackQuery):
+async def check_spam_callback(call: CallbackQuery, session):
     print(f"Получен колбэк: {call.data}")
     if not is_admin(call.from_user.id):
         await call.answer("Недостаточно прав")
@@ -561,38 +492,24 @@ async def check_spam_callback(call: CallbackQuery):
     await call.message.edit_text(call.message.text + "\n\n🔄 Проверка на спам-блок...", reply_markup=None)
     
     # Получаем информацию о сессии из базы данных
-    session = Session(bind=engine)
-    userbot = session.query(UserBot).filter(UserBot.id == userbot_id).first()
+    userbot = await session.get(UserBot, userbot_id)
     
     if not userbot:
         await call.message.edit_text(call.message.text + "\n\n❌ Ошибка: Сессия не найдена в базе данных.")
-        session.close()
         return
     
     try:
-        # Загружаем сессию из S3
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION
-        )
-        
-        # Получаем имя файла из URL
-        session_filename = userbot.session_name.split("/")[-1]
-        
-        # Загружаем файл
-        try:
-            s3.download_file(AWS_BUCKET_NAME, session_key, local_path)
-        except Exception as e:
+        # Получаем файл сессии через общий кэш (скачивается из S3 только при изменении)
+        local_path = await session_cache.get(extract_session_name(userbot.session_name))
+        if not local_path:
             await call.message.edit_text(
-                call.message.text + f"\n\n❌ Ошибка загрузки файла сессии: {str(e)}"
+                call.message.text + "\n\n❌ Ошибка загрузки файла сессии: файл не найден в хранилище"
             )
-            session.close()
             return
         
         # Пробуем авторизоваться
-        client = TelegramClient(local_path.replace(".session", ""), api_id=1, api_hash="1")
+        account = extract_session_name(userbot.session_name)
+        client = TelegramClient(local_path[:-len(".session")], api_id=1, api_hash="1", flood_sleep_threshold=0)
         
         try:
             await client.connect()
@@ -600,79 +517,19 @@ async def check_spam_callback(call: CallbackQuery):
             if await client.is_user_authorized():
                 # Проверка на спам-блок
                 try:
-                    # Тестовый канал для проверки возможности отправки сообщений
-                    test_chat_user = "SpamBot"  # Официальный бот для проверки статуса аккаунта
+                    spam_code, spam_text = await check_spambot(client, account)
+                    spam_status, details = format_spam_status(spam_code, spam_text)
                     
-                    try:
-                        # Пытаемся найти SpamBot в диалогах
-                        spam_bot = None
-                        dialogs = await client.get_dialogs(limit=100)
-                        for dialog in dialogs:
-                            if dialog.entity.username == test_chat_user:
-                                spam_bot = dialog.entity
-                                break
-                        
-                        # Если не нашли в диалогах, ищем по username
-                        if not spam_bot:
-                            spam_bot = await client.get_entity(test_chat_user)
-                        
-                        # Отправляем сообщение /start спам-боту
-                        await client.send_message(spam_bot, "/start")
-                        
-                        # Ждем ответа от спам-бота
-                        timeout = 5  # секунд
-                        start_time = asyncio.get_event_loop().time()
-                        spam_status = "⚠️ Статус блокировки неизвестен (не получен ответ от SpamBot)"
-                        
-                        # Ждем сообщения от SpamBot
-                        while (asyncio.get_event_loop().time() - start_time) < timeout:
-                            # Читаем последнее сообщение от SpamBot
-                            async for message in client.iter_messages(spam_bot, limit=1):
-                                if message.date.timestamp() > start_time:
-                                    # Если сообщение свежее (пришло после нашего запроса)
-                                    spam_message = message.text.lower()
-                                    
-                                    if "good news" in spam_message or "не ограничен" in spam_message:
-                                        spam_status = "✅ Аккаунт не заблокирован"
-                                    elif "спам" in spam_message or "spam" in spam_message:
-                                        spam_status = "❌ Обнаружены ограничения: возможен спам-блок"
-                                    else:
-                                        spam_status = f"⚠️ Ответ от SpamBot получен: {message.text[:100]}..."
-                                    
-                                    break
-                            
-                            # Если уже получили статус, выходим
-                            if spam_status != "⚠️ Статус блокировки неизвестен (не получен ответ от SpamBot)":
-                                break
-                                
-                            await asyncio.sleep(0.5)
-                        
-                        # Получаем дополнительные детали о SpamBot ответе, если доступны
-                        details = ""
-                        if "⚠️" not in spam_status:  # Если получили конкретный статус
-                            async for message in client.iter_messages(spam_bot, limit=1):
-                                if message.date.timestamp() > start_time:
-                                    details = f"\n\nДетали от SpamBot:\n{message.text}"
-                        
-                        # Обновляем сообщение с результатом
-                        inline_kb = InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="Проверить сессию полностью", callback_data=f"check_session:{userbot_id}")],
-                            [InlineKeyboardButton(text="Проверить спам-блок снова", callback_data=f"check_spam:{userbot_id}")]
-                        ])
-                        
-                        await call.message.edit_text(
-                            call.message.text.split("\n\n🔄")[0] + f"\n\n👮‍♂️ Результат проверки: {spam_status}{details}",
-                            reply_markup=inline_kb
-                        )
-                        
-                    except Exception as e:
-                        await call.message.edit_text(
-                            call.message.text.split("\n\n🔄")[0] + f"\n\n❌ Ошибка при проверке спам-блока: {str(e)}",
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                                [InlineKeyboardButton(text="Проверить сессию полностью", callback_data=f"check_session:{userbot_id}")],
-                                [InlineKeyboardButton(text="Проверить спам-блок снова", callback_data=f"check_spam:{userbot_id}")]
-                            ])
-                        )
+                    # Обновляем сообщение с результатом
+                    inline_kb = InlineKeyboardMarkup(inline_keyboard=[
+                        [InlineKeyboardButton(text="Проверить сессию полностью", callback_data=f"check_session:{userbot_id}")],
+                        [InlineKeyboardButton(text="Проверить спам-блок снова", callback_data=f"check_spam:{userbot_id}")]
+                    ])
+                    
+                    await call.message.edit_text(
+                        call.message.text.split("\n\n🔄")[0] + f"\n\n👮‍♂️ Результат проверки: {spam_status}{details}",
+                        reply_markup=inline_kb
+                    )
                 except Exception as e:
                     await call.message.edit_text(
                         call.message.text.split("\n\n🔄")[0] + f"\n\n❌ Ошибка при проверке спам-блока: {str(e)}",
@@ -710,8 +567,6 @@ async def check_spam_callback(call: CallbackQuery):
                 [InlineKeyboardButton(text="Проверить спам-блок снова", callback_data=f"check_spam:{userbot_id}")]
             ])
         )
-    finally:
-        session.close()
 
 async def main():
     await dp.start_polling(bot)
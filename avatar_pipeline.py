@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Подготовка аватарок юзерботов без записи на диск.
+
+Фото из Bot API скачивается в память, приводится к квадрату размера
+профильного фото Telegram и пережимается в JPEG. Результат адресуется
+хешем содержимого: одинаковые картинки для одного аккаунта повторно
+используют уже загруженный InputFile вместо новой загрузки.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+
+from PIL import Image, ImageOps
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Размер стороны профильного фото Telegram и качество JPEG
+AVATAR_SIZE = int(os.environ.get('AVATAR_SIZE', '640'))
+AVATAR_JPEG_QUALITY = int(os.environ.get('AVATAR_JPEG_QUALITY', '87'))
+
+# Загруженные части файла хранятся на серверах Telegram ограниченное время,
+# поэтому InputFile переиспользуется только в течение этого срока
+UPLOADED_AVATAR_TTL = int(os.environ.get('UPLOADED_AVATAR_TTL', '3600'))
+UPLOADED_AVATAR_MAX_ENTRIES = 1000
+
+
+async def download_photo(bot, photo):
+    """
+    Скачивает фото из Bot API в память.
+
+    Args:
+        bot (Bot): Экземпляр aiogram Bot
+        photo (PhotoSize | str): Фото из сообщения или его file_id
+
+    Returns:
+        bytes: Содержимое файла
+    """
+    buffer = io.BytesIO()
+    await bot.download(getattr(photo, 'file_id', photo), destination=buffer)
+    return buffer.getvalue()
+
+
+def normalize_avatar(data):
+    """
+    Обрезает изображение до квадрата по центру, уменьшает до AVATAR_SIZE и пережимает в JPEG.
+
+    Args:
+        data (bytes): Исходное изображение
+
+    Returns:
+        bytes: JPEG для загрузки в профиль
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        side = min(image.size)
+        size = min(side, AVATAR_SIZE)
+        image = ImageOps.fit(image, (size, size), method=Image.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=AVATAR_JPEG_QUALITY, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def content_hash(data):
+    """Хеш содержимого для адресации аватарки."""
+    return hashlib.sha256(data).hexdigest()
+
+
+async def prepare_avatar(data):
+    """
+    Нормализует изображение в отдельном потоке, чтобы не блокировать цикл событий.
+
+    Args:
+        data (bytes): Исходное изображение
+
+    Returns:
+        tuple: (JPEG, хеш содержимого JPEG)
+    """
+    jpeg = await asyncio.to_thread(normalize_avatar, data)
+    return jpeg, content_hash(jpeg)
+
+
+# Загруженные в Telegram аватарки: (аккаунт, хеш) -> InputFile
+uploaded_avatars = TTLCache(UPLOADED_AVATAR_TTL, max_entries=UPLOADED_AVATAR_MAX_ENTRIES)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Операции с балансом пользователей.
+
+Каждое изменение баланса - это одна атомарная инструкция UPDATE над
+users.balance и запись в журнал balance_transactions в той же транзакции.
+Списание выполняется условием balance >= сумма прямо в UPDATE, поэтому
+параллельные нажатия не теряют обновления и не уводят баланс в минус.
+Ключ идемпотентности (уникальный в журнале) не дает провести одну и ту же
+операцию дважды, например при повторной доставке обновления.
+"""
+import logging
+import os
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as SyncSession
+
+from database.models import BalanceTransaction, User
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Закэшированный баланс для экранов, где он только отображается
+BALANCE_CACHE_TTL = int(os.environ.get('BALANCE_CACHE_TTL', '60'))
+balance_cache = TTLCache(BALANCE_CACHE_TTL)
+
+
+class InsufficientFundsError(Exception):
+    """На балансе недостаточно средств для списания."""
+
+
+class DuplicateTransactionError(Exception):
+    """Операция с этим ключом идемпотентности уже проведена."""
+
+
+def callback_idempotency_key(callback, kind):
+    """
+    Ключ идемпотентности для операции, вызванной нажатием инлайн-кнопки.
+
+    Ключ строится по сообщению с кнопкой, поэтому и повторная доставка
+    того же callback-запроса, и повторное нажатие той же кнопки дают один ключ.
+
+    Args:
+        callback (CallbackQuery): Callback-запрос aiogram
+        kind (str): Тип операции
+
+    Returns:
+        str: Ключ идемпотентности
+    """
+    if callback.message:
+        return f"{kind}:{callback.message.chat.id}:{callback.message.message_id}"
+    return f"{kind}:{callback.id}"
+
+
+async def _apply(session, user_id, amount, kind, idempotency_key, condition=None):
+    statement = update(User).where(User.telegram_id == user_id)
+    if condition is not None:
+        statement = statement.where(condition)
+    statement = statement.values(balance=User.balance + amount).returning(User.balance)
+
+    try:
+        # Точка сохранения: при повторном ключе изменение баланса откатывается вместе с записью журнала
+        async with session.begin_nested():
+            balance = (await session.execute(statement)).scalar()
+            if balance is None:
+                return None
+            await session.execute(insert(BalanceTransaction).values(
+                user_id=user_id,
+                amount=amount,
+                kind=kind,
+                idempotency_key=idempotency_key,
+                balance_after=balance
+            ))
+    except IntegrityError:
+        raise DuplicateTransactionError(idempotency_key)
+
+    invalidate_balance(session, user_id)
+    return balance
+
+
+async def debit(session, user_id, amount, kind, idempotency_key=None):
+    """
+    Списывает средства одним условным UPDATE.
+
+    Args:
+        session (AsyncSession): Сессия базы данных текущего обновления
+        user_id (int): Telegram ID пользователя
+        amount (float): Сумма списания
+        kind (str): Тип операции для журнала
+        idempotency_key (str, optional): Ключ идемпотентности
+
+    Returns:
+        float: Баланс после списания
+
+    Raises:
+        InsufficientFundsError: Если средств недостаточно или пользователь не найден
+        DuplicateTransactionError: Если операция с этим ключом уже проведена
+    """
+    balance = await _apply(session, user_id, -amount, kind, idempotency_key, User.balance >= amount)
+    if balance is None:
+        raise InsufficientFundsError(user_id)
+    logger.info(f"Списано {amount} с баланса пользователя {user_id} ({kind}), остаток {balance}")
+    return balance
+
+
+async def credit(session, user_id, amount, kind, idempotency_key=None):
+    """
+    Зачисляет средства на баланс.
+
+    Returns:
+        float: Баланс после зачисления или None, если пользователь не найден
+
+    Raises:
+        DuplicateTransactionError: Если операция с этим ключом уже проведена
+    """
+    balance = await _apply(session, user_id, amount, kind, idempotency_key)
+    if balance is not None:
+        logger.info(f"Зачислено {amount} на баланс пользователя {user_id} ({kind}), остаток {balance}")
+    return balance
+
+
+async def get_balance(session, user_id):
+    """
+    Возвращает баланс пользователя, по возможности из кэша.
+
+    Returns:
+        float: Баланс или None, если пользователь не найден
+    """
+    balance = balance_cache.get(user_id)
+    if balance is None:
+        balance = await session.scalar(select(User.balance).where(User.telegram_id == user_id))
+        if balance is not None:
+            balance_cache.set(user_id, balance)
+    return balance
+
+
+def remember_balance(user_id, balance):
+    """Кэширует баланс, уже прочитанный из базы данных."""
+    balance_cache.set(user_id, balance)
+
+
+def invalidate_balance(session, user_id):
+    """
+    Сбрасывает закэшированный баланс сейчас и повторно после фиксации транзакции,
+    чтобы параллельное чтение не вернуло в кэш значение до фиксации.
+    """
+    balance_cache.pop(user_id)
+    session.sync_session.info.setdefault('invalidated_balances', set()).add(user_id)
+
+
+@event.listens_for(SyncSession, 'after_commit')
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop('invalidated_balances', ()):
+        balance_cache.pop(user_id)
@@ -3,7 +3,6 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKe
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 import asyncio
 import os
 import random
@@ -28,24 +27,51 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from database.db import Session
+from database.db import AsyncSession
+from database.middleware import DbSessionMiddleware
 from database.models import User, Campaign, UserBot
-from sqlalchemy import and_, or_, not_, func
+from sqlalchemy import and_, or_, not_, select
+from sqlalchemy.orm import joinedload
 import io
 import re
-import tempfile
 
 # Добавляем родительскую директорию в путь, чтобы можно было импортировать модули
-from userbot_manager import update_bot_profile, check_channel_admin, add_channel_to_profile, check_userbot_availability
+from userbot_manager import update_bot_profile, check_channel_admin, add_channel_to_profile, check_userbot_availability, client_pool
+from health_monitor import run_health_monitor
+from campaign_sweeper import run_campaign_sweeper
+from rpc_scheduler import rpc_scheduler
+from avatar_pipeline import download_photo, prepare_avatar
+from ttl_cache import TTLCache
+from job_queue import enqueue, job_handler, run_job_workers, RetryJob
+from userbot_prewarm import prewarmer
+from fsm_storage import create_storage
+from balance_ledger import (
+    debit, credit, get_balance, remember_balance, callback_idempotency_key,
+    InsufficientFundsError, DuplicateTransactionError
+)
+from userbot_allocator import (
+    claim_userbot, confirm_userbot, leased_userbot, release_userbot, run_lease_reaper, LeaseRenewalMiddleware
+)
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+HEALTH_MONITOR_ENABLED = os.getenv("HEALTH_MONITOR_ENABLED", "1") == "1"
+CAMPAIGN_SWEEPER_ENABLED = os.getenv("CAMPAIGN_SWEEPER_ENABLED", "1") == "1"
+CAMPAIGNS_PAGE_SIZE = int(os.getenv("CAMPAIGNS_PAGE_SIZE", "5"))
+
+# Кэш отрисованных страниц "Мои кампании", сбрасывается при изменении кампаний пользователя
+campaign_pages = TTLCache(300)
 
-# Создание FSM хранилища и диспетчера
-storage = MemoryStorage()
+# Создание FSM хранилища (выбирается FSM_STORAGE, по умолчанию в базе данных) и диспетчера
+storage = create_storage()
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher(storage=storage)
 
+# Одна сессия базы данных на обновление; аренда юзербота, пока пользователь
+# проходит мастер создания кампании, продлевается в той же транзакции
+dp.update.outer_middleware(DbSessionMiddleware())
+dp.update.outer_middleware(LeaseRenewalMiddleware())
+
 # Создаем основную клавиатуру
 def get_main_keyboard():
     keyboard = ReplyKeyboardMarkup(
@@ -84,6 +110,20 @@ def get_confirmation_keyboard():
     )
     return keyboard
 
+# Клавиатура шага добавления бота в канал
+def get_channel_keyboard():
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="Я добавил бота как администратора", callback_data="check_admin")
+            ],
+            [
+                InlineKeyboardButton(text="Отмена", callback_data="cancel")
+            ]
+        ]
+    )
+    return keyboard
+
 # Состояния для создания кампании
 class CampaignStates(StatesGroup):
     # Начальное состояние
@@ -98,13 +138,14 @@ class CampaignStates(StatesGroup):
     waiting_for_channel_confirmation = State()
     # Финальное подтверждение
     waiting_for_final_confirmation = State()
+    # Шаг мастера выполняется фоновым заданием
+    waiting_for_job = State()
 
 # Функция для регистрации пользователя
-async def register_user(user_id: int, username: str = None) -> User:
-    session = Session()
+async def register_user(session, user_id: int, username: str = None) -> User:
     try:
         # Проверяем, существует ли уже пользователь
-        user = session.query(User).filter(User.telegram_id == user_id).first()
+        user = await session.scalar(select(User).where(User.telegram_id == user_id))
         
         if not user:
             # Создаем нового пользователя
@@ -114,9 +155,12 @@ async def register_user(user_id: int, username: str = None) -> User:
                 balance=0.0
             )
             session.add(user)
-            session.commit()
+            await session.flush()
             logger.info(f"Новый пользователь зарегистрирован: {user_id}, {username}")
         
+        # Баланс уже прочитан, поэтому сразу кладем его в кэш
+        remember_balance(user_id, user.balance)
+        
         # Копируем нужные атрибуты вместо возврата самого объекта
         user_data = {
             'telegram_id': user.telegram_id,
@@ -128,78 +172,54 @@ async def register_user(user_id: int, username: str = None) -> User:
         return user_data
     except Exception as e:
         logger.error(f"Ошибка при регистрации пользователя: {e}")
-        session.rollback()
+        await session.rollback()
         return None
-        session.close()
 
 # Вспомогательная функция для получения баланса пользователя
-async def get_user_balance(user_id: int) -> float:
-    session = Session()
+async def get_user_balance(session, user_id: int) -> float:
     try:
-        user = session.query(User).filter(User.telegram_id == user_id).first()
-        if user:
-            return user.balance
+        balance = await get_balance(session, user_id)
+        if balance is not None:
+            return balance
         return 0.0
     except Exception as e:
         logger.error(f"Ошибка при получении баланса пользователя: {e}")
         return 0.0
-    finally:
-        session.close()
 
-# Функция для добавления баланса (для тестирования)
-async def add_balance(user_id: int, amount: float) -> bool:
-    session = Session()
+# Функция для зачисления средств на баланс (пополнение или возврат)
+async def add_balance(session, user_id: int, amount: float, kind: str = "topup", idempotency_key: str = None) -> bool:
     try:
-        user = session.query(User).filter(User.telegram_id == user_id).first()
-        if user:
-            user.balance += amount
-            session.commit()
-            return True
-        return Falseкрутой0гурец
-    
+        return await credit(session, user_id, amount, kind, idempotency_key) is not None
+    except DuplicateTransactionError:
+        # Операция уже проведена (повторное нажатие кнопки)
+        return True
     except Exception as e:
         print(f"Ошибка при пополнении баланса: {e}")
-        session.rollback()
         return False
-    finally:
-        session.close()
-
-# Функция для поиска свободного юзербота
-async def get_free_userbot():
-    session = Session()
-    try:
-        free_userbot = session.query(UserBot).filter(UserBot.isoccupied == False).order_by(func.random()).first()
-        return free_userbot
-    except Exception as e:
-        print(f"Ошибка при поиске свободного юзербота: {e}")
-        return None
-    finally:
-        session.close()
 
-# Функция для обновления статуса юзербота
-async def update_userbot_status(bot_id: int, is_occupied: bool, new_name: str = None):
-    session = Session()
+# Функция для обновления статуса юзербота (is_occupied=None - статус не меняется)
+async def update_userbot_status(session, bot_id: int, is_occupied: bool = None, new_name: str = None):
     try:
-        userbot = session.query(UserBot).filter(UserBot.id == bot_id).first()
+        userbot = await session.get(UserBot, bot_id)
         if userbot:
-            userbot.isoccupied = is_occupied
+            if is_occupied is not None:
+                userbot.isoccupied = is_occupied
             if new_name:
                 # Обновляем display_name вместо session_name
                 userbot.display_name = new_name
-            session.commit()
+            await session.flush()
             return True
         return False
     except Exception as e:
         print(f"Ошибка при обновлении статуса юзербота: {e}")
-        session.rollback()
+        await session.rollback()
         return False
-    finally:
-        session.close()
 
 @dp.message(CommandStart())
-async def start_cmd(message: Message):
+async def start_cmd(message: Message, session):
     # Регистрируем пользователя или получаем существующего
     user_data = await register_user(
+        session,
         user_id=message.from_user.id,
         username=message.from_user.username
     )
@@ -210,29 +230,29 @@ async def start_cmd(message: Message):
     )
     
     if user_data:
-        welcome_text += f"Ваш баланс: {user_data['balance']} руб.\n"
+        welcome_text += f"Ваш баланс: {await get_user_balance(session, message.from_user.id)} руб.\n"
     
     await message.answer(welcome_text, reply_markup=get_main_keyboard())
 
 # Команда для создания новой кампании
 @dp.message(Command("new_campaign"))
-async def new_campaign_cmd(message: Message, state: FSMContext):
-    # Получаем доступный (свободный) юзербот
-    free_userbot = await get_free_userbot()
+async def new_campaign_cmd(message: Message, state: FSMContext, session):
+    # Закрепляем за пользователем свободный юзербот (аренда продлевается, пока идет мастер)
+    free_userbot = await claim_userbot(session, message.from_user.id)
     
     if not free_userbot:
         await message.answer("К сожалению, сейчас нет доступных ботов для создания новой кампании. Попробуйте позже.")
         return
     
-    # Сохраняем информацию о выбранном юзерботе
-    await state.update_data(userbot_id=free_userbot.id, userbot_username=free_userbot.session_name)
+    # Пока пользователь оплачивает, в фоне подключаем бота и при необходимости меняем его на рабочего.
+    # Бот мастера хранится только в аренде, поэтому замена не зависит от данных FSM
+    prewarmer.start(message.from_user.id, free_userbot.id)
     
     # Стоимость недельной подписки
     campaign_cost = 10.0
     
-    # Получаем данные текущего пользователя
-    session = Session()
-    user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
+    # Получаем баланс текущего пользователя
+    balance = await get_user_balance(session, message.from_user.id)
     
     payment_keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -240,17 +260,16 @@ async def new_campaign_cmd(message: Message, state: FSMContext):
         ]
     )
     
-    if user and user.balance >= campaign_cost:
+    if balance >= campaign_cost:
         # У пользователя достаточно денег на балансе
         await message.answer(
             f"Для создания кампании на неделю требуется оплата 10₽.\n"
-            f"На вашем балансе: {user.balance}₽\n\n"
+            f"На вашем балансе: {balance}₽\n\n"
             f"Нажмите кнопку ниже для оплаты:",
             reply_markup=payment_keyboard
         )
     else:
         # Недостаточно средств
-        balance = user.balance if user else 0
         await message.answer(
             f"Для создания кампании на неделю требуется 10₽.\n"
             f"На вашем балансе: {balance}₽\n"
@@ -259,50 +278,41 @@ async def new_campaign_cmd(message: Message, state: FSMContext):
             reply_markup=payment_keyboard
         )
     
-    session.close()
     await state.set_state(CampaignStates.waiting_for_payment)
 
 # Обработка оплаты кампании
 @dp.callback_query(F.data == "pay_campaign", CampaignStates.waiting_for_payment)
-async def process_payment(callback: CallbackQuery, state: FSMContext):
+async def process_payment(callback: CallbackQuery, state: FSMContext, session):
     user_id = callback.from_user.id
     campaign_cost = 10.0
     
-    # Получаем данные пользователя
-    session = Session()
-    user = session.query(User).filter(User.telegram_id == user_id).first()
-    
-    if not user:
-        await callback.message.answer("Произошла ошибка при обработке платежа. Пользователь не найден.")
-        await callback.answer()
-        await state.clear()
+    # Списываем средства одним атомарным запросом; ключ защищает от повторного списания
+    payment_key = callback_idempotency_key(callback, "campaign")
+    try:
+        try:
+            await debit(session, user_id, campaign_cost, "campaign", payment_key)
+        except InsufficientFundsError:
+            # Демо-режим: пополняем баланс
+            if await credit(session, user_id, campaign_cost, "topup", callback_idempotency_key(callback, "topup")) is None:
+                await callback.message.answer("Произошла ошибка при обработке платежа. Пользователь не найден.")
+                await callback.answer()
+                await state.clear()
+                return
+            await callback.message.answer(f"Баланс пополнен на {campaign_cost}₽ (демо-режим)")
+            await debit(session, user_id, campaign_cost, "campaign", payment_key)
+    except DuplicateTransactionError:
+        # Повторное нажатие кнопки оплаты: платеж уже проведен
+        await callback.answer("Оплата уже проведена")
         return
     
-    # Проверяем баланс
-    if user.balance < campaign_cost:
-        # Демо-режим: пополняем баланс
-        await add_balance(user_id, campaign_cost)
-        user = session.query(User).filter(User.telegram_id == user_id).first()
-        await callback.message.answer(f"Баланс пополнен на {campaign_cost}₽ (демо-режим)")
-    
-    # Списываем средства
-    user.balance -= campaign_cost
-    session.commit()
-    
     # Устанавливаем дату окончания кампании (неделя)
     paid_until = datetime.now() + timedelta(days=7)
     await state.update_data(paid_until=paid_until)
     
-    # Обновляем юзербот как занятый
-    data = await state.get_data()
-    userbot_id = data.get("userbot_id")
-    await update_userbot_status(userbot_id, True)
-    
     # Переходим к следующему шагу
     await callback.message.answer("Оплата прошла успешно! Теперь давайте настроим вашу кампанию.")
     await callback.message.answer("Введите название вашей кампании (оно будет видно только вам):")
     
-    session.close()
     await callback.answer()
     await state.set_state(CampaignStates.waiting_for_name)
 
@@ -346,7 +356,7 @@ async def process_campaign_target(message: Message, state: FSMContext):
 
 # Обработка ввода имени бота
 @dp.message(CampaignStates.waiting_for_bot_name)
-async def process_bot_name(message: Message, state: FSMContext):
+async def process_bot_name(message: Message, state: FSMContext, session):
     bot_name = message.text.strip()
     
     # Проверяем длину имени
@@ -356,74 +366,20 @@ async def process_bot_name(message: Message, state: FSMContext):
         )
         return
     
-    # Получаем ID юзербота из состояния
-    data = await state.get_data()
-    userbot_id = data["userbot_id"]
-    
     # Сохраняем имя бота
     await state.update_data(bot_name=bot_name)
     
-    # Проверяем доступность юзербота
-    is_available = await check_userbot_availability(userbot_id)
-    if not is_available:
-        await message.answer(
-            "Произошла ошибка при подключении к боту. Пожалуйста, попробуйте позже или выберите другого бота.",
-            reply_markup=get_main_keyboard()
-        )
-        # Освобождаем юзербота
-        await update_userbot_status(userbot_id, False)
-        # Возвращаем к начальному состоянию
-        await state.clear()
-        return
-    
-    # Изменяем имя юзербота через Telethon API
-    success = await update_bot_profile(userbot_id, first_name=bot_name)
-    if not success:
-        await message.answer(
-            "Произошла ошибка при изменении имени бота. Пожалуйста, попробуйте другое имя:"
-        )
-        return
-    
-    # Обновляем имя бота в базе данных
-    await update_userbot_status(userbot_id, True, bot_name)
-    
-    # Переходим к загрузке аватара
-    await message.answer(
-        "Отлично! Теперь отправьте фотографию для аватара бота:"
-    )
-    
-    await state.set_state(CampaignStates.waiting_for_bot_avatar)
+    # Проверка бота и смена имени через Telethon выполняются в фоне
+    await enqueue_wizard_job(message, state, session, "set_bot_name", "⏳ Подключаемся к боту и меняем имя...",
+                             {"bot_name": bot_name})
 
 # Обработка загрузки аватарки
 @dp.message(F.photo, CampaignStates.waiting_for_bot_avatar)
-async def process_bot_avatar(message: Message, state: FSMContext):
-    data = await state.get_data()
-    userbot_id = data["userbot_id"]
-    
-    # Скачиваем фотографию во временный файл
+async def process_bot_avatar(message: Message, state: FSMContext, session):
+    # Скачивание, подготовка и установка аватара выполняются в фоне
     photo = message.photo[-1]  # Берем самое большое разрешение
-    
-    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-        await bot.download(photo.file_id, destination=temp_file.name)
-        temp_path = temp_file.name
-    
-    try:
-        # Применяем аватарку к юзерботу через Telethon API
-        success = await update_bot_profile(userbot_id, photo_path=temp_path)
-        
-        if success:
-            await message.answer(
-                "Аватар успешно установлен! Теперь введите описание профиля бота (без ссылок):"
-            )
-            await state.set_state(CampaignStates.waiting_for_bot_description)
-        else:
-            await message.answer(
-                "Произошла ошибка при установке аватара. Пожалуйста, попробуйте другое изображение:"
-            )
-    finally:
-        # Удаляем временный файл
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
+    await enqueue_wizard_job(message, state, session, "set_bot_avatar", "⏳ Устанавливаем аватар...",
+                             {"file_id": photo.file_id})
 
 # Обработка неправильного формата аватарки
 @dp.message(CampaignStates.waiting_for_bot_avatar)
@@ -432,7 +388,7 @@ async def wrong_avatar_format(message: Message):
 
 # Обработка ввода описания бота
 @dp.message(CampaignStates.waiting_for_bot_description)
-async def process_bot_description(message: Message, state: FSMContext):
+async def process_bot_description(message: Message, state: FSMContext, session):
     description = message.text.strip()
     
     # Проверяем наличие ссылок
@@ -452,47 +408,9 @@ async def process_bot_description(message: Message, state: FSMContext):
     # Сохраняем описание
     await state.update_data(bot_description=description)
     
-    # Получаем данные о юзерботе
-    data = await state.get_data()
-    userbot_id = data["userbot_id"]
-    
-    # Обновляем описание юзербота через Telethon API
-    success = await update_bot_profile(userbot_id, bio=description)
-    
-    if not success:
-        await message.answer(
-            "Произошла ошибка при обновлении описания бота. Пожалуйста, попробуйте другое описание:"
-        )
-        return
-    
-    # Получаем актуальную информацию о боте из БД
-    session = Session()
-    userbot = session.query(UserBot).filter(UserBot.id == userbot_id).first()
-    session.close()
-    
-    # Запрашиваем добавление бота в канал
-    await message.answer(
-        f"Отлично! Теперь вам нужно:\n\n"
-        f"1. Создать новый канал в Telegram\n"
-        f"2. Добавить в описание канала ссылку на ваш основной канал\n"
-        f"3. Добавить нашего бота @{userbot.session_name} как администратора канала\n\n"
-        f"После этого введите @username вашего нового канала и нажмите кнопку 'Подтвердить':"
-    )
-    
-    # Создаем клавиатуру для ввода канала
-    channel_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="Я добавил бота как администратора", callback_data="check_admin")
-            ],
-            [
-                InlineKeyboardButton(text="Отмена", callback_data="cancel")
-            ]
-        ]
-    )
-    
-    await message.answer("Когда добавите бота как администратора, нажмите кнопку:", reply_markup=channel_keyboard)
-    await state.set_state(CampaignStates.waiting_for_channel_confirmation)
+    # Описание профиля обновляется в фоне
+    await enqueue_wizard_job(message, state, session, "set_bot_description", "⏳ Обновляем описание бота...",
+                             {"description": description})
 
 # Обработка подтверждения добавления бота в канал
 @dp.callback_query(F.data == "confirm", CampaignStates.waiting_for_channel_confirmation)
@@ -520,10 +438,9 @@ async def confirm_channel_setup(callback: CallbackQuery, state: FSMContext):
 
 # Обработка отмены на этапе добавления бота в канал
 @dp.callback_query(F.data == "cancel", CampaignStates.waiting_for_channel_confirmation)
-async def cancel_channel_setup(callback: CallbackQuery, state: FSMContext):
+async def cancel_channel_setup(callback: CallbackQuery, state: FSMContext, session):
     # Освобождаем юзербота
-    data = await state.get_data()
-    await update_userbot_status(data["userbot_id"], False)
+    await release_wizard_userbot(session, callback.from_user.id)
     
     await callback.message.answer(
         "Создание кампании отменено. Ваши средства будут возвращены на баланс.",
@@ -531,30 +448,45 @@ async def cancel_channel_setup(callback: CallbackQuery, state: FSMContext):
     )
     
     # Возвращаем деньги на баланс
-    await add_balance(callback.from_user.id, 10.0)
+    await add_balance(session, callback.from_user.id, 10.0, "refund", callback_idempotency_key(callback, "refund"))
     
     await callback.answer()
     await state.clear()
 
 # Финальное подтверждение и создание кампании
 @dp.callback_query(F.data == "confirm", CampaignStates.waiting_for_final_confirmation)
-async def create_campaign(callback: CallbackQuery, state: FSMContext):
+async def create_campaign(callback: CallbackQuery, state: FSMContext, session):
     # Получаем все данные из состояния
     data = await state.get_data()
     
+    # Бот становится занятым только сейчас; если аренда истекла и его забрали, кампанию не создаем
+    await prewarmer.wait(callback.from_user.id)
+    userbot = await leased_userbot(session, callback.from_user.id)
+    if userbot is None or not await confirm_userbot(session, userbot.id, callback.from_user.id):
+        await callback.message.answer(
+            "Время на настройку кампании истекло, и бот был передан другому пользователю. "
+            "Ваши средства будут возвращены на баланс. Создайте кампанию заново: /new_campaign",
+            reply_markup=get_main_keyboard()
+        )
+        await add_balance(session, callback.from_user.id, 10.0, "refund", callback_idempotency_key(callback, "refund"))
+        await callback.answer()
+        await state.clear()
+        return
+    
     # Создаем запись в БД
-    session = Session()
     try:
         new_campaign = Campaign(
             creator_id=callback.from_user.id,
             name=data["campaign_name"],
-            bot_id=data["userbot_id"],
+            bot_id=userbot.id,
             paid_until=data["paid_until"],
             target=data["target"]
         )
         
         session.add(new_campaign)
-        session.commit()
+        # Фиксируем кампанию до сообщения пользователю об успехе
+        await session.commit()
+        invalidate_campaign_pages(callback.from_user.id)
         
         await callback.message.answer(
             "🎉 Отлично! Ваша кампания успешно создана и запущена!\n"
@@ -564,10 +496,11 @@ async def create_campaign(callback: CallbackQuery, state: FSMContext):
         )
     except Exception as e:
         print(f"Ошибка при создании кампании: {e}")
-        session.rollback()
+        # Откат отменяет и пометку бота занятым
+        await session.rollback()
         
         # Освобождаем юзербота
-        await update_userbot_status(data["userbot_id"], False)
+        await release_userbot(session, userbot.id, callback.from_user.id)
         
         await callback.message.answer(
             "Произошла ошибка при создании кампании. Ваши средства будут возвращены на баланс.",
@@ -575,19 +508,16 @@ async def create_campaign(callback: CallbackQuery, state: FSMContext):
         )
         
         # Возвращаем деньги на баланс
-        await add_balance(callback.from_user.id, 10.0)
-    finally:
-        session.close()
+        await add_balance(session, callback.from_user.id, 10.0, "refund", callback_idempotency_key(callback, "refund"))
     
     await callback.answer()
     await state.clear()
 
 # Отмена на последнем этапе
 @dp.callback_query(F.data == "cancel", CampaignStates.waiting_for_final_confirmation)
-async def cancel_final_confirmation(callback: CallbackQuery, state: FSMContext):
+async def cancel_final_confirmation(callback: CallbackQuery, state: FSMContext, session):
     # Освобождаем юзербота
-    data = await state.get_data()
-    await update_userbot_status(data["userbot_id"], False)
+    await release_wizard_userbot(session, callback.from_user.id)
     
     await callback.message.answer(
         "Создание кампании отменено. Ваши средства будут возвращены на баланс.",
@@ -595,57 +525,102 @@ async def cancel_final_confirmation(callback: CallbackQuery, state: FSMContext):
     )
     
     # Возвращаем деньги на баланс
-    await add_balance(callback.from_user.id, 10.0)
+    await add_balance(session, callback.from_user.id, 10.0, "refund", callback_idempotency_key(callback, "refund"))
     
     await callback.answer()
     await state.clear()
 
+# Страница списка кампаний пользователя: (текст, инлайн-клавиатура или None)
+async def render_campaigns_page(session, user_id: int, direction: str = "next", cursor: int = None):
+    cache_key = (user_id, direction, cursor)
+    page = campaign_pages.get(cache_key)
+    if page is not None:
+        return page
+    
+    # Keyset-пагинация по id (сначала новые): одна выборка кампаний вместе с ботами
+    query = select(Campaign).options(joinedload(Campaign.bot)).where(Campaign.creator_id == user_id)
+    if direction == "prev" and cursor is not None:
+        query = query.where(Campaign.id > cursor).order_by(Campaign.id.asc())
+    else:
+        if cursor is not None:
+            query = query.where(Campaign.id < cursor)
+        query = query.order_by(Campaign.id.desc())
+    
+    # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+    campaigns = list((await session.scalars(query.limit(CAMPAIGNS_PAGE_SIZE + 1))).all())
+    has_more = len(campaigns) > CAMPAIGNS_PAGE_SIZE
+    campaigns = campaigns[:CAMPAIGNS_PAGE_SIZE]
+    if direction == "prev" and cursor is not None:
+        campaigns.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = cursor is not None, has_more
+    
+    if not campaigns:
+        page = ("У вас пока нет активных кампаний. Чтобы создать кампанию, напишите /new_campaign", None)
+        campaign_pages.set(cache_key, page)
+        return page
+    
+    # Формируем текст с информацией о кампаниях
+    campaigns_text = "Ваши кампании:\n\n"
+    
+    for campaign in campaigns:
+        bot_name = campaign.bot.session_name if campaign.bot else "Неизвестный бот"
+        
+        # Форматируем дату окончания оплаты
+        paid_until_str = campaign.paid_until.strftime("%d.%m.%Y") if campaign.paid_until else "Не оплачено"
+        
+        campaigns_text += (
+            f"{campaign.id}. {campaign.name}\n"
+            f"   Бот: {bot_name}\n"
+            f"   Цель: {campaign.target}\n"
+            f"   Оплачено до: {paid_until_str}\n\n"
+        )
+    
+    campaigns_text += "Для управления кампанией, напишите /campaign_{id}, где {id} - номер кампании."
+    
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"campaigns:prev:{campaigns[0].id}"))
+    if has_older:
+        buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"campaigns:next:{campaigns[-1].id}"))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    
+    page = (campaigns_text, keyboard)
+    campaign_pages.set(cache_key, page)
+    return page
+
+# Сбрасывает закэшированные страницы списка кампаний пользователя
+def invalidate_campaign_pages(user_id: int):
+    campaign_pages.pop_where(lambda key: key[0] == user_id)
+
+# Сбрасывает закэшированные страницы нескольких пользователей (после освобождения истекших кампаний)
+def invalidate_all_campaign_pages(user_ids):
+    campaign_pages.pop_where(lambda key: key[0] in user_ids)
+
 # Обработчики для кнопок клавиатуры
 @dp.message(lambda message: message.text == "Мои кампании")
-async def show_my_campaigns(message: Message):
-    # Получаем информацию о кампаниях пользователя из БД
-    session = Session()
+async def show_my_campaigns(message: Message, session):
     try:
-        campaigns = session.query(Campaign).filter(
-            Campaign.creator_id == message.from_user.id
-        ).all()
-        
-        if not campaigns:
-            await message.answer(
-                "У вас пока нет активных кампаний. Чтобы создать кампанию, напишите /new_campaign",
-                reply_markup=get_main_keyboard()
-            )
-            return
-        
-        # Формируем текст с информацией о кампаниях
-        campaigns_text = "Ваши кампании:\n\n"
-        
-        for i, campaign in enumerate(campaigns, start=1):
-            # Получаем информацию о боте для этой кампании
-            bot = session.query(UserBot).filter(UserBot.id == campaign.bot_id).first()
-            bot_name = bot.session_name if bot else "Неизвестный бот"
-            
-            # Форматируем дату окончания оплаты
-            paid_until_str = campaign.paid_until.strftime("%d.%m.%Y") if campaign.paid_until else "Не оплачено"
-            
-            campaigns_text += (
-                f"{i}. {campaign.name}\n"
-                f"   Бот: {bot_name}\n"
-                f"   Цель: {campaign.target}\n"
-                f"   Оплачено до: {paid_until_str}\n\n"
-            )
-        
-        campaigns_text += "Для управления кампанией, напишите /campaign_{id}, где {id} - номер кампании."
-        
-        await message.answer(campaigns_text, reply_markup=get_main_keyboard())
+        campaigns_text, keyboard = await render_campaigns_page(session, message.from_user.id)
+        await message.answer(campaigns_text, reply_markup=keyboard or get_main_keyboard())
     except Exception as e:
         print(f"Ошибка при получении кампаний: {e}")
         await message.answer(
             "Произошла ошибка при получении списка кампаний",
             reply_markup=get_main_keyboard()
         )
-    finally:
-        session.close()
+
+# Переход между страницами списка кампаний
+@dp.callback_query(F.data.startswith("campaigns:"))
+async def paginate_campaigns(callback: CallbackQuery, session):
+    _, direction, cursor = callback.data.split(":")
+    try:
+        campaigns_text, keyboard = await render_campaigns_page(session, callback.from_user.id, direction, int(cursor))
+        await callback.message.edit_text(campaigns_text, reply_markup=keyboard)
+    except Exception as e:
+        print(f"Ошибка при получении кампаний: {e}")
+    await callback.answer()
 
 # Добавляем состояние для ввода username канала
 @dp.callback_query(F.data == "check_admin", CampaignStates.waiting_for_channel_confirmation)
@@ -656,7 +631,7 @@ async def request_channel_username(callback: CallbackQuery, state: FSMContext):
 
 # Обработчик для проверки статуса администратора в канале после ввода username
 @dp.message(CampaignStates.waiting_for_channel_username)
-async def check_admin_status(message: Message, state: FSMContext):
+async def check_admin_status(message: Message, state: FSMContext, session):
     channel_username = message.text.strip()
     
     # Проверяем формат username
@@ -664,51 +639,230 @@ async def check_admin_status(message: Message, state: FSMContext):
         await message.answer("Username канала должен начинаться с @. Пожалуйста, введите корректный username:")
         return
     
-    # Убираем @ для внутренней обработки
-    pure_username = channel_username[1:]
-    
     # Сохраняем username канала
     await state.update_data(channel_username=channel_username)
     
-    # Получаем данные о юзерботе
-    data = await state.get_data()
-    userbot_id = data["userbot_id"]
-    
-    # Проверяем, является ли юзербот администратором канала через Telethon API
-    is_admin = await check_channel_admin(userbot_id, pure_username)
-    
-    if not is_admin:
+    # Проверка прав и добавление канала в профиль выполняются в фоне
+    await enqueue_wizard_job(message, state, session, "check_channel_admin", "⏳ Проверяем права бота в канале...",
+                             {"channel_username": channel_username})
+
+# Возвращает в пул бота, арендованного пользователем для мастера
+async def release_wizard_userbot(session, user_id: int):
+    userbot = await leased_userbot(session, user_id)
+    if userbot:
+        await release_userbot(session, userbot.id, user_id)
+
+# Ставит шаг мастера в очередь фоновых заданий и сразу отвечает сообщением о ходе выполнения
+async def enqueue_wizard_job(message: Message, state: FSMContext, session, kind: str, progress_text: str, payload: dict):
+    # Бот мог быть заменен предварительной проверкой; берем итоговый из аренды
+    await prewarmer.wait(message.from_user.id)
+    userbot = await leased_userbot(session, message.from_user.id)
+    if userbot is None:
         await message.answer(
-            f"Бот не найден в списке администраторов канала {channel_username}.\n"
-            f"Пожалуйста, убедитесь, что вы добавили бота как администратора и повторите попытку:"
+            "Время на настройку кампании истекло, и бот был передан другому пользователю. "
+            "Создайте кампанию заново: /new_campaign",
+            reply_markup=get_main_keyboard()
         )
+        await state.clear()
         return
+    progress = await message.answer(progress_text)
+    job_id = await enqueue(
+        session, kind, payload,
+        userbot_id=userbot.id,
+        chat_id=message.chat.id,
+        user_id=message.from_user.id,
+        message_id=progress.message_id
+    )
+    await state.update_data(job_id=job_id)
+    await state.set_state(CampaignStates.waiting_for_job)
+
+# Пока выполняется фоновое задание, новые сообщения и нажатия не обрабатываются
+@dp.message(CampaignStates.waiting_for_job)
+async def wait_for_job_message(message: Message):
+    await message.answer("⏳ Подождите, предыдущий шаг еще выполняется...")
+
+@dp.callback_query(CampaignStates.waiting_for_job)
+async def wait_for_job_callback(callback: CallbackQuery):
+    await callback.answer("⏳ Подождите, предыдущий шаг еще выполняется...")
+
+# Фоновые задания мастера: выполняются исполнителями job_queue в отдельной сессии базы данных
+@job_handler("set_bot_name")
+async def set_bot_name_job(session, job, payload):
+    # Проверяем доступность юзербота
+    if not await check_userbot_availability(job.userbot_id, session=session):
+        # Освобождаем юзербота
+        await release_userbot(session, job.userbot_id, job.user_id)
+        return {"status": "unavailable"}
+    
+    # Изменяем имя юзербота через Telethon API
+    if not await update_bot_profile(job.userbot_id, first_name=payload["bot_name"], session=session):
+        raise RetryJob("Не удалось изменить имя бота")
+    
+    # Обновляем имя бота в базе данных
+    await update_userbot_status(session, job.userbot_id, new_name=payload["bot_name"])
+    return {"status": "ok"}
+
+@job_handler("set_bot_avatar")
+async def set_bot_avatar_job(session, job, payload):
+    # Скачиваем фотографию в память и приводим к формату профильного фото
+    try:
+        photo_bytes, _ = await prepare_avatar(await download_photo(bot, payload["file_id"]))
+    except Exception as e:
+        logger.error(f"Ошибка при подготовке аватара: {e}")
+        return {"status": "bad_image"}
+    
+    # Применяем аватарку к юзерботу через Telethon API
+    if not await update_bot_profile(job.userbot_id, photo_bytes=photo_bytes, session=session):
+        raise RetryJob("Не удалось установить аватар")
+    return {"status": "ok"}
+
+@job_handler("set_bot_description")
+async def set_bot_description_job(session, job, payload):
+    # Обновляем описание юзербота через Telethon API
+    if not await update_bot_profile(job.userbot_id, bio=payload["description"], session=session):
+        raise RetryJob("Не удалось обновить описание бота")
+    
+    userbot = await session.get(UserBot, job.userbot_id)
+    return {"status": "ok", "session_name": userbot.session_name}
+
+@job_handler("check_channel_admin")
+async def check_channel_admin_job(session, job, payload):
+    channel_username = payload["channel_username"]
+    
+    # Проверяем, является ли юзербот администратором канала через Telethon API (без @)
+    if not await check_channel_admin(job.userbot_id, channel_username[1:], session=session):
+        return {"status": "not_admin"}
     
     # Если бот является администратором, добавляем канал в профиль бота
-    success = await add_channel_to_profile(userbot_id, channel_username)
+    if not await add_channel_to_profile(job.userbot_id, channel_username, session=session):
+        raise RetryJob("Не удалось добавить канал в профиль бота")
+    return {"status": "ok"}
+
+# Ответы на итоги фоновых заданий: (тип задания, итог) -> (текст, следующее состояние мастера)
+JOB_REPLIES = {
+    ("set_bot_name", "ok"): ("Отлично! Теперь отправьте фотографию для аватара бота:", CampaignStates.waiting_for_bot_avatar),
+    ("set_bot_name", "error"): (
+        "Произошла ошибка при изменении имени бота. Пожалуйста, попробуйте другое имя:",
+        CampaignStates.waiting_for_bot_name
+    ),
+    ("set_bot_avatar", "ok"): (
+        "Аватар успешно установлен! Теперь введите описание профиля бота (без ссылок):",
+        CampaignStates.waiting_for_bot_description
+    ),
+    ("set_bot_avatar", "bad_image"): (
+        "Не удалось обработать изображение. Пожалуйста, попробуйте другое изображение:",
+        CampaignStates.waiting_for_bot_avatar
+    ),
+    ("set_bot_avatar", "error"): (
+        "Произошла ошибка при установке аватара. Пожалуйста, попробуйте другое изображение:",
+        CampaignStates.waiting_for_bot_avatar
+    ),
+    ("set_bot_description", "error"): (
+        "Произошла ошибка при обновлении описания бота. Пожалуйста, попробуйте другое описание:",
+        CampaignStates.waiting_for_bot_description
+    ),
+    ("check_channel_admin", "error"): (
+        "Произошла ошибка при добавлении канала в профиль бота. Пожалуйста, попробуйте снова.",
+        CampaignStates.waiting_for_channel_username
+    ),
+}
+
+# Хук завершения фонового задания: редактирует сообщение о ходе выполнения и переводит мастер на следующий шаг
+async def on_job_finished(job, result, error):
+    state = dp.fsm.get_context(bot=bot, chat_id=job.chat_id, user_id=job.user_id)
+    data = await state.get_data()
     
-    if not success:
-        await message.answer(
-            "Произошла ошибка при добавлении канала в профиль бота. Пожалуйста, попробуйте снова."
-        )
+    # Пользователь мог отменить мастер или начать заново, пока задание выполнялось
+    if await state.get_state() != CampaignStates.waiting_for_job.state or data.get("job_id") != job.id:
         return
     
-    # Все проверки пройдены, переходим к подтверждению
-    confirmation_text = (
-        "📋 Проверьте данные вашей кампании:\n\n"
-        f"📌 Название: {data['campaign_name']}\n"
-        f"🎯 Категория: {data['target']}\n"
-        f"🤖 Имя бота: {data['bot_name']}\n"
-        f"📝 Описание бота: {data['bot_description']}\n"
-        f"📢 Канал: {channel_username}\n"
-        f"📅 Оплачено до: {data['paid_until'].strftime('%d.%m.%Y')}\n\n"
-        "Всё верно? Нажмите 'Подтвердить' для запуска кампании."
-    )
+    status = result["status"] if result else "error"
+    reply_markup = None
     
-    await message.answer(confirmation_text, reply_markup=get_confirmation_keyboard())
-    await state.set_state(CampaignStates.waiting_for_final_confirmation)
+    if (job.kind, status) in JOB_REPLIES:
+        text, next_state = JOB_REPLIES[(job.kind, status)]
+    elif job.kind == "set_bot_name" and status == "unavailable":
+        await bot.delete_message(job.chat_id, job.message_id)
+        await bot.send_message(
+            job.chat_id,
+            "Произошла ошибка при подключении к боту. Пожалуйста, попробуйте позже или выберите другого бота.",
+            reply_markup=get_main_keyboard()
+        )
+        # Возвращаем к начальному состоянию
+        await state.clear()
+        return
+    elif job.kind == "set_bot_description":
+        # Запрашиваем добавление бота в канал
+        text = (
+            f"Отлично! Теперь вам нужно:\n\n"
+            f"1. Создать новый канал в Telegram\n"
+            f"2. Добавить в описание канала ссылку на ваш основной канал\n"
+            f"3. Добавить нашего бота @{result['session_name']} как администратора канала\n\n"
+            f"После этого введите @username вашего нового канала и нажмите кнопку 'Подтвердить':"
+        )
+        await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.message_id)
+        await bot.send_message(
+            job.chat_id, "Когда добавите бота как администратора, нажмите кнопку:", reply_markup=get_channel_keyboard()
+        )
+        await state.set_state(CampaignStates.waiting_for_channel_confirmation)
+        return
+    elif job.kind == "check_channel_admin" and status == "not_admin":
+        text = (
+            f"Бот не найден в списке администраторов канала {data['channel_username']}.\n"
+            f"Пожалуйста, убедитесь, что вы добавили бота как администратора и повторите попытку:"
+        )
+        next_state = CampaignStates.waiting_for_channel_username
+    else:
+        # Все проверки пройдены, переходим к подтверждению
+        text = (
+            "📋 Проверьте данные вашей кампании:\n\n"
+            f"📌 Название: {data['campaign_name']}\n"
+            f"🎯 Категория: {data['target']}\n"
+            f"🤖 Имя бота: {data['bot_name']}\n"
+            f"📝 Описание бота: {data['bot_description']}\n"
+            f"📢 Канал: {data['channel_username']}\n"
+            f"📅 Оплачено до: {data['paid_until'].strftime('%d.%m.%Y')}\n\n"
+            "Всё верно? Нажмите 'Подтвердить' для запуска кампании."
+        )
+        next_state = CampaignStates.waiting_for_final_confirmation
+        reply_markup = get_confirmation_keyboard()
+    
+    await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.message_id, reply_markup=reply_markup)
+    await state.set_state(next_state)
+
+# Запускает фоновые задачи бота. В режиме webhook вызывается в каждом процессе-обработчике:
+# общие задачи работают только в первом, а фоновые задания мастера - для чатов своего процесса
+def start_background_tasks(worker_index: int = 0, workers: int = 1):
+    background_tasks = []
+    partition = (worker_index, workers) if workers > 1 else None
+    background_tasks.append(asyncio.create_task(run_job_workers(on_job_finished, partition=partition)))
+    if worker_index != 0:
+        return background_tasks
+    # Запускаем фоновый мониторинг состояния юзерботов
+    if HEALTH_MONITOR_ENABLED:
+        background_tasks.append(asyncio.create_task(run_health_monitor()))
+    # Возвращаем в пул юзерботов из брошенных мастеров
+    background_tasks.append(asyncio.create_task(run_lease_reaper()))
+    # Освобождаем ботов кампаний с истекшей оплатой и уведомляем владельцев
+    if CAMPAIGN_SWEEPER_ENABLED:
+        background_tasks.append(asyncio.create_task(run_campaign_sweeper(bot, on_released=invalidate_all_campaign_pages)))
+    return background_tasks
+
+# Освобождает ресурсы процесса при остановке
+async def shutdown(background_tasks=()):
+    # Останавливаем фоновые задачи до закрытия пула и хранилища, которыми они пользуются
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    # Отключаем клиенты юзерботов, оставшиеся в пуле
+    logger.info(f"Статистика пула клиентов: {client_pool.stats()}")
+    logger.info(f"Статистика планировщика запросов: {rpc_scheduler.stats()}")
+    logger.info(f"Статистика предварительных проверок юзерботов: {prewarmer.stats()}")
+    await client_pool.close()
+    await storage.close()
 
 async def main():
+    background_tasks = []
     try:
         logger.info("Запуск бота...")
         # Проверяем токен бота
@@ -719,21 +873,25 @@ async def main():
         logger.info(f"Токен бота получен, первые 5 символов: {BOT_TOKEN[:5]}...")
         
         # Проверяем подключение к базе данных
-        session = Session()
+        session = AsyncSession()
         try:
-            result = session.execute(text("SELECT 1")).scalar()
+            result = (await session.execute(text("SELECT 1"))).scalar()
             logger.info(f"Подключение к БД успешно: {result}")
         except Exception as e:
             logger.error(f"Ошибка подключения к БД: {e}")
             return
         finally:
-            session.close()
+            await session.close()
             
+        background_tasks = start_background_tasks()
+        
         logger.info("Начинаю поллинг бота...")
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
         logger.error(traceback.format_exc())
+    finally:
+        await shutdown(background_tasks)
 
 if __name__ == "__main__":
     try:
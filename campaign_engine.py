@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Движок кампаний: комментирование новых постов от имени юзерботов.
+
+Движок держит подключенным по одному клиенту на каждого юзербота с
+действующей кампанией и подписывается на новые посты каналов через
+обработчик событий Telethon (без опроса истории). На пост с включенными
+комментариями бот отвечает в ветке обсуждения. Наблюдаемые каналы - те,
+на которые подписан аккаунт юзербота; если в каталоге каналов есть каналы
+категории кампании, комментируются только они. Подходящие посту кампании
+находятся по обратному индексу канал -> кампании (campaign_index).
+Чтобы посты каналов каталога доходили до бота, он в фоне и с лимитом
+вступает в них (ENGINE_JOIN_CHANNELS на категорию), запоминает вступления
+в userbot_channel_joins и выходит из этих каналов, когда его кампании
+заканчиваются.
+
+Список действующих кампаний перечитывается раз в ENGINE_REFRESH_INTERVAL
+секунд, поэтому новые кампании подхватываются без перезапуска, а
+окончание оплаты отслеживается таймером и отключает бота точно в срок.
+Память ограничена: одна запись на кампанию, один клиент на бота,
+кэш обработанных постов и очередь комментариев ограниченного размера.
+Комментарии отправляет общий планировщик (comment_scheduler) с дневным
+и часовым бюджетом каждого аккаунта.
+
+Использование:
+    python campaign_engine.py                 # все кампании
+    python campaign_engine.py --shard 0/4     # кампании ботов с bot_id % 4 == 0
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from telethon import events
+from telethon.errors import ChannelPrivateError, ChannelsTooMuchError, UserNotParticipantError
+from telethon.tl.functions.channels import GetChannelsRequest, JoinChannelRequest, LeaveChannelRequest
+
+from database.db import AsyncSession
+from campaign_index import CampaignIndex
+from channel_crawler import channels_for_category
+from comment_scheduler import CommentScheduler
+from database.models import Campaign, UserBot, UserbotChannelJoin
+from peer_cache import peer_cache
+from rpc_scheduler import rpc_scheduler
+from ttl_cache import TTLCache
+from userbot_manager import channel_topology, extract_session_name, get_client_by_session_name
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Параметры движка
+ENGINE_REFRESH_INTERVAL = int(os.environ.get('ENGINE_REFRESH_INTERVAL', '60'))
+ENGINE_CONNECT_CONCURRENCY = int(os.environ.get('ENGINE_CONNECT_CONCURRENCY', '10'))
+ENGINE_MAX_PENDING_COMMENTS = int(os.environ.get('ENGINE_MAX_PENDING_COMMENTS', '1000'))
+ENGINE_SEEN_POSTS = int(os.environ.get('ENGINE_SEEN_POSTS', '50000'))  # размер кэша обработанных постов
+ENGINE_CATEGORY_CHANNELS = int(os.environ.get('ENGINE_CATEGORY_CHANNELS', '500'))  # каналов каталога на категорию
+ENGINE_JOIN_CHANNELS = int(os.environ.get('ENGINE_JOIN_CHANNELS', '20'))  # крупнейших каналов категории, в которые вступает бот
+ENGINE_ATTACH_BACKOFF = float(os.environ.get('ENGINE_ATTACH_BACKOFF', '60'))  # пауза после первой неудачной попытки подключения
+ENGINE_ATTACH_BACKOFF_MAX = float(os.environ.get('ENGINE_ATTACH_BACKOFF_MAX', '3600'))
+
+# Короткие комментарии по категориям; продвижение идет через профиль бота (имя, аватар, канал в описании)
+COMMENT_TEMPLATES = {
+    "Технологии": ["Интересно, как это покажет себя на практике", "Полезный разбор, спасибо", "Жду продолжения темы"],
+    "Еда": ["Выглядит очень аппетитно", "Надо попробовать приготовить", "Сохранил рецепт, спасибо"],
+    "Мода": ["Отличный образ", "Стильно и со вкусом", "Очень актуально к сезону"],
+    "Спорт": ["Вот это результат", "Мотивирует тренироваться", "Сильная игра"],
+    "Путешествия": ["Хочу туда поехать", "Невероятно красивые места", "Добавил в список поездок"],
+    "Образование": ["Полезная информация, спасибо", "Сохраню, пригодится", "Понятно объяснено"],
+    "Финансы": ["Дельные мысли", "Интересный взгляд на рынок", "Спасибо за разбор"],
+    "Развлечения": ["Отлично поднял настроение", "Это лучшее за сегодня", "Очень смешно"],
+}
+DEFAULT_COMMENTS = ["Интересный пост", "Спасибо, полезно", "Согласен с автором"]
+
+
+def _is_channel_post(event):
+    """Новый пост канала (не сообщение группы) с включенными комментариями."""
+    message = event.message
+    return bool(message.post and message.replies and message.replies.comments)
+
+
+def _is_discussion_copy(event):
+    """Копия поста канала в группе обсуждения, в которой состоит бот."""
+    forward = event.message.fwd_from
+    return bool(forward and forward.saved_from_msg_id)
+
+
+class _Attachment:
+    """Подключенный клиент юзербота и его действующие кампании."""
+
+    __slots__ = ('userbot_id', 'account', 'client', 'campaigns', 'categories', 'handler', 'topology_handler',
+                 'join_task')
+
+    def __init__(self, userbot_id, account, client):
+        self.userbot_id = userbot_id
+        self.account = account
+        self.client = client
+        self.campaigns = {}  # ID кампании -> окончание оплаты
+        self.categories = set()  # категории кампаний, по каталогу которых бот вступает в каналы
+        self.handler = None
+        self.topology_handler = None
+        self.join_task = None
+
+
+class CampaignEngine:
+    """
+    Подключает юзерботов действующих кампаний и комментирует новые посты.
+
+    Args:
+        shard (tuple): (номер, количество) - обслуживать только ботов с bot_id % количество == номер
+        refresh_interval (int): Период перечитывания кампаний в секундах
+    """
+
+    def __init__(self, shard=None, refresh_interval=ENGINE_REFRESH_INTERVAL):
+        self.shard = shard
+        self.refresh_interval = refresh_interval
+        self._bots = {}  # ID юзербота -> _Attachment
+        self._timers = {}  # ID кампании -> таймер окончания оплаты
+        self._attach_failures = {}  # ID юзербота -> (неудачных попыток подряд, время следующей попытки)
+        self._leaving = {}  # ID юзербота -> задача выхода из каналов после окончания кампаний
+        self._seen = TTLCache(24 * 3600, max_entries=ENGINE_SEEN_POSTS)
+        self.index = CampaignIndex()
+        self._indexed = False
+        self.comments = CommentScheduler(max_pending=ENGINE_MAX_PENDING_COMMENTS)
+
+        # Счетчики для мониторинга
+        self.posts_seen = 0
+        self.channels_joined = 0
+        self.channels_left = 0
+
+    async def _load_active(self):
+        now = datetime.now()
+        query = (
+            select(Campaign.id, Campaign.bot_id, Campaign.target, Campaign.paid_until,
+                   UserBot.session_name, UserBot.session_string)
+            .join(UserBot, UserBot.id == Campaign.bot_id)
+            .where(Campaign.paid_until > now, Campaign.released_at.is_(None))
+        )
+        if self.shard:
+            index, count = self.shard
+            query = query.where(Campaign.bot_id % count == index)
+        async with AsyncSession() as session:
+            return (await session.execute(query)).all()
+
+    async def refresh(self):
+        """Приводит подключенных ботов и таймеры в соответствие с действующими кампаниями."""
+        rows = await self._load_active()
+        wanted = defaultdict(list)
+        for row in rows:
+            wanted[row.bot_id].append(row)
+
+        for userbot_id in set(self._bots) - set(wanted):
+            await self._detach(userbot_id)
+        for userbot_id in set(self._attach_failures) - set(wanted):
+            del self._attach_failures[userbot_id]
+
+        await self._update_index(rows)
+
+        # Новых ботов подключаем параллельно, но не больше ENGINE_CONNECT_CONCURRENCY одновременно
+        semaphore = asyncio.Semaphore(ENGINE_CONNECT_CONCURRENCY)
+
+        async def attach(userbot_id, row):
+            async with semaphore:
+                await self._attach(userbot_id, row.session_name, row.session_string)
+
+        now = time.monotonic()
+        await asyncio.gather(*(
+            attach(userbot_id, campaigns[0]) for userbot_id, campaigns in wanted.items()
+            if userbot_id not in self._bots and self._can_attach(userbot_id, now)
+        ))
+
+        for userbot_id, campaigns in wanted.items():
+            attachment = self._bots.get(userbot_id)
+            if attachment is None:
+                continue
+            attachment.campaigns = {row.id: row.paid_until for row in campaigns}
+            for row in campaigns:
+                self._schedule_expiry(row.id, userbot_id, row.paid_until)
+            categories = {row.target for row in campaigns}
+            if categories != attachment.categories:
+                attachment.categories = categories
+                self._start_joins(attachment)
+
+        active_ids = {row.id for row in rows}
+        for campaign_id in set(self._timers) - active_ids:
+            self._timers.pop(campaign_id).cancel()
+            self.comments.forget_campaign(campaign_id)
+
+    async def _update_index(self, rows):
+        # Один индексный запрос на категорию вместо поиска каналов через Telegram
+        category_channels = {}
+        async with AsyncSession() as session:
+            for category in {row.target for row in rows}:
+                channels = await channels_for_category(session, category, limit=ENGINE_CATEGORY_CHANNELS)
+                category_channels[category] = {channel.channel_id for channel in channels}
+
+        campaigns = [(row.id, row.bot_id, row.target) for row in rows]
+        if not self._indexed:
+            self.index.rebuild(campaigns, category_channels)
+            self._indexed = True
+            return
+
+        # Дальше индекс меняется только на разницу: новые и завершенные кампании, изменения каталога
+        for category, channels in category_channels.items():
+            self.index.set_category_channels(category, channels)
+        self.index.retain({campaign_id for campaign_id, _, _ in campaigns})
+        for campaign in campaigns:
+            self.index.add(*campaign)
+
+    def _schedule_expiry(self, campaign_id, userbot_id, paid_until):
+        timer = self._timers.get(campaign_id)
+        if timer is not None:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        delay = max(0.0, (paid_until - datetime.now()).total_seconds())
+        self._timers[campaign_id] = loop.call_later(delay, self._expire, campaign_id, userbot_id)
+
+    def _expire(self, campaign_id, userbot_id):
+        self._timers.pop(campaign_id, None)
+        self.index.remove(campaign_id)
+        self.comments.forget_campaign(campaign_id)
+        attachment = self._bots.get(userbot_id)
+        if attachment is None:
+            return
+        attachment.campaigns.pop(campaign_id, None)
+        logger.info(f"Кампания {campaign_id} истекла, юзербот {userbot_id} перестает комментировать")
+        if not attachment.campaigns:
+            asyncio.create_task(self._detach(userbot_id))
+
+    def _can_attach(self, userbot_id, now):
+        # Бот еще выходит из каналов прошлых кампаний или недавно не подключился
+        if userbot_id in self._leaving:
+            return False
+        failure = self._attach_failures.get(userbot_id)
+        return failure is None or failure[1] <= now
+
+    async def _attach(self, userbot_id, session_name, session_string):
+        client = await get_client_by_session_name(session_name, session_string=session_string)
+        if client is None:
+            # Повторные попытки с растущей паузой, а не на каждом обновлении списка кампаний
+            failures = self._attach_failures.get(userbot_id, (0, 0.0))[0] + 1
+            delay = min(ENGINE_ATTACH_BACKOFF_MAX, ENGINE_ATTACH_BACKOFF * 2 ** (failures - 1))
+            self._attach_failures[userbot_id] = (failures, time.monotonic() + delay)
+            logger.error(f"Не удалось подключить юзербота {userbot_id} для кампаний, следующая попытка через {delay:.0f} с")
+            return None
+        self._attach_failures.pop(userbot_id, None)
+
+        attachment = _Attachment(userbot_id, extract_session_name(session_name), client)
+
+        async def on_post(event):
+            await self._on_post(attachment, event)
+
+        async def on_discussion_copy(event):
+            channel_topology.learn(event.message)
+
+        attachment.handler = on_post
+        attachment.topology_handler = on_discussion_copy
+        client.add_event_handler(on_post, events.NewMessage(incoming=True, func=_is_channel_post))
+        client.add_event_handler(on_discussion_copy, events.NewMessage(incoming=True, func=_is_discussion_copy))
+        self._bots[userbot_id] = attachment
+        logger.info(f"Юзербот {userbot_id} подключен к движку кампаний")
+        return attachment
+
+    async def _detach(self, userbot_id, leave=True):
+        """
+        Отключает бота от движка.
+
+        Args:
+            userbot_id (int): ID юзербота
+            leave (bool): Выйти из каналов, в которые бот вступил ради кампаний (False при остановке движка)
+        """
+        attachment = self._bots.pop(userbot_id, None)
+        if attachment is None:
+            return
+        # Комментарии отключенного бота отправить уже некому
+        for campaign_id in attachment.campaigns:
+            self.comments.forget_campaign(campaign_id)
+        attachment.client.remove_event_handler(attachment.handler)
+        attachment.client.remove_event_handler(attachment.topology_handler)
+        if attachment.join_task is not None:
+            attachment.join_task.cancel()
+        if leave:
+            # Выход идет с лимитом семейства 'join' и может занять минуты, поэтому не задерживает обновление кампаний
+            self._leaving[userbot_id] = asyncio.create_task(self._leave_channels(attachment))
+            return
+        await self._disconnect(attachment)
+
+    async def _disconnect(self, attachment):
+        try:
+            await attachment.client.disconnect()
+        except Exception as e:
+            logger.error(f"Ошибка при отключении юзербота {attachment.userbot_id}: {e}")
+        logger.info(f"Юзербот {attachment.userbot_id} отключен от движка кампаний")
+
+    def _start_joins(self, attachment):
+        if attachment.join_task is not None:
+            attachment.join_task.cancel()
+        attachment.join_task = asyncio.create_task(self._join_channels(attachment, set(attachment.categories)))
+
+    async def _join_channels(self, attachment, categories):
+        """Вступает в крупнейшие каналы каталога категорий бота: посты каналов без подписки до него не доходят."""
+        try:
+            async with AsyncSession() as session:
+                joined = set((await session.execute(
+                    select(UserbotChannelJoin.channel_id).where(UserbotChannelJoin.userbot_id == attachment.userbot_id)
+                )).scalars())
+                channels = []
+                for category in categories:
+                    channels.extend(await channels_for_category(session, category, limit=ENGINE_JOIN_CHANNELS))
+        except Exception as e:
+            logger.error(f"Не удалось выбрать каналы для вступления юзербота {attachment.userbot_id}: {e}")
+            return
+
+        for channel in channels:
+            if channel.channel_id in joined:
+                continue
+            joined.add(channel.channel_id)
+            try:
+                if await self._join(attachment, channel):
+                    self.channels_joined += 1
+            except ChannelsTooMuchError:
+                logger.warning(f"Юзербот {attachment.userbot_id} состоит в максимуме каналов, вступление остановлено")
+                return
+            except Exception as e:
+                logger.warning(f"Юзербот {attachment.userbot_id} не смог вступить в канал "
+                               f"{channel.username or channel.channel_id}: {e}")
+
+    async def _join(self, attachment, channel):
+        """
+        Вступает в канал каталога, если аккаунт еще не подписан на него.
+
+        Returns:
+            bool: True, если бот вступил и вступление записано для выхода после кампаний
+        """
+        client, account = attachment.client, attachment.account
+        entity = await peer_cache.get_input_entity(client, account, channel.username or channel.channel_id)
+        result = await rpc_scheduler.call(account, 'channels', lambda: client(GetChannelsRequest([entity])))
+        if result.chats and not getattr(result.chats[0], 'left', True):
+            # Подписка владельца аккаунта: движок ее не записывает и из канала не выходит
+            return False
+
+        await rpc_scheduler.call(account, 'join', lambda: client(JoinChannelRequest(entity)))
+        async with AsyncSession() as session:
+            session.add(UserbotChannelJoin(
+                userbot_id=attachment.userbot_id, channel_id=channel.channel_id, joined_at=datetime.now()
+            ))
+            await session.commit()
+        return True
+
+    async def _leave_channels(self, attachment):
+        """Выходит из каналов, в которые бот вступил ради кампаний, и отключает клиента."""
+        client, account = attachment.client, attachment.account
+        try:
+            async with AsyncSession() as session:
+                channel_ids = (await session.execute(
+                    select(UserbotChannelJoin.channel_id).where(UserbotChannelJoin.userbot_id == attachment.userbot_id)
+                )).scalars().all()
+
+            for channel_id in channel_ids:
+                try:
+                    entity = await peer_cache.get_input_entity(client, account, channel_id)
+                    await rpc_scheduler.call(account, 'join', lambda: client(LeaveChannelRequest(entity)))
+                    self.channels_left += 1
+                except (UserNotParticipantError, ChannelPrivateError, ValueError):
+                    # Бот уже не состоит в канале или канал недоступен: выходить не из чего
+                    pass
+                except Exception as e:
+                    # Запись остается, выход повторится при следующем отключении бота
+                    logger.warning(f"Юзербот {attachment.userbot_id} не смог выйти из канала {channel_id}: {e}")
+                    continue
+                async with AsyncSession() as session:
+                    await session.execute(delete(UserbotChannelJoin).where(
+                        UserbotChannelJoin.userbot_id == attachment.userbot_id,
+                        UserbotChannelJoin.channel_id == channel_id
+                    ))
+                    await session.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при выходе юзербота {attachment.userbot_id} из каналов: {e}")
+        finally:
+            self._leaving.pop(attachment.userbot_id, None)
+            await self._disconnect(attachment)
+
+    async def _on_post(self, attachment, event):
+        # Группа обсуждения канала видна в самом посте, отдельный GetFullChannel не нужен
+        channel_topology.learn(event.message)
+        if not attachment.campaigns:
+            return
+        matches = self.index.match(getattr(event.message.peer_id, 'channel_id', None), attachment.userbot_id)
+        if not matches:
+            return
+        key = (attachment.userbot_id, event.chat_id, event.id)
+        if self._seen.get(key):
+            return
+        self._seen.set(key, True)
+        self.posts_seen += 1
+
+        # На пост отвечает одна кампания бота - та, у которой раньше заканчивается оплата
+        campaign_id, target = min(
+            (match for match in matches if match[0] in attachment.campaigns),
+            key=lambda match: attachment.campaigns[match[0]],
+            default=(None, None)
+        )
+        if campaign_id is None:
+            return
+        text = random.choice(COMMENT_TEMPLATES.get(target, DEFAULT_COMMENTS))
+        channel = await event.get_input_chat()
+        post_id = event.id
+        # Очередь комментариев ограничена: при перегрузке новые посты пропускаются
+        self.comments.submit(
+            attachment.userbot_id, campaign_id, attachment.campaigns[campaign_id],
+            lambda: self._comment(attachment, campaign_id, channel, post_id, text)
+        )
+
+    async def _comment(self, attachment, campaign_id, channel, post_id, text):
+        # К моменту отправки кампания могла истечь, а бот - отключиться
+        if campaign_id not in attachment.campaigns or self._bots.get(attachment.userbot_id) is not attachment:
+            return
+        # Ветка комментариев берется из кэша топологии, а не запрашивается при каждой отправке
+        thread = await channel_topology.comment_target(attachment.client, attachment.account, channel, post_id)
+        if thread is None:
+            logger.info(f"У поста {post_id} нет ветки комментариев, юзербот {attachment.userbot_id} его пропускает")
+            return
+        target, reply_to = thread
+        await rpc_scheduler.call(
+            attachment.account, 'messages',
+            lambda: attachment.client.send_message(target, text, reply_to=reply_to)
+        )
+
+    async def run(self):
+        """Бесконечный цикл: перечитывание кампаний и обработка событий подключенных клиентов."""
+        scheduler = asyncio.create_task(self.comments.run())
+        try:
+            while True:
+                try:
+                    await self.refresh()
+                    logger.info(f"Движок кампаний: {self.stats()}")
+                except Exception as e:
+                    logger.error(f"Ошибка при обновлении списка кампаний: {e}")
+                await asyncio.sleep(self.refresh_interval)
+        finally:
+            scheduler.cancel()
+            await self.close()
+
+    async def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        # При остановке движка кампании продолжаются, поэтому из каналов боты не выходят
+        for userbot_id in list(self._bots):
+            await self._detach(userbot_id, leave=False)
+        leaving = list(self._leaving.values())
+        for task in leaving:
+            task.cancel()
+        await asyncio.gather(*leaving, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'bots': len(self._bots),
+            'campaigns': len(self._timers),
+            'index': self.index.stats(),
+            'posts_seen': self.posts_seen,
+            'channels_joined': self.channels_joined,
+            'channels_left': self.channels_left,
+            'leaving': len(self._leaving),
+            'comments': self.comments.stats(),
+            'topology': channel_topology.stats(),
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Движок комментирования для действующих кампаний")
+    parser.add_argument("--shard", help="Доля кампаний для этого процесса в виде номер/количество, например 0/4")
+    args = parser.parse_args()
+
+    shard = tuple(int(part) for part in args.shard.split('/')) if args.shard else None
+    asyncio.run(CampaignEngine(shard=shard).run())
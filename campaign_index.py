@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Обратный индекс: канал нового поста -> заинтересованные кампании.
+
+Каждая кампания относится к категории, а категория по каталогу каналов -
+к набору каналов. Индекс хранит канал -> юзербот -> кампании, поэтому
+обработка поста ботом стоит O(подходящих кампаний этого бота), а не
+перебор кампаний категории всех ботов. Кампании
+категорий, для которых каталог пуст, подходят к любому каналу. Индекс
+строится целиком при запуске и дальше обновляется по одной кампании
+при появлении и окончании кампаний.
+"""
+import logging
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Замерять память индекса при полной перестройке (tracemalloc замедляет перестройку, включать для диагностики)
+CAMPAIGN_INDEX_TRACE_MEMORY = os.environ.get('CAMPAIGN_INDEX_TRACE_MEMORY', 'false').lower() == 'true'
+
+
+class CampaignIndex:
+    """Индекс действующих кампаний по каналам и категориям."""
+
+    def __init__(self):
+        self._campaigns = {}  # ID кампании -> (ID юзербота, категория)
+        self._by_category = defaultdict(set)  # категория -> ID кампаний
+        self._category_channels = {}  # категория -> ID каналов из каталога
+        self._by_channel = defaultdict(dict)  # ID канала -> ID юзербота -> ID кампаний
+        self._open = defaultdict(set)  # ID юзербота -> кампании категорий без каталога
+
+        # Показатели последней полной перестройки
+        self.rebuild_seconds = 0.0
+        self.rebuild_memory = None
+
+    def __len__(self):
+        return len(self._campaigns)
+
+    def __contains__(self, campaign_id):
+        return campaign_id in self._campaigns
+
+    def rebuild(self, campaigns, category_channels):
+        """
+        Строит индекс заново.
+
+        Args:
+            campaigns (iterable): Тройки (ID кампании, ID юзербота, категория)
+            category_channels (dict): Категория -> ID каналов из каталога
+        """
+        tracing = CAMPAIGN_INDEX_TRACE_MEMORY and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        started = time.perf_counter()
+
+        self._campaigns = {}
+        self._by_category = defaultdict(set)
+        self._by_channel = defaultdict(dict)
+        self._open = defaultdict(set)
+        # Пустой каталог категории равен его отсутствию: кампании категории подходят к любому каналу
+        self._category_channels = {
+            category: set(channels) for category, channels in category_channels.items() if channels
+        }
+        for campaign_id, userbot_id, category in campaigns:
+            self.add(campaign_id, userbot_id, category)
+
+        self.rebuild_seconds = time.perf_counter() - started
+        if tracing:
+            self.rebuild_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        logger.info(f"Индекс кампаний перестроен: {self.stats()}")
+
+    def add(self, campaign_id, userbot_id, category):
+        """Добавляет кампанию; повторное добавление обновляет ее бота и категорию."""
+        if campaign_id in self._campaigns:
+            if self._campaigns[campaign_id] == (userbot_id, category):
+                return
+            self.remove(campaign_id)
+        self._campaigns[campaign_id] = (userbot_id, category)
+        self._by_category[category].add(campaign_id)
+        if category not in self._category_channels:
+            self._open[userbot_id].add(campaign_id)
+        for channel_id in self._category_channels.get(category, ()):
+            self._by_channel[channel_id].setdefault(userbot_id, set()).add(campaign_id)
+
+    def remove(self, campaign_id):
+        """Убирает кампанию (истекла или освобождена)."""
+        entry = self._campaigns.pop(campaign_id, None)
+        if entry is None:
+            return
+        userbot_id, category = entry
+        self._discard(self._by_category, category, campaign_id)
+        self._discard(self._open, userbot_id, campaign_id)
+        for channel_id in self._category_channels.get(category, ()):
+            self._unlink(channel_id, userbot_id, campaign_id)
+
+    def retain(self, campaign_ids):
+        """
+        Убирает кампании, которых нет среди действующих.
+
+        Returns:
+            int: Количество убранных кампаний
+        """
+        stale = [campaign_id for campaign_id in self._campaigns if campaign_id not in campaign_ids]
+        for campaign_id in stale:
+            self.remove(campaign_id)
+        return len(stale)
+
+    def set_category_channels(self, category, channels):
+        """Заменяет каналы категории, перенося ее кампании только между изменившимися каналами."""
+        channels = set(channels)
+        previous = self._category_channels.get(category, set())
+        if channels == previous:
+            return
+        campaigns = [
+            (campaign_id, self._campaigns[campaign_id][0]) for campaign_id in self._by_category.get(category, ())
+        ]
+        for campaign_id, userbot_id in campaigns:
+            if channels:
+                self._discard(self._open, userbot_id, campaign_id)
+            else:
+                self._open[userbot_id].add(campaign_id)
+        for channel_id in previous - channels:
+            for campaign_id, userbot_id in campaigns:
+                self._unlink(channel_id, userbot_id, campaign_id)
+        if campaigns:
+            for channel_id in channels - previous:
+                bots = self._by_channel[channel_id]
+                for campaign_id, userbot_id in campaigns:
+                    bots.setdefault(userbot_id, set()).add(campaign_id)
+        if channels:
+            self._category_channels[category] = channels
+        else:
+            self._category_channels.pop(category, None)
+
+    def match(self, channel_id, userbot_id):
+        """
+        Кампании юзербота, которые должны отреагировать на пост канала.
+
+        Args:
+            channel_id (int): ID канала поста
+            userbot_id (int): ID юзербота, получившего пост
+
+        Returns:
+            list: Пары (ID кампании, категория)
+        """
+        matched = []
+        # Категории без каталога не ограничивают каналы
+        by_channel = self._by_channel.get(channel_id)
+        for campaign_ids in (by_channel.get(userbot_id, ()) if by_channel else (), self._open.get(userbot_id, ())):
+            for campaign_id in campaign_ids:
+                matched.append((campaign_id, self._campaigns[campaign_id][1]))
+        return matched
+
+    def _unlink(self, channel_id, userbot_id, campaign_id):
+        bots = self._by_channel.get(channel_id)
+        if bots is None:
+            return
+        self._discard(bots, userbot_id, campaign_id)
+        if not bots:
+            del self._by_channel[channel_id]
+
+    @staticmethod
+    def _discard(mapping, key, campaign_id):
+        campaign_ids = mapping.get(key)
+        if campaign_ids is None:
+            return
+        campaign_ids.discard(campaign_id)
+        if not campaign_ids:
+            del mapping[key]
+
+    def stats(self):
+        return {
+            'campaigns': len(self._campaigns),
+            'channels': len(self._by_channel),
+            'categories': len(self._by_category),
+            'rebuild_ms': round(self.rebuild_seconds * 1000, 1),
+            'rebuild_memory_kb': None if self.rebuild_memory is None else round(self.rebuild_memory / 1024, 1),
+        }
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Освобождение юзерботов кампаний с истекшей оплатой.
+
+Сборщик идет по частичному индексу ix_campaigns_unreleased_paid_until
+пачками с курсором (paid_until, id), не загружая ORM-объекты: на пачку
+приходится один UPDATE кампаний (released_at) и один UPDATE юзерботов,
+возвращающий их в пул. Владельцы получают одно уведомление на пачку их
+кампаний, а итог каждого обхода записывается в таблицу sweep_runs.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, exists, insert, or_, select, update
+
+from database.db import AsyncSession
+from database.models import Campaign, SweepRun, UserBot
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Параметры сборщика
+CAMPAIGN_SWEEP_INTERVAL = int(os.environ.get('CAMPAIGN_SWEEP_INTERVAL', '300'))  # секунд между обходами
+CAMPAIGN_SWEEP_BATCH_SIZE = int(os.environ.get('CAMPAIGN_SWEEP_BATCH_SIZE', '500'))
+CAMPAIGN_SWEEP_NOTIFY_RATE = float(os.environ.get('CAMPAIGN_SWEEP_NOTIFY_RATE', '20'))  # уведомлений в секунду
+
+
+def _expired(now, cursor):
+    """Истекшие неосвобожденные кампании после курсора (paid_until, id)."""
+    condition = and_(Campaign.released_at.is_(None), Campaign.paid_until <= now)
+    if cursor:
+        paid_until, campaign_id = cursor
+        condition = and_(condition, or_(
+            Campaign.paid_until > paid_until,
+            and_(Campaign.paid_until == paid_until, Campaign.id > campaign_id)
+        ))
+    return condition
+
+
+async def _release_batch(now, cursor, batch_size):
+    """
+    Освобождает одну пачку истекших кампаний.
+
+    Returns:
+        tuple: (курсор следующей пачки или None, освобожденные кампании, количество освобожденных ботов)
+    """
+    async with AsyncSession() as session:
+        candidates = (await session.execute(
+            select(Campaign.id, Campaign.paid_until)
+            .where(_expired(now, cursor))
+            .order_by(Campaign.paid_until, Campaign.id)
+            .limit(batch_size)
+        )).all()
+        if not candidates:
+            return None, [], 0
+
+        # Повторная проверка released_at защищает от параллельного обхода
+        released = (await session.execute(
+            update(Campaign)
+            .where(Campaign.id.in_([row.id for row in candidates]), Campaign.released_at.is_(None))
+            .values(released_at=now)
+            .returning(Campaign.id, Campaign.creator_id, Campaign.bot_id, Campaign.name)
+        )).all()
+
+        bots_released = 0
+        bot_ids = {row.bot_id for row in released}
+        if bot_ids:
+            # Бот остается занятым, если за ним числится другая действующая кампания
+            still_active = exists().where(
+                Campaign.bot_id == UserBot.id,
+                Campaign.released_at.is_(None),
+                Campaign.paid_until > now
+            )
+            result = await session.execute(
+                update(UserBot)
+                .where(UserBot.id.in_(bot_ids), UserBot.isoccupied == True, ~still_active)
+                .values(isoccupied=False)
+                .execution_options(synchronize_session=False)
+            )
+            bots_released = result.rowcount
+
+        await session.commit()
+
+    last = candidates[-1]
+    return (last.paid_until, last.id), released, bots_released
+
+
+async def _notify_owners(bot, released, rate=CAMPAIGN_SWEEP_NOTIFY_RATE):
+    """
+    Отправляет каждому владельцу одно сообщение обо всех его кампаниях из пачки.
+
+    Returns:
+        int: Количество уведомленных владельцев
+    """
+    by_owner = defaultdict(list)
+    for row in released:
+        by_owner[row.creator_id].append(row.name)
+
+    notified = 0
+    for owner_id, names in by_owner.items():
+        text = "⏰ Срок оплаты истек, кампании остановлены:\n" + "\n".join(f"• {name}" for name in names)
+        text += "\n\nЧтобы продолжить продвижение, создайте новую кампанию: /new_campaign"
+        try:
+            await bot.send_message(owner_id, text)
+            notified += 1
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить пользователя {owner_id} об истечении кампаний: {e}")
+        # Равномерный темп, чтобы не упереться в лимит Bot API на рассылку
+        await asyncio.sleep(1 / rate)
+    return notified
+
+
+async def _record_run(values, run_id=None):
+    session = AsyncSession()
+    try:
+        if run_id is None:
+            run_id = (await session.execute(insert(SweepRun).values(**values).returning(SweepRun.id))).scalar()
+        else:
+            await session.execute(update(SweepRun).where(SweepRun.id == run_id).values(**values))
+        await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при записи журнала обхода кампаний: {e}")
+        await session.rollback()
+    finally:
+        await session.close()
+    return run_id
+
+
+async def sweep_expired_campaigns(bot=None, batch_size=CAMPAIGN_SWEEP_BATCH_SIZE, on_released=None):
+    """
+    Освобождает ботов всех кампаний, оплата которых истекла.
+
+    Args:
+        bot (Bot): Бот aiogram для уведомлений владельцев или None, чтобы не уведомлять
+        batch_size (int): Количество кампаний в одной пачке
+        on_released (callable): Вызывается с Telegram ID владельцев освобожденных кампаний
+
+    Returns:
+        dict: Итоги обхода
+    """
+    now = datetime.now()
+    totals = {'campaigns_expired': 0, 'bots_released': 0, 'owners_notified': 0}
+    run_id = await _record_run({'started_at': now})
+
+    cursor = None
+    error = None
+    try:
+        while True:
+            cursor, released, bots_released = await _release_batch(now, cursor, batch_size)
+            if cursor is None:
+                break
+            totals['campaigns_expired'] += len(released)
+            totals['bots_released'] += bots_released
+
+            if released and on_released:
+                on_released({row.creator_id for row in released})
+            if released and bot:
+                totals['owners_notified'] += await _notify_owners(bot, released)
+    except Exception as e:
+        logger.error(f"Ошибка при освобождении истекших кампаний: {e}")
+        error = str(e)[:255]
+
+    await _record_run(dict(totals, finished_at=datetime.now(), error=error), run_id)
+    if totals['campaigns_expired']:
+        logger.info(
+            f"Истекших кампаний: {totals['campaigns_expired']}, возвращено в пул юзерботов: {totals['bots_released']}, "
+            f"уведомлено владельцев: {totals['owners_notified']}"
+        )
+    return totals
+
+
+async def run_campaign_sweeper(bot=None, interval=CAMPAIGN_SWEEP_INTERVAL, on_released=None):
+    """Бесконечный цикл освобождения ботов истекших кампаний."""
+    while True:
+        try:
+            await sweep_expired_campaigns(bot, on_released=on_released)
+        except Exception as e:
+            logger.error(f"Ошибка сборщика истекших кампаний: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _main(args):
+    bot = None
+    token = os.getenv('BOT_TOKEN')
+    if token and not args.no_notify:
+        from aiogram import Bot
+        bot = Bot(token=token)
+    try:
+        if args.once:
+            totals = await sweep_expired_campaigns(bot, batch_size=args.batch_size)
+            print(f"Итоги обхода: {totals}")
+        else:
+            await run_campaign_sweeper(bot)
+    finally:
+        if bot:
+            await bot.session.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Освобождение юзерботов кампаний с истекшей оплатой")
+    parser.add_argument("--once", action="store_true", help="Выполнить один обход и завершиться")
+    parser.add_argument("--batch-size", type=int, default=CAMPAIGN_SWEEP_BATCH_SIZE, help="Кампаний в одной пачке")
+    parser.add_argument("--no-notify", action="store_true", help="Не уведомлять владельцев")
+    args = parser.parse_args()
+
+    asyncio.run(_main(args))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Каталог каналов по категориям и его инкрементальное обновление.
+
+Таблица channel_catalog хранит для каждого канала категорию, группу
+обсуждения, число подписчиков и время последнего поста, поэтому выбор
+каналов для кампании - один индексный запрос channels_for_category(),
+без поиска через Telegram. Краулер от имени одного юзербота обновляет
+каталог пачками, начиная с самых давно обновленных записей, и соблюдает
+лимиты планировщика запросов.
+
+Использование:
+    python channel_crawler.py import channels.csv     # username,category
+    python channel_crawler.py crawl --once             # одна пачка
+    python channel_crawler.py crawl                    # бесконечный цикл
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, UsernameInvalidError, UsernameNotOccupiedError
+from telethon.tl.functions.channels import GetFullChannelRequest
+
+from database.db import AsyncSession
+from database.models import ChannelCatalog, UserBot
+from peer_cache import peer_cache
+from rpc_scheduler import rpc_scheduler
+from userbot_manager import extract_session_name, get_client_by_session_name
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Параметры краулера
+CRAWLER_BATCH_SIZE = int(os.environ.get('CRAWLER_BATCH_SIZE', '50'))
+CRAWLER_MAX_AGE = int(os.environ.get('CRAWLER_MAX_AGE', str(24 * 3600)))  # как часто обновлять запись канала
+CRAWLER_IDLE_INTERVAL = int(os.environ.get('CRAWLER_IDLE_INTERVAL', '600'))  # пауза, когда обновлять нечего или Telegram не отвечает
+CRAWLER_USERBOT_ID = os.environ.get('CRAWLER_USERBOT_ID')
+
+# Ошибки, после которых канал считается недоступным, а не временно не ответившим
+UNAVAILABLE_ERRORS = (ChannelInvalidError, ChannelPrivateError, UsernameInvalidError, UsernameNotOccupiedError, ValueError)
+
+
+async def channels_for_category(session, category, limit=100, active_since=None):
+    """
+    Каналы категории, в которых можно комментировать, по убыванию аудитории.
+
+    Args:
+        session (AsyncSession): Сессия базы данных
+        category (str): Категория кампании
+        limit (int): Максимальное количество каналов
+        active_since (datetime, optional): Только каналы с постами не раньше этого времени
+
+    Returns:
+        list: Строки (channel_id, username, linked_chat_id, subscribers)
+    """
+    query = (
+        select(ChannelCatalog.channel_id, ChannelCatalog.username, ChannelCatalog.linked_chat_id,
+               ChannelCatalog.subscribers)
+        .where(
+            ChannelCatalog.category == category,
+            ChannelCatalog.is_active == True,
+            ChannelCatalog.linked_chat_id.isnot(None)
+        )
+        .order_by(ChannelCatalog.subscribers.desc())
+        .limit(limit)
+    )
+    if active_since is not None:
+        query = query.where(ChannelCatalog.last_post_at >= active_since)
+    return (await session.execute(query)).all()
+
+
+def _normalize_username(username):
+    return username.strip().lstrip('@').lower() or None
+
+
+async def import_csv(path):
+    """
+    Добавляет каналы из CSV (username,category) и обновляет категорию существующих.
+
+    Returns:
+        tuple: (добавлено, обновлено)
+    """
+    with open(path, newline='', encoding='utf-8') as file:
+        rows = {}
+        for record in csv.reader(file):
+            if len(record) < 2 or record[0].strip().lower() == 'username':
+                continue
+            username = _normalize_username(record[0])
+            if username:
+                rows[username] = record[1].strip()
+
+    added = updated = 0
+    async with AsyncSession() as session:
+        usernames = list(rows)
+        for start in range(0, len(usernames), 500):
+            chunk = usernames[start:start + 500]
+            existing = {
+                row.username: row
+                for row in (await session.execute(
+                    select(ChannelCatalog.id, ChannelCatalog.username, ChannelCatalog.category)
+                    .where(ChannelCatalog.username.in_(chunk))
+                )).all()
+            }
+            for username in chunk:
+                category = rows[username]
+                row = existing.get(username)
+                if row is None:
+                    session.add(ChannelCatalog(username=username, category=category, is_active=True))
+                    added += 1
+                elif row.category != category:
+                    await session.execute(
+                        update(ChannelCatalog).where(ChannelCatalog.id == row.id).values(category=category)
+                    )
+                    updated += 1
+        await session.commit()
+    return added, updated
+
+
+async def _stale_batch(batch_size):
+    """Записи, которые ни разу не обновлялись или устарели, начиная с самых старых."""
+    threshold = datetime.now() - timedelta(seconds=CRAWLER_MAX_AGE)
+    async with AsyncSession() as session:
+        return (await session.execute(
+            select(ChannelCatalog.id, ChannelCatalog.channel_id, ChannelCatalog.username)
+            .where(or_(ChannelCatalog.refreshed_at.is_(None), ChannelCatalog.refreshed_at < threshold))
+            .order_by(ChannelCatalog.refreshed_at.is_(None).desc(), ChannelCatalog.refreshed_at, ChannelCatalog.id)
+            .limit(batch_size)
+        )).all()
+
+
+async def _describe_channel(client, account, row):
+    """Запрашивает у Telegram данные канала для записи каталога."""
+    channel = await peer_cache.get_input_entity(client, account, row.username or row.channel_id)
+    full = await rpc_scheduler.call(account, 'channels', lambda: client(GetFullChannelRequest(channel)))
+    chat = full.chats[0] if full.chats else None
+    messages = await rpc_scheduler.call(account, 'messages', lambda: client.get_messages(channel, limit=1))
+
+    return {
+        'channel_id': full.full_chat.id,
+        'username': (getattr(chat, 'username', None) or row.username or '').lower() or None,
+        'title': getattr(chat, 'title', None),
+        'linked_chat_id': full.full_chat.linked_chat_id,
+        'subscribers': full.full_chat.participants_count,
+        'last_post_at': messages[0].date.replace(tzinfo=None) if messages else None,
+        'is_active': True,
+        'error': None,
+    }
+
+
+async def refresh_batch(client, account, batch_size=CRAWLER_BATCH_SIZE):
+    """
+    Обновляет одну пачку устаревших записей каталога.
+
+    Returns:
+        int: Количество записей, получивших новое время обновления (без временных ошибок)
+    """
+    rows = await _stale_batch(batch_size)
+    if not rows:
+        return 0
+
+    updates = []
+    for row in rows:
+        try:
+            values = await _describe_channel(client, account, row)
+            values['refreshed_at'] = datetime.now()
+        except UNAVAILABLE_ERRORS as e:
+            values = {'is_active': False, 'error': f"{type(e).__name__}: {e}"[:255], 'refreshed_at': datetime.now()}
+        except Exception as e:
+            # Временная ошибка (FloodWait, сеть): refreshed_at не меняется, и запись остается в начале очереди
+            logger.warning(f"Не удалось обновить канал {row.username or row.channel_id}: {e}")
+            values = {'error': str(e)[:255]}
+        updates.append((row, values))
+
+    refreshed = 0
+    async with AsyncSession() as session:
+        for row, values in updates:
+            try:
+                # Точка сохранения на запись: конфликт одной записи не откатывает всю пачку
+                async with session.begin_nested():
+                    await session.execute(update(ChannelCatalog).where(ChannelCatalog.id == row.id).values(**values))
+            except IntegrityError:
+                # Канал уже есть в каталоге под другим username (переименован или указан дважды)
+                logger.warning(f"Канал {row.username} уже есть в каталоге с ID {values.get('channel_id')}, запись отключена")
+                values = {'is_active': False, 'error': "Дубликат канала в каталоге", 'refreshed_at': datetime.now()}
+                await session.execute(update(ChannelCatalog).where(ChannelCatalog.id == row.id).values(**values))
+            if 'refreshed_at' in values:
+                refreshed += 1
+        await session.commit()
+    return refreshed
+
+
+async def _crawler_userbot(userbot_id=CRAWLER_USERBOT_ID):
+    async with AsyncSession() as session:
+        query = select(UserBot.session_name, UserBot.session_string)
+        query = query.where(UserBot.id == int(userbot_id)) if userbot_id else query.order_by(UserBot.id).limit(1)
+        return (await session.execute(query)).first()
+
+
+async def run_crawler(once=False, batch_size=CRAWLER_BATCH_SIZE, idle_interval=CRAWLER_IDLE_INTERVAL):
+    """Обновляет каталог пачками; когда устаревших записей нет, ждет idle_interval."""
+    userbot = await _crawler_userbot()
+    if userbot is None:
+        logger.error("Нет юзербота для обновления каталога каналов")
+        return
+
+    account = extract_session_name(userbot.session_name)
+    client = await get_client_by_session_name(userbot.session_name, session_string=userbot.session_string)
+    if client is None:
+        logger.error(f"Не удалось подключить юзербота {account} для обновления каталога каналов")
+        return
+
+    try:
+        while True:
+            refreshed = 0
+            try:
+                refreshed = await refresh_batch(client, account, batch_size)
+                if refreshed:
+                    logger.info(f"Обновлено записей каталога каналов: {refreshed}")
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении каталога каналов: {e}")
+            if once:
+                return
+            # Неполная пачка: устаревших записей не осталось или часть из них ждет повтора после временной ошибки
+            if refreshed < batch_size:
+                await asyncio.sleep(idle_interval)
+    finally:
+        await client.disconnect()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Каталог каналов по категориям")
+    subparsers = parser.add_subparsers(dest="command")
+
+    import_parser = subparsers.add_parser("import", help="Импортировать каналы из CSV (username,category)")
+    import_parser.add_argument("path")
+
+    crawl_parser = subparsers.add_parser("crawl", help="Обновлять каталог пачками")
+    crawl_parser.add_argument("--once", action="store_true", help="Обновить одну пачку и завершиться")
+    crawl_parser.add_argument("--batch-size", type=int, default=CRAWLER_BATCH_SIZE)
+
+    args = parser.parse_args()
+
+    if args.command == "import":
+        added, updated = asyncio.run(import_csv(args.path))
+        print(f"Добавлено каналов: {added}, изменена категория: {updated}")
+    elif args.command == "crawl":
+        asyncio.run(run_crawler(once=args.once, batch_size=args.batch_size))
+    else:
+        parser.print_help()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Пул постоянных подключений TelegramClient, ключом служит имя сессии.
+
+Авторизованные клиенты остаются подключенными между вызовами, поэтому
+повторные операции с одним аккаунтом не платят за новое MTProto-рукопожатие.
+Простаивающие клиенты вытесняются в порядке LRU при превышении лимита.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Максимальное количество одновременно подключенных клиентов в пуле
+USERBOT_POOL_MAX_SIZE = int(os.environ.get('USERBOT_POOL_MAX_SIZE', '20'))
+
+
+class _PoolEntry:
+    __slots__ = ('client', 'borrowed', 'last_used')
+
+    def __init__(self, client):
+        self.client = client
+        self.borrowed = 0
+        self.last_used = time.monotonic()
+
+
+class ClientPool:
+    """
+    Пул подключенных клиентов Telethon.
+
+    Args:
+        connect (callable): Корутина connect(key, **kwargs), возвращающая
+            подключенный и авторизованный клиент или None
+        max_size (int): Максимальное количество клиентов в пуле
+    """
+
+    def __init__(self, connect, max_size=USERBOT_POOL_MAX_SIZE):
+        self._connect = connect
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._locks = {}
+
+        # Счетчики для мониторинга
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.connect_failures = 0
+        self.connect_time_total = 0.0
+        self.connect_time_max = 0.0
+
+    def _lock_for(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def acquire(self, key, **connect_kwargs):
+        """
+        Выдает подключенный клиент для сессии key.
+
+        Если клиента нет в пуле или он потерял соединение, создается новый.
+        Клиент остается подключенным после выхода из контекста.
+
+        Args:
+            key (str): Имя сессии
+            **connect_kwargs: Дополнительные аргументы для функции подключения
+
+        Yields:
+            TelegramClient: Клиент Telethon или None, если подключиться не удалось
+        """
+        entry = await self._get_entry(key, connect_kwargs)
+        if entry is None:
+            yield None
+            return
+
+        entry.borrowed += 1
+        try:
+            yield entry.client
+        finally:
+            entry.borrowed -= 1
+            entry.last_used = time.monotonic()
+            # Клиент, потерявший соединение, больше не держим в пуле
+            if not entry.client.is_connected() and self._entries.get(key) is entry:
+                del self._entries[key]
+            await self._evict()
+
+    async def _get_entry(self, key, connect_kwargs):
+        async with self._lock_for(key):
+            entry = self._entries.get(key)
+            if entry is not None and entry.client.is_connected():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry
+
+            if entry is not None:
+                # Соединение разорвано - создаем клиента заново
+                del self._entries[key]
+
+            self.misses += 1
+            started = time.monotonic()
+            client = await self._connect(key, **connect_kwargs)
+            elapsed = time.monotonic() - started
+            self.connect_time_total += elapsed
+            self.connect_time_max = max(self.connect_time_max, elapsed)
+
+            if client is None:
+                self.connect_failures += 1
+                return None
+
+            logger.info(f"Клиент {key} добавлен в пул за {elapsed * 1000:.0f} мс")
+            entry = _PoolEntry(client)
+            self._entries[key] = entry
+            return entry
+
+    async def _evict(self):
+        """Отключает простаивающие клиенты в порядке LRU, пока пул превышает лимит."""
+        if len(self._entries) <= self.max_size:
+            return
+
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_size:
+                break
+            entry = self._entries[key]
+            if entry.borrowed:
+                continue
+            del self._entries[key]
+            self._locks.pop(key, None)
+            self.evictions += 1
+            logger.info(f"Клиент {key} вытеснен из пула")
+            await self._disconnect(key, entry.client)
+
+    async def discard(self, key):
+        """Удаляет клиента из пула и отключает его."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            await self._disconnect(key, entry.client)
+
+    async def close(self):
+        """Отключает все клиенты пула."""
+        entries = list(self._entries.items())
+        self._entries.clear()
+        self._locks.clear()
+        for key, entry in entries:
+            await self._disconnect(key, entry.client)
+
+    async def _disconnect(self, key, client):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.error(f"Ошибка при отключении клиента {key}: {e}")
+
+    def stats(self):
+        """
+        Возвращает счетчики пула.
+
+        Returns:
+            dict: Размер пула, попадания/промахи и задержка подключения
+        """
+        connects = self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'connect_failures': self.connect_failures,
+            'connect_avg_ms': (self.connect_time_total / connects * 1000) if connects else 0.0,
+            'connect_max_ms': self.connect_time_max * 1000,
+        }
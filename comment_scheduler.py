@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Планировщик комментариев с бюджетами аккаунтов.
+
+Комментарии от одного аккаунта слишком часто приводят к спам-блоку,
+поэтому у каждого юзербота есть дневной и часовой бюджет, минимальный
+интервал между комментариями и случайная добавка к нему. Все ожидающие
+комментарии обслуживает один цикл: куча аккаунтов упорядочена по времени,
+когда аккаунт снова может комментировать, а внутри аккаунта куча
+комментариев упорядочена по приоритету кампании - давно не обслуженные
+и раньше истекающие (paid_until) кампании идут первыми. Все операции
+очереди - O(log n), без спящей корутины на каждую кампанию.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from collections import Counter, deque
+
+from telethon.errors import PeerFloodError
+
+logger = logging.getLogger(__name__)
+
+# Бюджеты аккаунта
+COMMENT_DAILY_BUDGET = int(os.environ.get('COMMENT_DAILY_BUDGET', '40'))
+COMMENT_HOURLY_BUDGET = int(os.environ.get('COMMENT_HOURLY_BUDGET', '6'))
+COMMENT_MIN_SPACING = float(os.environ.get('COMMENT_MIN_SPACING', '180'))
+COMMENT_JITTER = float(os.environ.get('COMMENT_JITTER', '120'))  # случайная добавка к интервалу, до N секунд
+
+# Параметры очереди
+COMMENT_MAX_PENDING = int(os.environ.get('COMMENT_MAX_PENDING', '10000'))
+COMMENT_MAX_AGE = float(os.environ.get('COMMENT_MAX_AGE', '3600'))  # комментарий к старому посту не отправляется
+COMMENT_FLOOD_PAUSE = float(os.environ.get('COMMENT_FLOOD_PAUSE', str(6 * 3600)))  # пауза аккаунта после PeerFlood
+
+HOUR = 3600
+DAY = 24 * 3600
+
+
+class _Account:
+    """Бюджет и очередь комментариев одного юзербота."""
+
+    __slots__ = ('userbot_id', 'sent_day', 'sent_hour', 'next_at', 'queue', 'scheduled_at')
+
+    def __init__(self, userbot_id):
+        self.userbot_id = userbot_id
+        self.sent_day = deque()  # время отправки за последние сутки
+        self.sent_hour = deque()  # время отправки за последний час
+        self.next_at = 0.0  # не раньше: интервал с добавкой или пауза после PeerFlood
+        self.queue = []  # куча (время последнего обслуживания кампании, paid_until, порядковый номер, комментарий)
+        self.scheduled_at = None  # время записи аккаунта в общей куче
+
+    def available_at(self, now, daily, hourly):
+        """Ближайшее время, когда бюджет аккаунта позволяет отправить комментарий."""
+        while self.sent_day and self.sent_day[0] <= now - DAY:
+            self.sent_day.popleft()
+        while self.sent_hour and self.sent_hour[0] <= now - HOUR:
+            self.sent_hour.popleft()
+
+        at = self.next_at
+        if len(self.sent_hour) >= hourly:
+            at = max(at, self.sent_hour[-hourly] + HOUR)
+        if len(self.sent_day) >= daily:
+            at = max(at, self.sent_day[-daily] + DAY)
+        return at
+
+    def record(self, now, spacing, jitter):
+        self.sent_day.append(now)
+        self.sent_hour.append(now)
+        self.next_at = now + spacing + random.uniform(0, jitter)
+
+
+class _Comment:
+    __slots__ = ('campaign_id', 'paid_until', 'send', 'created_at')
+
+    def __init__(self, campaign_id, paid_until, send, created_at):
+        self.campaign_id = campaign_id
+        self.paid_until = paid_until
+        self.send = send
+        self.created_at = created_at
+
+
+class CommentScheduler:
+    """
+    Очередь комментариев всех юзерботов с одним циклом отправки.
+
+    Args:
+        daily_budget (int): Комментариев на аккаунт за сутки
+        hourly_budget (int): Комментариев на аккаунт за час
+        min_spacing (float): Минимальный интервал между комментариями аккаунта в секундах
+        jitter (float): Максимальная случайная добавка к интервалу в секундах
+        max_pending (int): Максимальное количество ожидающих комментариев
+    """
+
+    def __init__(self, daily_budget=COMMENT_DAILY_BUDGET, hourly_budget=COMMENT_HOURLY_BUDGET,
+                 min_spacing=COMMENT_MIN_SPACING, jitter=COMMENT_JITTER, max_pending=COMMENT_MAX_PENDING):
+        self.daily_budget = daily_budget
+        self.hourly_budget = hourly_budget
+        self.min_spacing = min_spacing
+        self.jitter = jitter
+        self.max_pending = max_pending
+
+        self._accounts = {}  # ID юзербота -> _Account
+        self._ready = []  # куча (время, ID юзербота)
+        self._served = {}  # ID кампании -> время последнего комментария
+        self._queued = Counter()  # ID кампании -> комментариев в очередях
+        self._forgotten = set()  # завершенные кампании, чьи комментарии еще лежат в очередях
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._inflight = set()
+        self.pending = 0
+
+        # Счетчики для мониторинга
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.expired = 0
+        self.cancelled = 0
+
+    def submit(self, userbot_id, campaign_id, paid_until, send):
+        """
+        Ставит комментарий в очередь аккаунта.
+
+        Args:
+            userbot_id (int): ID юзербота, от имени которого пишется комментарий
+            campaign_id (int): ID кампании
+            paid_until (datetime): Окончание оплаты кампании; раньше истекающие идут первыми
+            send (callable): Функция без аргументов, возвращающая корутину отправки
+
+        Returns:
+            bool: False, если очередь переполнена и комментарий отброшен
+        """
+        if self.pending >= self.max_pending:
+            self.dropped += 1
+            return False
+        # Кампания снова действует (например, продлена) - ее комментарии больше не отбрасываются
+        self._forgotten.discard(campaign_id)
+
+        now = time.monotonic()
+        account = self._accounts.get(userbot_id)
+        if account is None:
+            account = self._accounts[userbot_id] = _Account(userbot_id)
+        comment = _Comment(campaign_id, paid_until.timestamp(), send, now)
+        heapq.heappush(account.queue, self._priority(comment) + (comment,))
+        self._queued[campaign_id] += 1
+        self.pending += 1
+
+        if account.scheduled_at is None:
+            self._schedule(account, now)
+        return True
+
+    def _priority(self, comment):
+        return self._served.get(comment.campaign_id, 0.0), comment.paid_until, next(self._sequence)
+
+    def _schedule(self, account, now):
+        at = max(now, account.available_at(now, self.daily_budget, self.hourly_budget))
+        account.scheduled_at = at
+        heapq.heappush(self._ready, (at, account.userbot_id))
+        self._wakeup.set()
+
+    def _unqueue(self, account):
+        comment = heapq.heappop(account.queue)[-1]
+        self.pending -= 1
+        self._queued[comment.campaign_id] -= 1
+        if not self._queued[comment.campaign_id]:
+            del self._queued[comment.campaign_id]
+            self._forgotten.discard(comment.campaign_id)
+        return comment
+
+    def _next_comment(self, account, now):
+        """Берет самый приоритетный актуальный комментарий аккаунта, не расходуя бюджет на отброшенные."""
+        while account.queue:
+            served, _, _, comment = account.queue[0]
+            if comment.campaign_id in self._forgotten:
+                self._unqueue(account)
+                self.cancelled += 1
+                continue
+            if now - comment.created_at > COMMENT_MAX_AGE:
+                self._unqueue(account)
+                self.expired += 1
+                continue
+            # Кампанию обслужили после постановки: приоритет пересчитывается лениво
+            if self._served.get(comment.campaign_id, 0.0) != served:
+                heapq.heapreplace(account.queue, self._priority(comment) + (comment,))
+                continue
+            return self._unqueue(account)
+        return None
+
+    def _dispatch(self, account, now):
+        comment = self._next_comment(account, now)
+        if comment is None:
+            return
+        account.record(now, self.min_spacing, self.jitter)
+        self._served[comment.campaign_id] = now
+        task = asyncio.create_task(self._send(account, comment))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, account, comment):
+        try:
+            await comment.send()
+            self.sent += 1
+        except PeerFloodError:
+            self.failed += 1
+            account.next_at = max(account.next_at, time.monotonic() + COMMENT_FLOOD_PAUSE)
+            logger.warning(f"Юзербот {account.userbot_id} получил PeerFlood, комментарии приостановлены")
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Юзербот {account.userbot_id} не смог отправить комментарий: {e}")
+
+    async def run(self):
+        """Цикл отправки: берет аккаунт с ближайшим временем и отправляет его лучший комментарий."""
+        try:
+            while True:
+                self._wakeup.clear()
+                now = time.monotonic()
+                if not self._ready:
+                    await self._wakeup.wait()
+                    continue
+                at, userbot_id = self._ready[0]
+                if at > now:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), at - now)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                heapq.heappop(self._ready)
+                account = self._accounts[userbot_id]
+                account.scheduled_at = None
+                # Пауза после PeerFlood могла сдвинуть время аккаунта
+                if account.available_at(now, self.daily_budget, self.hourly_budget) <= now:
+                    self._dispatch(account, now)
+                if account.queue:
+                    self._schedule(account, now)
+                elif not account.sent_day and account.next_at <= now:
+                    del self._accounts[userbot_id]
+        finally:
+            for task in list(self._inflight):
+                task.cancel()
+
+    def forget_campaign(self, campaign_id):
+        """Отменяет ожидающие комментарии завершенной кампании: они отбрасываются до списания бюджета аккаунта."""
+        self._served.pop(campaign_id, None)
+        if campaign_id in self._queued:
+            self._forgotten.add(campaign_id)
+
+    def stats(self):
+        return {
+            'accounts': len(self._accounts),
+            'pending': self.pending,
+            'inflight': len(self._inflight),
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'cancelled': self.cancelled,
+        }
@@ -1,18 +1,63 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 from .models import Base 
 
 load_dotenv()
 
-DATABASE_URL = os.environ.get("DATABASE_URL")
+# Без DATABASE_URL (локальный запуск) используется файл SQLite
+DATABASE_URL = os.environ.get("DATABASE_URL") or "sqlite:///bot.db"
 
-engine = create_engine(DATABASE_URL)
+# Heroku выдает адрес со схемой postgres://, которую SQLAlchemy не принимает
+if DATABASE_URL.startswith("postgres://"):
+    DATABASE_URL = "postgresql://" + DATABASE_URL[len("postgres://"):]
+
+# Настройки пула соединений (для SQLite не применяются)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+
+def to_async_url(url):
+    """
+    Возвращает адрес базы данных с асинхронным драйвером.
+    
+    Args:
+        url (str): Адрес базы данных из DATABASE_URL
+        
+    Returns:
+        URL: Адрес с драйвером asyncpg для PostgreSQL или aiosqlite для SQLite
+    """
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        return url.set(drivername="postgresql+asyncpg")
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+def _engine_options(url):
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# Синхронный движок для скриптов обслуживания и создания схемы
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 Session = sessionmaker(bind=engine)
 
+# Асинхронный движок для обработчиков ботов: запросы не блокируют цикл событий
+async_engine = create_async_engine(to_async_url(DATABASE_URL), **_engine_options(DATABASE_URL))
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
 def init_db():
-    Base.metadata.create_all(engine)
+    """Создает или обновляет схему через миграции (database/migrations)."""
+    from .migrate import upgrade
+    upgrade()
 
 if __name__ == "__main__":
     init_db()
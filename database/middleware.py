@@ -0,0 +1,26 @@
+from aiogram import BaseMiddleware
+
+from .db import AsyncSession
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Открывает одну сессию базы данных на каждое обновление Telegram.
+
+    Сессия передается обработчикам в аргументе session. Если обработчик
+    завершился без ошибки, транзакция фиксируется, иначе откатывается;
+    соединение возвращается в пул в любом случае.
+    """
+
+    def __init__(self, session_factory=AsyncSession):
+        self.session_factory = session_factory
+
+    async def __call__(self, handler, event, data):
+        async with self.session_factory() as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            await session.commit()
+            return result
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Управление схемой базы данных через миграции Alembic.
+
+Использование:
+    python -m database.migrate upgrade      # применить все миграции
+    python -m database.migrate stamp 0001   # пометить базу как находящуюся на ревизии
+    python -m database.migrate check        # сравнить индексы моделей с живой схемой
+
+Базы, созданные раньше через Base.metadata.create_all, при первом
+upgrade дополняются до схемы ревизии 0001 (только ее таблицами,
+столбцами и индексами, см. adopt() в 0001_baseline.py) и помечаются
+этой ревизией, после чего к ним применяются остальные миграции.
+"""
+import argparse
+import os
+import sys
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect
+
+from .db import engine
+from .models import Base
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_REVISION = "0001"
+
+def alembic_config():
+    """Конфигурация Alembic, не зависящая от текущей директории."""
+    config = Config(os.path.join(ROOT_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT_DIR, "database", "migrations"))
+    return config
+
+def upgrade(revision="head"):
+    """
+    Применяет миграции до указанной ревизии.
+    
+    Args:
+        revision (str): Целевая ревизия
+    """
+    config = alembic_config()
+    tables = set(inspect(engine).get_table_names())
+    
+    if tables and "alembic_version" not in tables:
+        # База создана до появления миграций: приводим ее к исходной схеме и помечаем
+        print(f"База без истории миграций, помечаем ревизией {BASELINE_REVISION}")
+        baseline = ScriptDirectory.from_config(config).get_revision(BASELINE_REVISION).module
+        with engine.begin() as connection:
+            for name in baseline.adopt(connection):
+                print(f"Добавлено: {name}")
+        command.stamp(config, BASELINE_REVISION)
+    
+    command.upgrade(config, revision)
+
+def stamp(revision):
+    """Помечает базу ревизией без выполнения миграций."""
+    command.stamp(alembic_config(), revision)
+
+def missing_indexes():
+    """
+    Сравнивает индексы моделей с живой схемой.
+    
+    Returns:
+        list: Пары (таблица, имя индекса), отсутствующие в базе данных
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            missing.append((table.name, "<таблица отсутствует>"))
+            continue
+        
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        existing |= {constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                missing.append((table.name, index.name))
+    
+    return missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    upgrade_parser = subparsers.add_parser("upgrade", help="Применить миграции")
+    upgrade_parser.add_argument("revision", nargs="?", default="head", help="Целевая ревизия (по умолчанию head)")
+    
+    stamp_parser = subparsers.add_parser("stamp", help="Пометить базу ревизией без выполнения миграций")
+    stamp_parser.add_argument("revision", help="Ревизия, например 0001 или head")
+    
+    subparsers.add_parser("check", help="Показать индексы моделей, которых нет в базе")
+    
+    args = parser.parse_args()
+    
+    if args.command == "stamp":
+        stamp(args.revision)
+    elif args.command == "check":
+        missing = missing_indexes()
+        if not missing:
+            print("Все индексы моделей присутствуют в базе данных.")
+        else:
+            print("Отсутствуют в базе данных:")
+            for table_name, index_name in missing:
+                print(f"  {table_name}: {index_name}")
+            sys.exit(1)
+    else:
+        upgrade(getattr(args, "revision", "head"))
+        print("Миграции применены.")
@@ -0,0 +1,40 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from database.db import DATABASE_URL, engine
+from database.models import Base
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+    """Генерирует SQL миграций без подключения к базе данных."""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    """Применяет миграции через синхронный движок из database/db.py."""
+    with engine.connect() as connection:
+        # render_as_batch нужен SQLite, который не умеет изменять ограничения через ALTER TABLE
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
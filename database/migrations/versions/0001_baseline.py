@@ -0,0 +1,126 @@
+"""Исходная схема (то, что создавал Base.metadata.create_all)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateColumn
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+FREE_BOTS_WHERE = 'isoccupied = false AND lease_owner IS NULL'
+
+# Схема на момент появления миграций; не меняется вместе с моделями
+metadata = sa.MetaData()
+
+sa.Table(
+    'userbots', metadata,
+    sa.Column('id', sa.Integer(), primary_key=True),
+    sa.Column('owner_id', sa.BigInteger(), nullable=False),
+    sa.Column('account_id', sa.BigInteger(), nullable=False),
+    sa.Column('session_name', sa.String(), nullable=False),
+    sa.Column('session_string', sa.Text(), nullable=True),
+    sa.Column('display_name', sa.String(), nullable=True),
+    sa.Column('isoccupied', sa.Boolean(), nullable=False),
+    sa.Column('lease_owner', sa.BigInteger(), nullable=True),
+    sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.func.now()),
+    sa.Index('ix_userbots_free', 'id', postgresql_where=sa.text(FREE_BOTS_WHERE),
+             sqlite_where=sa.text(FREE_BOTS_WHERE)),
+)
+sa.Table(
+    'userbot_health', metadata,
+    sa.Column('userbot_id', sa.Integer(), sa.ForeignKey('userbots.id', ondelete='CASCADE'), primary_key=True),
+    sa.Column('is_authorized', sa.Boolean(), nullable=True),
+    sa.Column('is_restricted', sa.Boolean(), nullable=True),
+    sa.Column('spam_status', sa.String(), nullable=True),
+    sa.Column('flood_wait_until', sa.DateTime(), nullable=True),
+    sa.Column('last_check_at', sa.DateTime(), nullable=True),
+    sa.Column('last_latency_ms', sa.Integer(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+)
+sa.Table(
+    'users', metadata,
+    sa.Column('id', sa.Integer(), primary_key=True),
+    sa.Column('username', sa.String(), nullable=True),
+    sa.Column('telegram_id', sa.BigInteger(), nullable=False, unique=True),
+    sa.Column('balance', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.func.now()),
+)
+sa.Table(
+    'campaigns', metadata,
+    sa.Column('id', sa.Integer(), primary_key=True),
+    sa.Column('creator_id', sa.BigInteger(), sa.ForeignKey('users.telegram_id'), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('bot_id', sa.Integer(), sa.ForeignKey('userbots.id'), nullable=False),
+    sa.Column('paid_until', sa.DateTime(), nullable=False),
+    sa.Column('target', sa.String(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.func.now()),
+)
+sa.Table(
+    'peer_cache', metadata,
+    sa.Column('id', sa.Integer(), primary_key=True),
+    sa.Column('account', sa.String(), nullable=False),
+    sa.Column('peer_type', sa.String(), nullable=False),
+    sa.Column('peer_id', sa.BigInteger(), nullable=False),
+    sa.Column('access_hash', sa.BigInteger(), nullable=True),
+    sa.Column('username', sa.String(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.UniqueConstraint('account', 'peer_id', name='uq_peer_cache_account_peer'),
+    sa.Index('ix_peer_cache_account_username', 'account', 'username'),
+)
+
+
+def upgrade():
+    metadata.create_all(op.get_bind(), checkfirst=False)
+
+
+def downgrade():
+    metadata.drop_all(op.get_bind(), checkfirst=False)
+
+
+def adopt(connection):
+    """
+    Дополняет базу, созданную до миграций, до этой схемы.
+
+    Такие базы создавались create_all в разных версиях моделей, поэтому в них
+    может не быть части таблиц, столбцов (session_string, аренда) и индексов.
+    Добавляется только недостающее из схемы 0001, а не из текущих моделей:
+    остальное делают следующие миграции.
+
+    Args:
+        connection (Connection): Соединение внутри транзакции
+
+    Returns:
+        list: Добавленные объекты в виде "таблица.имя"
+    """
+    inspector = sa.inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            table.create(connection)
+            added.append(table.name)
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+                added.append(f"{table.name}.{column.name}")
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(connection)
+                added.append(f"{table.name}.{index.name}")
+
+    return added
@@ -0,0 +1,35 @@
+"""Индексы для частых запросов и уникальность userbots.account_id
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:30:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_campaigns_creator_id', 'campaigns', ['creator_id'])
+    op.create_index('ix_campaigns_paid_until', 'campaigns', ['paid_until'])
+
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT account_id FROM userbots GROUP BY account_id HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            f"Несколько записей userbots с одинаковым account_id: {duplicates}. "
+            f"Удалите дубликаты и повторите миграцию."
+        )
+    op.create_index('uq_userbots_account_id', 'userbots', ['account_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_userbots_account_id', table_name='userbots')
+    op.drop_index('ix_campaigns_paid_until', table_name='campaigns')
+    op.drop_index('ix_campaigns_creator_id', table_name='campaigns')
@@ -0,0 +1,33 @@
+"""Журнал операций с балансом
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 14:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'balance_transactions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('users.telegram_id'), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('idempotency_key', sa.String(), nullable=True, unique=True),
+        sa.Column('balance_after', sa.Float(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.func.now()),
+    )
+    op.create_index('ix_balance_transactions_user_id', 'balance_transactions', ['user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_balance_transactions_user_id', table_name='balance_transactions')
+    op.drop_table('balance_transactions')
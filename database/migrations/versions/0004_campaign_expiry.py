@@ -0,0 +1,44 @@
+"""Освобождение ботов истекших кампаний и журнал обходов
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 15:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+UNRELEASED_WHERE = 'released_at IS NULL'
+
+
+def upgrade():
+    with op.batch_alter_table('campaigns') as batch_op:
+        batch_op.add_column(sa.Column('released_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_campaigns_unreleased_paid_until', 'campaigns', ['paid_until', 'id'],
+        postgresql_where=sa.text(UNRELEASED_WHERE),
+        sqlite_where=sa.text(UNRELEASED_WHERE),
+    )
+
+    op.create_table(
+        'sweep_runs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('campaigns_expired', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('bots_released', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('owners_notified', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('error', sa.String(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('sweep_runs')
+    op.drop_index('ix_campaigns_unreleased_paid_until', table_name='campaigns')
+    with op.batch_alter_table('campaigns') as batch_op:
+        batch_op.drop_column('released_at')
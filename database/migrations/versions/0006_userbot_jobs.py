@@ -0,0 +1,48 @@
+"""Очередь заданий юзерботов
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 17:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+READY_WHERE = "status IN ('queued', 'running')"
+
+
+def upgrade():
+    op.create_table(
+        'userbot_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('userbot_id', sa.Integer(), sa.ForeignKey('userbots.id', ondelete='CASCADE'), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('run_after', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('chat_id', sa.BigInteger(), nullable=True),
+        sa.Column('user_id', sa.BigInteger(), nullable=True),
+        sa.Column('message_id', sa.BigInteger(), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.func.now()),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index(
+        'ix_userbot_jobs_ready', 'userbot_jobs', ['status', 'run_after'],
+        postgresql_where=sa.text(READY_WHERE),
+        sqlite_where=sa.text(READY_WHERE),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_userbot_jobs_ready', table_name='userbot_jobs')
+    op.drop_table('userbot_jobs')
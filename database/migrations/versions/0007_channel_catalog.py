@@ -0,0 +1,41 @@
+"""Каталог каналов по категориям
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 18:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'channel_catalog',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('channel_id', sa.BigInteger(), nullable=True, unique=True),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('linked_chat_id', sa.BigInteger(), nullable=True),
+        sa.Column('category', sa.String(), nullable=False),
+        sa.Column('subscribers', sa.Integer(), nullable=True),
+        sa.Column('last_post_at', sa.DateTime(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=False, server_default=sa.true()),
+        sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+    )
+    op.create_index('ix_channel_catalog_username', 'channel_catalog', ['username'])
+    op.create_index('ix_channel_catalog_category_subscribers', 'channel_catalog', ['category', 'subscribers'])
+    op.create_index('ix_channel_catalog_refreshed_at', 'channel_catalog', ['refreshed_at'])
+
+
+def downgrade():
+    op.drop_index('ix_channel_catalog_refreshed_at', table_name='channel_catalog')
+    op.drop_index('ix_channel_catalog_category_subscribers', table_name='channel_catalog')
+    op.drop_index('ix_channel_catalog_username', table_name='channel_catalog')
+    op.drop_table('channel_catalog')
@@ -0,0 +1,27 @@
+"""Каналы каталога, в которые вступили юзерботы
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 19:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'userbot_channel_joins',
+        sa.Column('userbot_id', sa.Integer(), sa.ForeignKey('userbots.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('channel_id', sa.BigInteger(), primary_key=True),
+        sa.Column('joined_at', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('userbot_channel_joins')
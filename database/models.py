@@ -1,20 +1,47 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, BigInteger, TIMESTAMP, func, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, BigInteger, TIMESTAMP, func, Float, DateTime, ForeignKey, Boolean, Text, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
 class UserBot(Base):
     __tablename__ = 'userbots'
+    __table_args__ = (
+        # Частичный индекс по свободным ботам: выделение бота не сканирует всю таблицу
+        Index('ix_userbots_free', 'id', postgresql_where=text('isoccupied = false AND lease_owner IS NULL'),
+              sqlite_where=text('isoccupied = false AND lease_owner IS NULL')),
+        # Один аккаунт Telegram - одна запись; по account_id ищется запись при загрузке файла сессии
+        Index('uq_userbots_account_id', 'account_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     owner_id = Column(BigInteger, nullable=False)
     account_id = Column(BigInteger, nullable=False)  # Новый столбец для ID аккаунта
     session_name = Column(String, nullable=False)
+    session_string = Column(Text, nullable=True)  # Зашифрованная StringSession (предпочтительнее файла сессии)
     display_name = Column(String, nullable=True)  # Отображаемое имя бота
     isoccupied = Column(Boolean, default=False, nullable=False)  # Столбец для отслеживания статуса занятости бота
+    lease_owner = Column(BigInteger, nullable=True)  # Telegram ID пользователя, за которым бот временно закреплен
+    lease_expires_at = Column(DateTime, nullable=True)  # Когда аренда истекает, если ее не продлить
     created_at = Column(TIMESTAMP, server_default=func.now())
 
+    # Результат последней фоновой проверки аккаунта
+    health = relationship("UserBotHealth", uselist=False, back_populates="userbot", cascade="all, delete-orphan")
+
+class UserBotHealth(Base):
+    __tablename__ = 'userbot_health'
+
+    userbot_id = Column(Integer, ForeignKey('userbots.id', ondelete='CASCADE'), primary_key=True)
+    is_authorized = Column(Boolean, nullable=True)  # Сессия авторизована
+    is_restricted = Column(Boolean, nullable=True)  # Аккаунт ограничен Telegram
+    spam_status = Column(String, nullable=True)  # Ответ SpamBot: ok, limited, answered, unknown
+    flood_wait_until = Column(DateTime, nullable=True)  # До какого времени действует FloodWait
+    last_check_at = Column(DateTime, nullable=True)
+    last_latency_ms = Column(Integer, nullable=True)  # Длительность последней проверки
+    last_error = Column(String, nullable=True)
+
+    userbot = relationship("UserBot", back_populates="health")
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -26,15 +53,119 @@ class User(Base):
 
 class Campaign(Base):
     __tablename__ = 'campaigns'
+    __table_args__ = (
+        # Частичный индекс для поиска истекших, но еще не освобожденных кампаний по (paid_until, id)
+        Index('ix_campaigns_unreleased_paid_until', 'paid_until', 'id', postgresql_where=text('released_at IS NULL'),
+              sqlite_where=text('released_at IS NULL')),
+    )
 
     id = Column(Integer, primary_key=True)
-    creator_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False)
+    creator_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False, index=True)
     name = Column(String, nullable=False)
     bot_id = Column(Integer, ForeignKey('userbots.id'), nullable=False)
-    paid_until = Column(DateTime, nullable=False)
+    paid_until = Column(DateTime, nullable=False, index=True)
     target = Column(String, nullable=False)  # Целевые каналы/группы для комментирования
+    released_at = Column(DateTime, nullable=True)  # Когда после истечения оплаты бот кампании был освобожден
     created_at = Column(TIMESTAMP, server_default=func.now())
     
     # Отношения
     creator = relationship("User", foreign_keys=[creator_id])
     bot = relationship("UserBot", foreign_keys=[bot_id])
+
+class PeerCacheEntry(Base):
+    __tablename__ = 'peer_cache'
+    __table_args__ = (
+        UniqueConstraint('account', 'peer_id', name='uq_peer_cache_account_peer'),
+        Index('ix_peer_cache_account_username', 'account', 'username'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    account = Column(String, nullable=False)  # Имя сессии аккаунта, для которого действует access_hash
+    peer_type = Column(String, nullable=False)  # user, chat или channel
+    peer_id = Column(BigInteger, nullable=False)
+    access_hash = Column(BigInteger, nullable=True)  # У обычных групп (chat) access_hash нет
+    username = Column(String, nullable=True)  # В нижнем регистре, без @
+    updated_at = Column(DateTime, nullable=False)
+
+class BalanceTransaction(Base):
+    __tablename__ = 'balance_transactions'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False, index=True)
+    amount = Column(Float, nullable=False)  # Положительная сумма - пополнение, отрицательная - списание
+    kind = Column(String, nullable=False)  # campaign, refund, topup
+    idempotency_key = Column(String, nullable=True, unique=True)  # Повторная операция с тем же ключом отклоняется
+    balance_after = Column(Float, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+class SweepRun(Base):
+    __tablename__ = 'sweep_runs'
+
+    id = Column(Integer, primary_key=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    campaigns_expired = Column(Integer, default=0, nullable=False)  # Кампаний помечено освобожденными
+    bots_released = Column(Integer, default=0, nullable=False)  # Юзерботов возвращено в пул
+    owners_notified = Column(Integer, default=0, nullable=False)
+    error = Column(String, nullable=True)
+
+class FsmState(Base):
+    __tablename__ = 'fsm_states'
+
+    key = Column(String, primary_key=True)  # bot_id:chat_id:user_id:thread_id:business_connection_id:destiny
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)  # Компактный JSON данных мастера
+    updated_at = Column(DateTime, nullable=False)
+
+class UserbotJob(Base):
+    __tablename__ = 'userbot_jobs'
+    __table_args__ = (
+        # Выборка готовых заданий не сканирует выполненные
+        Index('ix_userbot_jobs_ready', 'status', 'run_after', postgresql_where=text("status IN ('queued', 'running')"),
+              sqlite_where=text("status IN ('queued', 'running')")),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # Тип задания, определяет обработчик
+    userbot_id = Column(Integer, ForeignKey('userbots.id', ondelete='CASCADE'), nullable=True)
+    payload = Column(Text, nullable=False)  # Параметры задания в JSON
+    status = Column(String, nullable=False)  # queued, running, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, nullable=False)
+    run_after = Column(DateTime, nullable=False)  # Не запускать раньше (отложенный повтор)
+    locked_until = Column(DateTime, nullable=True)  # Выполняющееся задание считается брошенным после этого времени
+    chat_id = Column(BigInteger, nullable=True)  # Чат и сообщение с ходом выполнения
+    user_id = Column(BigInteger, nullable=True)
+    message_id = Column(BigInteger, nullable=True)
+    result = Column(Text, nullable=True)  # Результат обработчика в JSON
+    error = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    finished_at = Column(DateTime, nullable=True)
+
+class ChannelCatalog(Base):
+    __tablename__ = 'channel_catalog'
+    __table_args__ = (
+        # Каналы категории по убыванию аудитории - один проход по индексу
+        Index('ix_channel_catalog_category_subscribers', 'category', 'subscribers'),
+        # Краулер берет самые давно обновленные записи
+        Index('ix_channel_catalog_refreshed_at', 'refreshed_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    channel_id = Column(BigInteger, nullable=True, unique=True)  # Заполняется краулером после разрешения username
+    username = Column(String, nullable=True, index=True)  # В нижнем регистре, без @
+    title = Column(String, nullable=True)
+    linked_chat_id = Column(BigInteger, nullable=True)  # Группа обсуждения; без нее комментировать нельзя
+    category = Column(String, nullable=False)  # Одна из категорий мастера создания кампании
+    subscribers = Column(Integer, nullable=True)
+    last_post_at = Column(DateTime, nullable=True)
+    is_active = Column(Boolean, default=True, nullable=False)  # Канал доступен для комментирования
+    refreshed_at = Column(DateTime, nullable=True)  # Последнее обновление краулером
+    error = Column(String, nullable=True)
+
+class UserbotChannelJoin(Base):
+    __tablename__ = 'userbot_channel_joins'
+
+    userbot_id = Column(Integer, ForeignKey('userbots.id', ondelete='CASCADE'), primary_key=True)
+    channel_id = Column(BigInteger, primary_key=True)  # Канал каталога, в который бот вступил сам
+    joined_at = Column(DateTime, nullable=False)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Постоянные хранилища состояний FSM для aiogram.
+
+Состояние и данные мастера хранятся одной записью на ключ: в таблице
+fsm_states (SQLStorage) или в одном значении Redis (RedisProtocolStorage),
+поэтому перезапуск бота не сбрасывает начатые мастера, а несколько
+процессов бота могут работать с одним токеном. Данные сериализуются в
+компактный JSON (datetime сохраняется с тегом). Чтения, пришедшие за одну
+итерацию цикла событий, объединяются в один запрос, а прочитанные записи
+недолго кэшируются в памяти процесса.
+
+Хранилище выбирается переменной окружения FSM_STORAGE:
+sql (по умолчанию), redis, redis-local (Redis внутри процесса) или memory.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.db import AsyncSession
+from database.models import FsmState
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+FSM_STORAGE = os.environ.get('FSM_STORAGE', 'sql')
+# Время жизни записи в кэше процесса; 0 отключает кэш (например, без привязки чатов к процессам)
+FSM_CACHE_TTL = float(os.environ.get('FSM_CACHE_TTL', '10'))
+# Время жизни записи в Redis: брошенные мастера удаляются сами
+FSM_REDIS_TTL = int(os.environ.get('FSM_REDIS_TTL', str(7 * 24 * 3600)))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Запись без состояния и данных
+_EMPTY = (None, None)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в данные FSM")
+
+
+def _object_hook(value):
+    if len(value) == 1 and '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    return value
+
+
+def encode_data(data):
+    """Сериализует данные FSM в компактный JSON или None для пустых данных."""
+    if not data:
+        return None
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=_default)
+
+
+def decode_data(raw):
+    """Восстанавливает данные FSM из JSON."""
+    if not raw:
+        return {}
+    return json.loads(raw, object_hook=_object_hook)
+
+
+def record_key(key):
+    """Строковый ключ записи для StorageKey aiogram."""
+    return ':'.join(str(part) if part is not None else '' for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+    ))
+
+
+class _RecordStorage(BaseStorage):
+    """
+    Общая часть постоянных хранилищ: кэш, объединение чтений и сериализация.
+
+    Наследники реализуют _fetch_many(keys) -> {ключ: (состояние, JSON данных)}
+    и _write(ключ, состояние, JSON данных), где (None, None) означает удаление.
+    """
+
+    def __init__(self, cache_ttl=FSM_CACHE_TTL):
+        self._cache = TTLCache(cache_ttl) if cache_ttl > 0 else None
+        self._pending = {}
+        # Ключи, которые сейчас читаются, и те из них, что были записаны во время чтения:
+        # прочитанное до записи значение не должно попасть в кэш
+        self._loading = set()
+        self._written_while_loading = set()
+
+        # Счетчики для мониторинга
+        self.batches = 0
+        self.records_loaded = 0
+        self.writes = 0
+
+    async def _get_record(self, key):
+        key = record_key(key)
+        if self._cache is not None:
+            record = self._cache.get(key)
+            if record is not None:
+                return record
+
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending:
+                # Запрос уходит на следующей итерации цикла и забирает все ключи, накопленные к этому моменту
+                loop.create_task(self._flush())
+            future = self._pending[key] = loop.create_future()
+        return await future
+
+    async def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._loading.update(pending)
+        try:
+            records = await self._fetch_many(list(pending))
+        except Exception as e:
+            logger.error(f"Ошибка при чтении состояний FSM: {e}")
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._loading.difference_update(pending)
+            stale = self._written_while_loading & pending.keys()
+            self._written_while_loading -= stale
+
+        self.batches += 1
+        self.records_loaded += len(pending)
+        for key, future in pending.items():
+            record = records.get(key, _EMPTY)
+            if self._cache is not None and key not in stale:
+                self._cache.set(key, record)
+            if not future.done():
+                future.set_result(record)
+
+    async def _put_record(self, key, state, data):
+        key = record_key(key)
+        if key in self._loading:
+            self._written_while_loading.add(key)
+        if self._cache is not None:
+            self._cache.pop(key)
+        await self._write(key, state, data)
+        self.writes += 1
+        if self._cache is not None:
+            self._cache.set(key, (state, data))
+
+    async def set_state(self, key, state=None):
+        _, data = await self._get_record(key)
+        await self._put_record(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key):
+        state, _ = await self._get_record(key)
+        return state
+
+    async def set_data(self, key, data):
+        state, _ = await self._get_record(key)
+        await self._put_record(key, state, encode_data(data))
+
+    async def get_data(self, key):
+        _, data = await self._get_record(key)
+        return decode_data(data)
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        stats = {'batches': self.batches, 'records_loaded': self.records_loaded, 'writes': self.writes}
+        if self._cache is not None:
+            stats.update(self._cache.stats())
+        return stats
+
+
+class SQLStorage(_RecordStorage):
+    """
+    Хранилище FSM в таблице fsm_states.
+
+    Args:
+        session_factory: Фабрика асинхронных сессий SQLAlchemy
+        cache_ttl (float): Время жизни записи в кэше процесса в секундах
+    """
+
+    def __init__(self, session_factory=AsyncSession, cache_ttl=FSM_CACHE_TTL):
+        super().__init__(cache_ttl)
+        self.session_factory = session_factory
+
+    async def _fetch_many(self, keys):
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(FsmState.key, FsmState.state, FsmState.data).where(FsmState.key.in_(keys))
+            )).all()
+        return {row.key: (row.state, row.data) for row in rows}
+
+    async def _write(self, key, state, data):
+        async with self.session_factory() as session:
+            if state is None and data is None:
+                await session.execute(delete(FsmState).where(FsmState.key == key))
+            else:
+                values = {'key': key, 'state': state, 'data': data, 'updated_at': datetime.now()}
+                dialect = session.get_bind().dialect.name
+                if dialect in ('postgresql', 'sqlite'):
+                    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+                    statement = insert(FsmState).values(**values)
+                    await session.execute(statement.on_conflict_do_update(
+                        index_elements=[FsmState.key],
+                        set_={'state': state, 'data': data, 'updated_at': values['updated_at']}
+                    ))
+                else:
+                    await session.merge(FsmState(**values))
+            await session.commit()
+
+
+class RedisProtocolStorage(_RecordStorage):
+    """
+    Хранилище FSM поверх клиента с командами Redis GET/SET/MGET/DELETE.
+
+    Запись хранится одним значением [состояние,данные], где данные
+    встроены в JSON без повторного экранирования.
+
+    Args:
+        redis: Клиент redis.asyncio.Redis или InMemoryRedis
+        prefix (str): Префикс ключей
+        state_ttl (int): Время жизни записи в Redis в секундах (0 - без ограничения)
+        cache_ttl (float): Время жизни записи в кэше процесса в секундах
+    """
+
+    def __init__(self, redis, prefix='fsm', state_ttl=FSM_REDIS_TTL, cache_ttl=FSM_CACHE_TTL):
+        super().__init__(cache_ttl)
+        self.redis = redis
+        self.prefix = prefix
+        self.state_ttl = state_ttl
+
+    def _name(self, key):
+        return f"{self.prefix}:{key}"
+
+    async def _fetch_many(self, keys):
+        values = await self.redis.mget([self._name(key) for key in keys])
+        records = {}
+        for key, value in zip(keys, values):
+            if value is None:
+                continue
+            if isinstance(value, bytes):
+                value = value.decode()
+            # Значение имеет вид [состояние,данные]: разбираем только состояние, данные остаются строкой
+            state, end = json.JSONDecoder().raw_decode(value, 1)
+            data = value[end + 1:-1]
+            records[key] = (state, None if data == 'null' else data)
+        return records
+
+    async def _write(self, key, state, data):
+        if state is None and data is None:
+            await self.redis.delete(self._name(key))
+            return
+        value = f"[{json.dumps(state, ensure_ascii=False)},{data or 'null'}]"
+        await self.redis.set(self._name(key), value, ex=self.state_ttl or None)
+
+    async def close(self):
+        close = getattr(self.redis, 'aclose', None) or getattr(self.redis, 'close', None)
+        if close:
+            await close()
+
+
+class InMemoryRedis:
+    """
+    Замена Redis внутри процесса с командами GET/SET/MGET/DELETE.
+
+    Подходит для одного процесса бота и для проверки RedisProtocolStorage
+    без сервера Redis.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def _alive(self, name):
+        entry = self._values.get(name)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._values[name]
+            return None
+        return value
+
+    async def get(self, name):
+        return self._alive(name)
+
+    async def mget(self, names):
+        return [self._alive(name) for name in names]
+
+    async def set(self, name, value, ex=None):
+        self._values[name] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    async def delete(self, *names):
+        return sum(1 for name in names if self._values.pop(name, None) is not None)
+
+    async def aclose(self):
+        pass
+
+
+def create_storage(kind=FSM_STORAGE):
+    """
+    Создает хранилище FSM по названию.
+
+    Args:
+        kind (str): sql, redis, redis-local или memory
+
+    Returns:
+        BaseStorage: Хранилище для Dispatcher
+    """
+    if kind == 'memory':
+        return MemoryStorage()
+    if kind == 'redis-local':
+        return RedisProtocolStorage(InMemoryRedis())
+    if kind == 'redis':
+        try:
+            from redis.asyncio import Redis
+        except ImportError:
+            raise RuntimeError("Для FSM_STORAGE=redis установите пакет redis")
+        return RedisProtocolStorage(Redis.from_url(REDIS_URL))
+    if kind != 'sql':
+        logger.warning(f"Неизвестное хранилище FSM {kind}, используется sql")
+    return SQLStorage()
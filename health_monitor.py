@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Фоновый мониторинг состояния всех юзерботов.
+
+Монитор периодически обходит все записи UserBot с ограниченной
+параллельностью и случайной задержкой, проверяет авторизацию, ограничения
+аккаунта и FloodWait и сохраняет результат в таблицу userbot_health.
+Выбор свободного бота и экран "Статус" в админ-боте читают эту таблицу
+вместо обращения к Telegram.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from telethon.errors import FloodWaitError, UnauthorizedError
+
+from database.db import AsyncSession
+from database.models import UserBot, UserBotHealth
+from sqlalchemy import select
+from rpc_scheduler import rpc_scheduler
+from userbot_manager import client_pool, connect_failures, check_spambot, extract_session_name
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Параметры мониторинга
+HEALTH_CHECK_INTERVAL = int(os.environ.get('HEALTH_CHECK_INTERVAL', '1800'))  # секунд между обходами
+HEALTH_CHECK_CONCURRENCY = int(os.environ.get('HEALTH_CHECK_CONCURRENCY', '5'))
+HEALTH_CHECK_JITTER = float(os.environ.get('HEALTH_CHECK_JITTER', '10'))  # максимальная задержка перед проверкой
+HEALTH_CHECK_SPAMBOT = os.environ.get('HEALTH_CHECK_SPAMBOT', '0') == '1'
+
+
+async def check_userbot_health(userbot_id, session_name, session_string, check_spam=HEALTH_CHECK_SPAMBOT):
+    """
+    Проверяет один аккаунт.
+
+    Клиент берется из общего пула, чтобы не открывать второе подключение
+    к аккаунту, которым процесс уже пользуется. Недействительной сессия
+    считается только при отказе в авторизации; сетевой сбой записывается
+    в last_error и не меняет is_authorized.
+
+    Args:
+        userbot_id (int): ID юзербота в базе данных
+        session_name (str): Имя или URL сессии
+        session_string (str): Зашифрованная StringSession или None
+        check_spam (bool): Дополнительно опрашивать @SpamBot
+
+    Returns:
+        dict: Значения для записи UserBotHealth
+    """
+    result = {
+        'userbot_id': userbot_id,
+        'is_restricted': None,
+        'spam_status': None,
+        'flood_wait_until': None,
+        'last_error': None,
+    }
+    started = time.monotonic()
+    account = extract_session_name(session_name)
+
+    async with client_pool.acquire(session_name, session_string=session_string) as client:
+        if client is None:
+            rejected, error = connect_failures.get(account) or (False, "Не удалось подключиться")
+            # Без ключа is_authorized запись сохраняет результат предыдущей проверки
+            if rejected:
+                result['is_authorized'] = False
+            result['last_error'] = error
+        else:
+            result['is_authorized'] = True
+            try:
+                me = await rpc_scheduler.call(account, 'default', lambda: client.get_me())
+                result['is_restricted'] = bool(getattr(me, 'restricted', False))
+                if check_spam:
+                    result['spam_status'], _ = await check_spambot(client, account)
+            except UnauthorizedError as e:
+                result['is_authorized'] = False
+                result['last_error'] = str(e)[:255]
+                await client_pool.discard(session_name)
+            except FloodWaitError as e:
+                result['flood_wait_until'] = datetime.now() + timedelta(seconds=e.seconds)
+                result['last_error'] = f"FloodWait {e.seconds} с"
+            except Exception as e:
+                result['last_error'] = str(e)[:255]
+
+    # Аккаунт мог быть припаркован планировщиком из-за FloodWait в других запросах
+    parked_for = rpc_scheduler.parked_for(account)
+    if parked_for and not result['flood_wait_until']:
+        result['flood_wait_until'] = datetime.now() + timedelta(seconds=parked_for)
+
+    result['last_check_at'] = datetime.now()
+    result['last_latency_ms'] = int((time.monotonic() - started) * 1000)
+    return result
+
+
+async def sweep(concurrency=HEALTH_CHECK_CONCURRENCY, jitter=HEALTH_CHECK_JITTER):
+    """
+    Проверяет все аккаунты и сохраняет результаты.
+
+    Returns:
+        list: Результаты проверок
+    """
+    async with AsyncSession() as session:
+        userbots = (await session.execute(
+            select(UserBot.id, UserBot.session_name, UserBot.session_string)
+        )).all()
+
+    if not userbots:
+        return []
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def check(userbot_id, session_name, session_string):
+        # Случайная задержка размазывает подключения во времени
+        await asyncio.sleep(random.uniform(0, jitter))
+        async with semaphore:
+            try:
+                return await check_userbot_health(userbot_id, session_name, session_string)
+            except Exception as e:
+                logger.error(f"Ошибка при проверке юзербота {userbot_id}: {e}")
+                return None
+
+    started = time.monotonic()
+    results = await asyncio.gather(*(check(*userbot) for userbot in userbots))
+    results = [result for result in results if result]
+
+    session = AsyncSession()
+    try:
+        for result in results:
+            await session.merge(UserBotHealth(**result))
+        await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении результатов проверки: {e}")
+        await session.rollback()
+    finally:
+        await session.close()
+
+    alive = sum(1 for result in results if result.get('is_authorized') and not result['is_restricted'])
+    logger.info(
+        f"Проверено юзерботов: {len(results)} за {time.monotonic() - started:.1f} с, "
+        f"доступно: {alive}, недоступно: {len(results) - alive}"
+    )
+    return results
+
+
+async def run_health_monitor(interval=HEALTH_CHECK_INTERVAL):
+    """Бесконечный цикл обхода аккаунтов."""
+    while True:
+        try:
+            await sweep()
+        except Exception as e:
+            logger.error(f"Ошибка мониторинга юзерботов: {e}")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Мониторинг состояния юзерботов")
+    parser.add_argument("--once", action="store_true", help="Выполнить один обход и завершиться")
+    args = parser.parse_args()
+
+    async def main():
+        try:
+            if args.once:
+                await sweep()
+            else:
+                await run_health_monitor()
+        finally:
+            await client_pool.close()
+
+    asyncio.run(main())
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Очередь фоновых заданий юзерботов.
+
+Медленные операции через Telethon (смена профиля, проверка прав в канале)
+не выполняются в обработчике aiogram: обработчик кладет задание в таблицу
+userbot_jobs в своей транзакции и сразу отвечает сообщением о ходе работы.
+Пул исполнителей забирает задания через FOR UPDATE SKIP LOCKED, повторяет
+упавшие с растущей задержкой и по завершении вызывает хук, который
+редактирует это сообщение. Задание, исполнитель которого упал, снова
+становится доступным после истечения locked_until.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, event, func, or_, select, update
+from sqlalchemy.orm import Session as SyncSession
+
+from database.db import AsyncSession
+from database.models import UserbotJob
+
+logger = logging.getLogger(__name__)
+
+# Параметры исполнителей
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', '5'))  # задержка первого повтора, дальше удваивается
+JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', '300'))
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', str(7 * 24 * 3600)))  # сколько хранить завершенные задания
+
+# Обработчики по типу задания
+_handlers = {}
+
+# Будит исполнителей, когда в этом процессе зафиксировано новое задание
+_wakeup = None
+
+
+class RetryJob(Exception):
+    """Временная ошибка задания: оно будет повторено, пока не исчерпаны попытки."""
+
+
+def job_handler(kind):
+    """
+    Регистрирует обработчик заданий.
+
+    Обработчик вызывается как handler(session, job, payload) и возвращает
+    результат, сериализуемый в JSON. Исключение означает неудачную попытку.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+async def enqueue(session, kind, payload=None, userbot_id=None, chat_id=None, user_id=None, message_id=None,
+                  max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Добавляет задание в транзакции текущего обновления.
+
+    Args:
+        session (AsyncSession): Сессия базы данных текущего обновления
+        kind (str): Тип задания
+        payload (dict): Параметры задания
+        userbot_id (int): ID юзербота
+        chat_id (int): Чат сообщения о ходе выполнения
+        user_id (int): Telegram ID пользователя
+        message_id (int): ID сообщения о ходе выполнения
+        max_attempts (int): Максимальное количество попыток
+
+    Returns:
+        int: ID задания
+    """
+    job = UserbotJob(
+        kind=kind,
+        payload=json.dumps(payload or {}, ensure_ascii=False),
+        userbot_id=userbot_id,
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts,
+        run_after=datetime.now(),
+        chat_id=chat_id,
+        user_id=user_id,
+        message_id=message_id
+    )
+    session.add(job)
+    await session.flush()
+    session.sync_session.info['jobs_enqueued'] = True
+    return job.id
+
+
+@event.listens_for(SyncSession, 'after_commit')
+def _wake_after_commit(session):
+    if session.info.pop('jobs_enqueued', False) and _wakeup is not None:
+        _wakeup.set()
+
+
+def _ready(now):
+    """Задание ждет запуска или брошено упавшим исполнителем."""
+    return or_(
+        and_(UserbotJob.status == 'queued', UserbotJob.run_after <= now),
+        and_(UserbotJob.status == 'running', UserbotJob.locked_until < now)
+    )
+
+
+async def _claim(session, partition=None):
+    now = datetime.now()
+    condition = _ready(now)
+    if partition:
+        # Тот же остаток от деления, что и при выборе процесса по chat_id в webhook_server
+        index, count = partition
+        condition = and_(condition, (func.coalesce(UserbotJob.chat_id, 0) % count + count) % count == index)
+
+    candidate = (
+        select(UserbotJob.id)
+        .where(condition)
+        .order_by(UserbotJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return (await session.execute(
+        update(UserbotJob)
+        .where(UserbotJob.id == candidate, _ready(now))
+        .values(
+            status='running',
+            attempts=UserbotJob.attempts + 1,
+            locked_until=now + timedelta(seconds=JOB_LOCK_TIMEOUT)
+        )
+        .returning(
+            UserbotJob.id, UserbotJob.kind, UserbotJob.userbot_id, UserbotJob.payload, UserbotJob.attempts,
+            UserbotJob.max_attempts, UserbotJob.chat_id, UserbotJob.user_id, UserbotJob.message_id
+        )
+    )).first()
+
+
+async def _run_job(job, on_finished):
+    handler = _handlers.get(job.kind)
+    result = error = None
+
+    async with AsyncSession() as session:
+        try:
+            if handler is None:
+                raise LookupError(f"Нет обработчика заданий {job.kind}")
+            result = await handler(session, job, json.loads(job.payload))
+            await session.execute(
+                update(UserbotJob)
+                .where(UserbotJob.id == job.id)
+                .values(status='done', result=json.dumps(result, ensure_ascii=False), finished_at=datetime.now(),
+                        locked_until=None, error=None)
+            )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            error = str(e)[:255] or type(e).__name__
+            final = handler is None or job.attempts >= job.max_attempts
+            if final:
+                values = {'status': 'failed', 'finished_at': datetime.now()}
+                logger.error(f"Задание {job.id} ({job.kind}) не выполнено за {job.attempts} попыток: {error}")
+            else:
+                delay = JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+                values = {'status': 'queued', 'run_after': datetime.now() + timedelta(seconds=delay)}
+                logger.warning(f"Задание {job.id} ({job.kind}) будет повторено через {delay:.0f} с: {error}")
+            await session.execute(
+                update(UserbotJob).where(UserbotJob.id == job.id).values(locked_until=None, error=error, **values)
+            )
+            await session.commit()
+            if not final:
+                return
+
+    if on_finished:
+        try:
+            await on_finished(job, result, error)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике завершения задания {job.id}: {e}")
+
+
+async def purge_finished_jobs(retention=JOB_RETENTION):
+    """
+    Удаляет давно завершенные задания.
+
+    Returns:
+        int: Количество удаленных заданий
+    """
+    async with AsyncSession() as session:
+        result = await session.execute(
+            delete(UserbotJob).where(
+                UserbotJob.status.in_(('done', 'failed')),
+                UserbotJob.finished_at < datetime.now() - timedelta(seconds=retention)
+            )
+        )
+        await session.commit()
+        return result.rowcount
+
+
+async def run_job_workers(on_finished=None, workers=JOB_WORKERS, partition=None, poll_interval=JOB_POLL_INTERVAL):
+    """
+    Бесконечный цикл исполнителей заданий.
+
+    Args:
+        on_finished (callable): Вызывается как on_finished(job, result, error) после
+            успешного выполнения или последней неудачной попытки
+        workers (int): Количество одновременно выполняемых заданий
+        partition (tuple): (номер процесса, количество процессов) - брать только задания
+            чатов, закрепленных за этим процессом
+        poll_interval (float): Период опроса таблицы при отсутствии новых заданий
+    """
+    global _wakeup
+    _wakeup = asyncio.Event()
+
+    async def worker():
+        while True:
+            _wakeup.clear()
+            job = None
+            try:
+                async with AsyncSession() as session:
+                    job = await _claim(session, partition)
+                    await session.commit()
+            except Exception as e:
+                logger.error(f"Ошибка при получении задания: {e}")
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await _run_job(job, on_finished)
+
+    async def purger():
+        while True:
+            try:
+                purged = await purge_finished_jobs()
+                if purged:
+                    logger.info(f"Удалено завершенных заданий: {purged}")
+            except Exception as e:
+                logger.error(f"Ошибка при удалении завершенных заданий: {e}")
+            await asyncio.sleep(3600)
+
+    tasks = [worker() for _ in range(workers)]
+    if not partition or partition[0] == 0:
+        tasks.append(purger())
+    await asyncio.gather(*tasks)
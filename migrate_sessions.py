@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Скрипт для перевода существующих юзерботов с файлов .session на StringSession.
+
+Для каждого юзербота без UserBot.session_string файл сессии берется из
+хранилища (через локальный кэш), преобразуется в StringSession без
+подключения к Telegram, шифруется и сохраняется в базе данных.
+Файлы в хранилище не удаляются и остаются резервным вариантом.
+"""
+
+import asyncio
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+# Добавляем текущую директорию в путь для импорта
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Импортируем модули для работы с базой данных
+from database.db import Session
+from database.migrate import upgrade
+from database.models import UserBot
+from string_sessions import is_configured, encrypt_session_string, session_file_to_string
+from userbot_manager import session_cache, extract_session_name
+
+# Загружаем переменные окружения
+load_dotenv()
+
+async def convert_userbot(userbot_id, session_name, semaphore):
+    """
+    Скачивает файл сессии и возвращает зашифрованную StringSession.
+
+    Returns:
+        tuple: (userbot_id, зашифрованная строка или None, текст ошибки или None)
+    """
+    async with semaphore:
+        clean_name = extract_session_name(session_name)
+        session_path = await session_cache.get(clean_name)
+        if not session_path:
+            return userbot_id, None, "файл сессии не найден"
+
+        try:
+            session_string = session_file_to_string(session_path)
+        except Exception as e:
+            return userbot_id, None, f"не удалось прочитать файл сессии: {e}"
+
+        if not session_string:
+            return userbot_id, None, "в файле сессии нет ключа авторизации"
+
+        return userbot_id, encrypt_session_string(session_string), None
+
+async def migrate_sessions(concurrency, force, dry_run):
+    """Переводит юзерботов на StringSession пакетно."""
+    session = Session()
+    try:
+        query = session.query(UserBot.id, UserBot.session_name)
+        if not force:
+            query = query.filter(UserBot.session_string.is_(None))
+        userbots = query.all()
+
+        if not userbots:
+            print("Все юзерботы уже используют StringSession.")
+            return
+
+        print(f"Юзерботов для перевода: {len(userbots)}")
+
+        semaphore = asyncio.Semaphore(concurrency)
+        results = await asyncio.gather(*(
+            convert_userbot(userbot_id, session_name, semaphore)
+            for userbot_id, session_name in userbots
+        ))
+
+        converted = {userbot_id: value for userbot_id, value, error in results if value}
+        for userbot_id, _, error in results:
+            if error:
+                print(f"Юзербот {userbot_id}: {error}")
+
+        if dry_run:
+            print(f"Пробный запуск: можно перевести {len(converted)} из {len(userbots)} юзерботов.")
+            return
+
+        # Одно массовое обновление вместо коммита на каждого юзербота
+        if converted:
+            session.bulk_update_mappings(UserBot, [
+                {'id': userbot_id, 'session_string': value}
+                for userbot_id, value in converted.items()
+            ])
+            session.commit()
+
+        print(f"Переведено на StringSession: {len(converted)} из {len(userbots)} юзерботов.")
+
+    except Exception as e:
+        print(f"Ошибка при переводе сессий: {e}")
+        session.rollback()
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перевод сессий юзерботов в зашифрованную StringSession")
+    parser.add_argument("--concurrency", type=int, default=8, help="Количество одновременных загрузок файлов сессий")
+    parser.add_argument("--force", action="store_true", help="Пересоздать StringSession и для уже переведенных юзерботов")
+    parser.add_argument("--dry-run", action="store_true", help="Только проверить файлы, не изменяя базу данных")
+
+    args = parser.parse_args()
+
+    if not is_configured():
+        print("Не задан SESSION_ENCRYPTION_KEY. Сгенерируйте ключ командой: python string_sessions.py")
+        sys.exit(1)
+
+    # Применяем миграции схемы (в том числе столбец session_string)
+    upgrade()
+
+    asyncio.run(migrate_sessions(args.concurrency, args.force, args.dry_run))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Общий кэш разрешения сущностей Telegram (username/ID -> InputPeer).
+
+access_hash действует только для аккаунта, который его получил, поэтому
+записи хранятся по паре (аккаунт, peer_id). Поиск идет сначала в памяти,
+затем в таблице peer_cache и только потом через Telegram (ResolveUsername),
+так что перезапуск процесса или новый временный файл сессии не начинают
+с пустого кэша и не расходуют лимит на разрешение username.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+from telethon import utils
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+from database.db import AsyncSession
+from database.models import PeerCacheEntry
+from rpc_scheduler import rpc_scheduler
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Username может перейти к другому владельцу, поэтому связь username -> ID живет меньше,
+# чем access_hash, который для пары (аккаунт, peer) не меняется
+PEER_USERNAME_TTL = int(os.environ.get('PEER_USERNAME_TTL', str(24 * 3600)))
+PEER_HASH_TTL = int(os.environ.get('PEER_HASH_TTL', str(30 * 24 * 3600)))
+PEER_MEMORY_MAX_ENTRIES = int(os.environ.get('PEER_MEMORY_MAX_ENTRIES', '10000'))
+
+
+def _normalize(peer):
+    """Приводит username или ID к ключу кэша."""
+    if isinstance(peer, str):
+        peer = peer.strip()
+        if peer.lstrip('-').isdigit():
+            peer = int(peer)
+        else:
+            return peer.lstrip('@').lower()
+    # Помеченные ID каналов (-100...) приводятся к ID из InputPeer
+    real_id, _ = utils.resolve_id(peer)
+    return real_id
+
+
+def _to_input_peer(peer_type, peer_id, access_hash):
+    if peer_type == 'user':
+        return InputPeerUser(peer_id, access_hash)
+    if peer_type == 'channel':
+        return InputPeerChannel(peer_id, access_hash)
+    return InputPeerChat(peer_id)
+
+
+def _describe(input_peer):
+    """Возвращает (тип, ID, access_hash) для InputPeer или None для прочих типов."""
+    if isinstance(input_peer, InputPeerUser):
+        return 'user', input_peer.user_id, input_peer.access_hash
+    if isinstance(input_peer, InputPeerChannel):
+        return 'channel', input_peer.channel_id, input_peer.access_hash
+    if isinstance(input_peer, InputPeerChat):
+        return 'chat', input_peer.chat_id, None
+    return None
+
+
+class PeerCache:
+    """
+    Кэш InputPeer по аккаунтам с хранением в базе данных.
+
+    Args:
+        username_ttl (int): Время жизни связи username -> ID в секундах
+        hash_ttl (int): Время жизни access_hash в секундах
+        max_entries (int): Максимальное количество записей в памяти
+    """
+
+    def __init__(self, username_ttl=PEER_USERNAME_TTL, hash_ttl=PEER_HASH_TTL, max_entries=PEER_MEMORY_MAX_ENTRIES):
+        self.username_ttl = username_ttl
+        self.hash_ttl = hash_ttl
+        self._memory = TTLCache(username_ttl, max_entries=max_entries)
+
+        # Счетчики для мониторинга
+        self.db_hits = 0
+        self.resolved = 0
+
+    async def get_input_entity(self, client, account, peer):
+        """
+        Разрешает username или ID в InputPeer для аккаунта.
+
+        Args:
+            client (TelegramClient): Подключенный клиент аккаунта
+            account (str): Ключ аккаунта (имя сессии)
+            peer (str | int): Username (с @ или без) или ID
+
+        Returns:
+            InputPeer: Сущность для запросов от имени аккаунта
+
+        Raises:
+            ValueError: Если Telegram не смог разрешить сущность
+        """
+        key = _normalize(peer)
+        ttl = self.username_ttl if isinstance(key, str) else self.hash_ttl
+
+        input_peer = self._memory.get((account, key))
+        if input_peer is not None:
+            return input_peer
+
+        input_peer = await self._load(account, key, ttl)
+        if input_peer is not None:
+            self.db_hits += 1
+            self._memory.set((account, key), input_peer, ttl=ttl)
+            return input_peer
+
+        input_peer = await rpc_scheduler.call(account, 'resolve', lambda: client.get_input_entity(key))
+        self.resolved += 1
+        await self.remember(account, input_peer, username=key if isinstance(key, str) else None)
+        return input_peer
+
+    async def remember(self, account, entity, username=None):
+        """
+        Сохраняет уже полученную сущность (например, из диалогов или обновлений).
+
+        Args:
+            account (str): Ключ аккаунта (имя сессии)
+            entity: Сущность Telethon или InputPeer
+            username (str): Username, по которому сущность была найдена
+        """
+        await self.remember_many(account, [entity], username=username)
+
+    async def remember_many(self, account, entities, username=None):
+        """Сохраняет несколько сущностей одной транзакцией."""
+        rows = []
+        for entity in entities:
+            try:
+                input_peer = utils.get_input_peer(entity)
+            except TypeError:
+                continue
+            described = _describe(input_peer)
+            if not described:
+                continue
+            peer_type, peer_id, access_hash = described
+            entity_username = username or getattr(entity, 'username', None)
+            entity_username = entity_username.lower() if entity_username else None
+
+            self._memory.set((account, peer_id), input_peer, ttl=self.hash_ttl)
+            if entity_username:
+                self._memory.set((account, entity_username), input_peer, ttl=self.username_ttl)
+            rows.append((peer_type, peer_id, access_hash, entity_username))
+
+        if rows:
+            await self._store(account, rows)
+
+    async def invalidate(self, account, peer):
+        """Удаляет сущность из кэша, например после ошибки PEER_ID_INVALID."""
+        key = _normalize(peer)
+        self._memory.pop((account, key))
+        session = AsyncSession()
+        try:
+            await session.execute(delete(PeerCacheEntry).where(PeerCacheEntry.account == account, self._match(key)))
+            await session.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при удалении {peer} из кэша сущностей: {e}")
+            await session.rollback()
+        finally:
+            await session.close()
+
+    @staticmethod
+    def _match(key):
+        if isinstance(key, str):
+            return PeerCacheEntry.username == key
+        return PeerCacheEntry.peer_id == key
+
+    async def _load(self, account, key, ttl):
+        session = AsyncSession()
+        try:
+            row = (await session.execute(
+                select(PeerCacheEntry.peer_type, PeerCacheEntry.peer_id, PeerCacheEntry.access_hash).where(
+                    PeerCacheEntry.account == account,
+                    PeerCacheEntry.updated_at > datetime.now() - timedelta(seconds=ttl),
+                    self._match(key)
+                ).limit(1)
+            )).first()
+            return _to_input_peer(*row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при чтении кэша сущностей: {e}")
+            return None
+        finally:
+            await session.close()
+
+    async def _store(self, account, rows):
+        session = AsyncSession()
+        try:
+            now = datetime.now()
+            for peer_type, peer_id, access_hash, username in rows:
+                if username:
+                    # Username принадлежит только одной сущности: снимаем его с прежнего владельца
+                    await session.execute(
+                        update(PeerCacheEntry).where(
+                            PeerCacheEntry.account == account,
+                            PeerCacheEntry.username == username,
+                            PeerCacheEntry.peer_id != peer_id
+                        ).values(username=None)
+                    )
+
+                entry = await session.scalar(select(PeerCacheEntry).where(
+                    PeerCacheEntry.account == account,
+                    PeerCacheEntry.peer_id == peer_id
+                ))
+                if entry is None:
+                    entry = PeerCacheEntry(account=account, peer_id=peer_id)
+                    session.add(entry)
+                entry.peer_type = peer_type
+                entry.access_hash = access_hash
+                if username:
+                    entry.username = username
+                entry.updated_at = now
+            await session.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении сущностей аккаунта {account} в кэш: {e}")
+            await session.rollback()
+        finally:
+            await session.close()
+
+    def stats(self):
+        return dict(self._memory.stats(), db_hits=self.db_hits, resolved=self.resolved)
+
+
+# Общий кэш сущностей для всех клиентов процесса
+peer_cache = PeerCache()
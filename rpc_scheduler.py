@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Планировщик исходящих запросов Telethon с учетом FloodWait.
+
+Каждый запрос к Telegram от имени аккаунта проходит через
+RpcScheduler.call() с указанием семейства методов. Для каждой пары
+(аккаунт, семейство) действует отдельная корзина токенов, а вызывающие
+обслуживаются по очереди в порядке поступления. Получив FloodWaitError,
+планировщик "паркует" аккаунт на указанное время и повторяет запрос,
+вместо того чтобы возвращать ошибку пользователю.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+# Лимиты по семействам методов: (запросов в секунду, емкость корзины)
+RPC_LIMITS = {
+    'profile': (1 / 20, 3),       # UpdateProfileRequest, UploadProfilePhotoRequest
+    'resolve': (1 / 10, 3),       # ResolveUsername (get_entity по username)
+    'participants': (1 / 5, 3),   # GetParticipant(s)
+    'channels': (1 / 3, 3),       # GetFullChannel (обновление каталога каналов)
+    'messages': (1 / 3, 3),       # send_message, get_messages, get_dialogs
+    'discussion': (1 / 5, 3),     # GetDiscussionMessage (ветка комментариев поста)
+    'join': (1 / 60, 2),          # JoinChannel, LeaveChannel (частые вступления ведут к спам-блоку)
+    'default': (1.0, 5),          # get_me и прочие дешевые запросы
+}
+
+# Максимальный FloodWait, который планировщик пережидает; более долгий возвращается вызывающему
+RPC_MAX_FLOOD_WAIT = int(os.environ.get('RPC_MAX_FLOOD_WAIT', '120'))
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Сколько секунд ждать до появления токена."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _AccountState:
+    __slots__ = ('buckets', 'locks', 'parked_until', 'waiting')
+
+    def __init__(self):
+        self.buckets = {}
+        self.locks = {}
+        self.parked_until = 0.0
+        self.waiting = 0
+
+
+class RpcScheduler:
+    """
+    Планировщик запросов по аккаунтам.
+
+    Args:
+        limits (dict): Лимиты по семействам методов
+        max_flood_wait (int): Максимальный FloodWait, который пережидается автоматически
+    """
+
+    def __init__(self, limits=RPC_LIMITS, max_flood_wait=RPC_MAX_FLOOD_WAIT):
+        self.limits = limits
+        self.max_flood_wait = max_flood_wait
+        self._accounts = {}
+
+        # Счетчики для мониторинга
+        self.calls = 0
+        self.flood_waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _state(self, account):
+        state = self._accounts.get(account)
+        if state is None:
+            state = self._accounts[account] = _AccountState()
+        return state
+
+    def _family(self, state, family):
+        if family not in self.limits:
+            family = 'default'
+        bucket = state.buckets.get(family)
+        if bucket is None:
+            rate, capacity = self.limits[family]
+            bucket = state.buckets[family] = TokenBucket(rate, capacity)
+            state.locks[family] = asyncio.Lock()
+        return bucket, state.locks[family]
+
+    async def call(self, account, family, request):
+        """
+        Выполняет запрос с соблюдением лимитов аккаунта.
+
+        Args:
+            account (str): Ключ аккаунта (имя сессии)
+            family (str): Семейство методов из RPC_LIMITS
+            request (callable): Функция без аргументов, возвращающая корутину запроса
+
+        Returns:
+            Результат запроса
+
+        Raises:
+            FloodWaitError: Если Telegram требует ждать дольше max_flood_wait
+        """
+        state = self._state(account)
+        bucket, lock = self._family(state, family)
+        queued_at = time.monotonic()
+        state.waiting += 1
+        try:
+            # asyncio.Lock будит ожидающих в порядке очереди, поэтому вызывающие обслуживаются честно
+            async with lock:
+                while True:
+                    delay = max(state.parked_until - time.monotonic(), bucket.delay())
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        continue
+
+                    bucket.take()
+                    self._record_wait(time.monotonic() - queued_at)
+                    try:
+                        return await request()
+                    except FloodWaitError as e:
+                        self.flood_waits += 1
+                        state.parked_until = max(state.parked_until, time.monotonic() + e.seconds)
+                        logger.warning(f"FloodWait {e.seconds} с для аккаунта {account} ({family}), аккаунт припаркован")
+                        if e.seconds > self.max_flood_wait:
+                            raise
+                        queued_at = time.monotonic()
+        finally:
+            state.waiting -= 1
+
+    def _record_wait(self, waited):
+        self.calls += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    def parked_for(self, account):
+        """Сколько секунд аккаунт еще припаркован из-за FloodWait."""
+        state = self._accounts.get(account)
+        if state is None:
+            return 0.0
+        return max(0.0, state.parked_until - time.monotonic())
+
+    def stats(self):
+        """
+        Возвращает метрики планировщика.
+
+        Returns:
+            dict: Количество запросов, время ожидания, глубина очередей и припаркованные аккаунты
+        """
+        now = time.monotonic()
+        return {
+            'calls': self.calls,
+            'flood_waits': self.flood_waits,
+            'wait_avg_ms': (self.wait_time_total / self.calls * 1000) if self.calls else 0.0,
+            'wait_max_ms': self.wait_time_max * 1000,
+            'queue_depth': {account: state.waiting for account, state in self._accounts.items() if state.waiting},
+            'parked': {
+                account: round(state.parked_until - now)
+                for account, state in self._accounts.items() if state.parked_until > now
+            },
+        }
+
+
+# Общий планировщик для всех клиентов процесса
+rpc_scheduler = RpcScheduler()
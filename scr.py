@@ -4,6 +4,7 @@
 from telethon import TelegramClient, events, utils
 from telethon.tl.functions.users import GetFullUserRequest
 from telethon.tl.types import User, Channel, InputPeerUser, InputPeerChannel, UserStatusOnline, UserStatusOffline, UserStatusRecently
+from peer_cache import peer_cache
 import asyncio
 import logging
 import sys
@@ -52,12 +53,12 @@ async def send_notification(message):
 async def get_user_entity():
     """Получает сущность пользователя по имени пользователя или номеру телефона."""
     try:
-        # Пробуем найти пользователя по имени пользователя или номеру телефона
-        entity = await client.get_entity(TARGET_USER)
+        # Пробуем найти пользователя через общий кэш сущностей, чтобы не разрешать username после каждого перезапуска
+        entity = await peer_cache.get_input_entity(client, SESSION_NAME, TARGET_USER)
         
         # Проверяем, что сущность - это пользователь, а не канал или группа
-        if not isinstance(entity, User):
-            if isinstance(entity, Channel):
+        if not isinstance(entity, InputPeerUser):
+            if isinstance(entity, InputPeerChannel):
                 logger.error(f"Ошибка: {TARGET_USER} - это канал или группа, а не пользователь.")
                 await send_notification(f"⚠️ Ошибка: {TARGET_USER} - это канал или группа, а не пользователь. Укажите имя пользователя.")
             else:
@@ -65,7 +66,7 @@ async def get_user_entity():
                 await send_notification(f"⚠️ Ошибка: {TARGET_USER} - не является пользователем. Укажите корректное имя пользователя.")
             return None
             
-        logger.info(f"Успешно найден пользователь: {entity.first_name} {entity.last_name or ''} (ID: {entity.id})")
+        logger.info(f"Успешно найден пользователь: {TARGET_USER} (ID: {entity.user_id})")
         return entity
     except Exception as e:
         logger.error(f"Ошибка при получении сущности пользователя: {e}")
@@ -127,6 +128,8 @@ async def check_user_status():
     except Exception as e:
         logger.error(f"Ошибка при проверке статуса: {e}")
         # При ошибке пробуем сбросить кэшированную сущность
+        if user_status['entity'] is not None:
+            await peer_cache.invalidate(SESSION_NAME, TARGET_USER)
         user_status['entity'] = None
         await asyncio.sleep(10)  # Ждем немного перед повторной попыткой
 
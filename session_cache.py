@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Локальный кэш файлов сессий перед общим хранилищем (S3).
+
+Каждая сессия хранится в каталоге кэша как <name>.session вместе с файлом
+метаданных <name>.meta.json (ETag, LastModified, размер). Перед выдачей файл
+сверяется с объектом в хранилище через HEAD-запрос, поэтому неизмененная сессия
+отдается с диска без скачивания. Обновленный файл заменяется атомарно,
+а лишние записи вытесняются в порядке LRU по количеству и суммарному размеру.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Параметры кэша
+SESSION_CACHE_DIR = os.environ.get('SESSION_CACHE_DIR', os.path.join(ROOT_DIR, '.session_cache'))
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', '500'))
+SESSION_CACHE_MAX_BYTES = int(os.environ.get('SESSION_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+
+META_SUFFIX = '.meta.json'
+
+
+class SessionCache:
+    """
+    Кэш файлов сессий с ревалидацией по ETag/LastModified.
+
+    Args:
+        storage (Storage): Общее хранилище объектов
+        directory (str): Каталог кэша
+        max_entries (int): Максимальное количество сессий в кэше
+        max_bytes (int): Максимальный суммарный размер файлов сессий
+    """
+
+    def __init__(self, storage, directory=SESSION_CACHE_DIR,
+                 max_entries=SESSION_CACHE_MAX_ENTRIES, max_bytes=SESSION_CACHE_MAX_BYTES):
+        self.storage = storage
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._locks = {}
+
+        # Счетчики для мониторинга
+        self.hits = 0
+        self.misses = 0
+        self.bytes_downloaded = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, session_name):
+        """Путь к файлу сессии в кэше (файла может не быть)."""
+        return os.path.join(self.directory, f"{session_name}.session")
+
+    def cached_path(self, session_name):
+        """
+        Возвращает путь к закэшированному файлу без сверки с хранилищем.
+
+        Args:
+            session_name (str): Имя сессии
+
+        Returns:
+            str: Путь к файлу или None, если сессии нет в кэше
+        """
+        path = self.path_for(session_name)
+        return path if os.path.exists(path) else None
+
+    def _meta_path(self, session_name):
+        return os.path.join(self.directory, f"{session_name}{META_SUFFIX}")
+
+    def _read_meta(self, session_name):
+        try:
+            with open(self._meta_path(session_name), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, session_name, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(session_name))
+
+    def _touch(self, session_name):
+        # Время изменения файла метаданных служит меткой последнего доступа для LRU
+        try:
+            os.utime(self._meta_path(session_name))
+        except OSError:
+            pass
+
+    def _lock_for(self, session_name):
+        lock = self._locks.get(session_name)
+        if lock is None:
+            lock = self._locks[session_name] = asyncio.Lock()
+        return lock
+
+    async def get(self, session_name):
+        """
+        Возвращает путь к актуальному файлу сессии, при необходимости скачивая его из хранилища.
+
+        Args:
+            session_name (str): Имя сессии (без .session)
+
+        Returns:
+            str: Путь к файлу сессии в кэше или None, если сессия не найдена
+        """
+        async with self._lock_for(session_name):
+            path = self.path_for(session_name)
+            s3_key = f"sessions/{session_name}.session"
+
+            try:
+                version = await self.storage.head(s3_key)
+            except Exception as e:
+                if os.path.exists(path):
+                    logger.warning(f"Хранилище недоступно ({e}), используется закэшированная сессия {session_name}")
+                    self._touch(session_name)
+                    return path
+                logger.error(f"Ошибка при проверке сессии {s3_key} в хранилище: {e}")
+                return None
+
+            if version is None:
+                logger.warning(f"Сессия {s3_key} отсутствует в хранилище")
+                self.invalidate(session_name)
+                return None
+
+            meta = self._read_meta(session_name)
+            if meta and os.path.exists(path) and meta.get('etag') == version['etag'] \
+                    and meta.get('last_modified') == version['last_modified']:
+                self.hits += 1
+                self._touch(session_name)
+                logger.debug(f"Сессия {session_name} взята из кэша")
+                return path
+
+            # Версия изменилась или файла нет - скачиваем во временный файл и атомарно заменяем
+            self.misses += 1
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+            try:
+                logger.info(f"Загрузка сессии из хранилища: {s3_key}")
+                await self.storage.get(s3_key, tmp_path)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logger.error(f"Ошибка при загрузке сессии из хранилища: {e}")
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                return None
+
+            self.bytes_downloaded += version['size']
+            self._write_meta(session_name, version)
+            self._evict()
+            return path
+
+    def invalidate(self, session_name):
+        """Удаляет сессию из кэша."""
+        for file_path in (self.path_for(session_name), self._meta_path(session_name)):
+            if os.path.exists(file_path):
+                try:
+                    os.unlink(file_path)
+                except OSError as e:
+                    logger.error(f"Ошибка при удалении {file_path} из кэша: {e}")
+
+    def _evict(self):
+        """Вытесняет давно не использованные сессии, пока кэш превышает лимиты."""
+        entries = []
+        total_bytes = 0
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(META_SUFFIX):
+                continue
+            session_name = file_name[:-len(META_SUFFIX)]
+            try:
+                last_access = os.path.getmtime(self._meta_path(session_name))
+                size = os.path.getsize(self.path_for(session_name))
+            except OSError:
+                continue
+            entries.append((last_access, session_name, size))
+            total_bytes += size
+
+        entries.sort()
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, session_name, size = entries.pop(0)
+            self.invalidate(session_name)
+            total_bytes -= size
+            logger.info(f"Сессия {session_name} вытеснена из кэша")
+
+    def stats(self):
+        """
+        Возвращает счетчики кэша.
+
+        Returns:
+            dict: Попадания, промахи и объем скачанных данных
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes_downloaded': self.bytes_downloaded,
+        }
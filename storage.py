@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Общее хранилище объектов для обоих ботов с асинхронным API.
+
+Блокирующие вызовы бэкенда (boto3 или файловая система) выполняются в
+ограниченном пуле потоков, поэтому передача файлов не останавливает
+цикл событий. Используется один долгоживущий клиент S3 с пулом соединений.
+Бэкенд выбирается переменной STORAGE_BACKEND: "s3" или "local".
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Параметры для S3 Bucketeer
+BUCKETEER_AWS_ACCESS_KEY_ID = os.environ.get('BUCKETEER_AWS_ACCESS_KEY_ID')
+BUCKETEER_AWS_SECRET_ACCESS_KEY = os.environ.get('BUCKETEER_AWS_SECRET_ACCESS_KEY')
+BUCKETEER_BUCKET_NAME = os.environ.get('BUCKETEER_BUCKET_NAME')
+BUCKETEER_REGION = os.environ.get('BUCKETEER_REGION', 'us-east-1')
+
+# Параметры хранилища
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND')
+STORAGE_LOCAL_DIR = os.environ.get('STORAGE_LOCAL_DIR', os.path.join(ROOT_DIR, 'storage'))
+STORAGE_MAX_WORKERS = int(os.environ.get('STORAGE_MAX_WORKERS', '8'))
+
+
+class S3Backend:
+    """Синхронный бэкенд поверх одного клиента boto3."""
+
+    def __init__(self, bucket, access_key_id, secret_access_key, region, max_connections=STORAGE_MAX_WORKERS):
+        import boto3
+        from botocore.config import Config
+        from botocore.exceptions import ClientError
+
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.region = region
+        self.client = boto3.client(
+            's3',
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            region_name=region,
+            config=Config(max_pool_connections=max_connections, retries={'max_attempts': 3, 'mode': 'standard'})
+        )
+        logger.info(f"S3 клиент инициализирован для бакета {bucket}")
+
+    def head(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except self._client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        last_modified = response.get('LastModified')
+        return {
+            'etag': response.get('ETag'),
+            'last_modified': last_modified.isoformat() if last_modified else None,
+            'size': response.get('ContentLength', 0),
+        }
+
+    def get(self, key, dest_path):
+        self.client.download_file(self.bucket, key, dest_path)
+
+    def put(self, src_path, key):
+        self.client.upload_file(src_path, self.bucket, key)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list(self, prefix):
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(item['Key'] for item in page.get('Contents', []))
+        return keys
+
+    def url(self, key):
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+
+class LocalBackend:
+    """Бэкенд на локальной файловой системе для запуска и замеров без бакета."""
+
+    def __init__(self, root=STORAGE_LOCAL_DIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        logger.info(f"Используется локальное хранилище: {root}")
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def head(self, key):
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return {
+            'etag': f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            'last_modified': datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).isoformat(),
+            'size': stat.st_size,
+        }
+
+    def get(self, key, dest_path):
+        shutil.copyfile(self._path(key), dest_path)
+
+    def put(self, src_path, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Копируем во временный файл и атомарно заменяем, чтобы читатели не видели частичный объект
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        keys = []
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.endswith('.tmp'):
+                    continue
+                key = os.path.relpath(os.path.join(dir_path, file_name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def url(self, key):
+        return f"file://{self._path(key)}"
+
+
+class Storage:
+    """
+    Асинхронная обертка над бэкендом хранилища.
+
+    Args:
+        backend: S3Backend или LocalBackend
+        max_workers (int): Размер пула потоков для блокирующих операций
+    """
+
+    def __init__(self, backend, max_workers=STORAGE_MAX_WORKERS):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='storage')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def head(self, key):
+        """
+        Возвращает метаданные объекта.
+
+        Args:
+            key (str): Ключ объекта
+
+        Returns:
+            dict: etag, last_modified и size или None, если объекта нет
+        """
+        return await self._run(self.backend.head, key)
+
+    async def get(self, key, dest_path):
+        """Скачивает объект key в файл dest_path."""
+        await self._run(self.backend.get, key, dest_path)
+
+    async def put(self, src_path, key):
+        """Загружает файл src_path в объект key."""
+        await self._run(self.backend.put, src_path, key)
+
+    async def delete(self, key):
+        """Удаляет объект key."""
+        await self._run(self.backend.delete, key)
+
+    async def list(self, prefix=''):
+        """Возвращает ключи объектов с указанным префиксом."""
+        return await self._run(self.backend.list, prefix)
+
+    def url(self, key):
+        """Возвращает URL объекта, который сохраняется в UserBot.session_name."""
+        return self.backend.url(key)
+
+
+_storage = None
+
+
+def get_storage():
+    """
+    Возвращает общий экземпляр хранилища, создавая его при первом вызове.
+
+    Returns:
+        Storage: Хранилище с бэкендом из STORAGE_BACKEND
+    """
+    global _storage
+    if _storage is None:
+        backend_name = STORAGE_BACKEND
+        s3_configured = all([BUCKETEER_AWS_ACCESS_KEY_ID, BUCKETEER_AWS_SECRET_ACCESS_KEY, BUCKETEER_BUCKET_NAME])
+        if backend_name is None:
+            backend_name = 's3' if s3_configured else 'local'
+
+        if backend_name == 's3':
+            if not s3_configured:
+                logger.warning("S3 клиент не инициализирован. Отсутствуют необходимые переменные окружения.")
+            backend = S3Backend(
+                BUCKETEER_BUCKET_NAME,
+                BUCKETEER_AWS_ACCESS_KEY_ID,
+                BUCKETEER_AWS_SECRET_ACCESS_KEY,
+                BUCKETEER_REGION
+            )
+        else:
+            backend = LocalBackend(STORAGE_LOCAL_DIR)
+        _storage = Storage(backend)
+    return _storage
+
+
+# Если файл запущен напрямую, выполняем замер на локальном бэкенде
+if __name__ == "__main__":
+    async def benchmark(count=200, size=64 * 1024):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = Storage(LocalBackend(os.path.join(tmp_dir, 'bucket')))
+            src_path = os.path.join(tmp_dir, 'source.session')
+            with open(src_path, 'wb') as f:
+                f.write(os.urandom(size))
+
+            started = time.monotonic()
+            await asyncio.gather(*(storage.put(src_path, f"sessions/bench{i}.session") for i in range(count)))
+            print(f"put:  {count} объектов за {time.monotonic() - started:.3f} с")
+
+            started = time.monotonic()
+            await asyncio.gather(*(storage.head(f"sessions/bench{i}.session") for i in range(count)))
+            print(f"head: {count} объектов за {time.monotonic() - started:.3f} с")
+
+            started = time.monotonic()
+            await asyncio.gather(*(
+                storage.get(f"sessions/bench{i}.session", os.path.join(tmp_dir, f"out{i}.session"))
+                for i in range(count)
+            ))
+            print(f"get:  {count} объектов за {time.monotonic() - started:.3f} с")
+
+            started = time.monotonic()
+            keys = await storage.list('sessions/')
+            print(f"list: {len(keys)} ключей за {time.monotonic() - started:.3f} с")
+
+    asyncio.run(benchmark())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Хранение сессий юзерботов в виде зашифрованной Telethon StringSession.
+
+StringSession содержит только DC и ключ авторизации, поэтому клиент
+подключается из памяти без скачивания файла, временных копий и блокировок
+SQLite. В базе данных строка хранится зашифрованной ключом Fernet из
+переменной окружения SESSION_ENCRYPTION_KEY.
+"""
+import logging
+import os
+
+from cryptography.fernet import Fernet, InvalidToken
+from dotenv import load_dotenv
+from telethon.sessions import SQLiteSession, StringSession
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Ключ шифрования (сгенерировать: python string_sessions.py)
+SESSION_ENCRYPTION_KEY = os.environ.get('SESSION_ENCRYPTION_KEY')
+
+_fernet = Fernet(SESSION_ENCRYPTION_KEY.encode()) if SESSION_ENCRYPTION_KEY else None
+
+
+def is_configured():
+    """Проверяет, задан ли ключ шифрования сессий."""
+    return _fernet is not None
+
+
+def encrypt_session_string(session_string):
+    """
+    Шифрует StringSession для хранения в базе данных.
+
+    Args:
+        session_string (str): StringSession в открытом виде
+
+    Returns:
+        str: Зашифрованная строка
+    """
+    if not _fernet:
+        raise RuntimeError("SESSION_ENCRYPTION_KEY не задан")
+    return _fernet.encrypt(session_string.encode()).decode()
+
+
+def decrypt_session_string(token):
+    """
+    Расшифровывает StringSession, сохраненную в базе данных.
+
+    Args:
+        token (str): Зашифрованная строка из UserBot.session_string
+
+    Returns:
+        str: StringSession в открытом виде или None, если расшифровать не удалось
+    """
+    if not _fernet:
+        logger.error("SESSION_ENCRYPTION_KEY не задан, StringSession недоступна")
+        return None
+    try:
+        return _fernet.decrypt(token.encode()).decode()
+    except InvalidToken:
+        logger.error("Не удалось расшифровать StringSession: неверный ключ или поврежденные данные")
+        return None
+
+
+def session_to_string(session):
+    """
+    Преобразует любую сессию Telethon (например, client.session) в StringSession.
+
+    Args:
+        session: Объект сессии Telethon
+
+    Returns:
+        str: StringSession в открытом виде
+    """
+    return StringSession.save(session)
+
+
+def session_file_to_string(session_path):
+    """
+    Преобразует файл .session (SQLite) в StringSession без подключения к Telegram.
+
+    Args:
+        session_path (str): Путь к файлу сессии
+
+    Returns:
+        str: StringSession в открытом виде или None, если в файле нет ключа авторизации
+    """
+    session = SQLiteSession(session_path)
+    try:
+        if not session.auth_key:
+            return None
+        return session_to_string(session)
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    print(f"Новый ключ для SESSION_ENCRYPTION_KEY: {Fernet.generate_key().decode()}")
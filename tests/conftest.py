@@ -0,0 +1,48 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тесты не должны подключаться к базе из .env
+os.environ["DATABASE_URL"] = "sqlite://"
+
+
+@pytest.fixture
+def with_database():
+    """
+    Запускает асинхронный тест на чистой базе SQLite в памяти.
+
+    Тест получает фабрику сессий: with_database(test), где test(sessions) - корутина.
+    """
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import StaticPool
+
+    from database.models import Base
+
+    async def main(test):
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+
+        # pysqlite сам открывает транзакции и ломает SAVEPOINT, а begin_nested нужен журналу баланса
+        @event.listens_for(engine.sync_engine, "connect")
+        def _connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine.sync_engine, "begin")
+        def _begin(connection):
+            connection.exec_driver_sql("BEGIN")
+
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        try:
+            await test(async_sessionmaker(engine, expire_on_commit=False))
+        finally:
+            await engine.dispose()
+
+    return lambda test: asyncio.run(main(test))
@@ -0,0 +1,89 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import func, select
+
+from balance_ledger import DuplicateTransactionError, InsufficientFundsError, credit, debit
+from database.models import BalanceTransaction, User
+
+USER_ID = 1001
+
+
+async def _create_user(sessions, balance):
+    async with sessions() as session:
+        session.add(User(telegram_id=USER_ID, balance=balance))
+        await session.commit()
+
+
+async def _state(sessions):
+    async with sessions() as session:
+        balance = await session.scalar(select(User.balance).where(User.telegram_id == USER_ID))
+        transactions = await session.scalar(select(func.count()).select_from(BalanceTransaction))
+    return balance, transactions
+
+
+def test_debit_and_credit_are_journaled(with_database):
+    async def test(sessions):
+        await _create_user(sessions, 100.0)
+        async with sessions() as session:
+            assert await debit(session, USER_ID, 30.0, 'campaign', 'campaign:1') == 70.0
+            assert await credit(session, USER_ID, 5.0, 'refund', 'refund:1') == 75.0
+            await session.commit()
+
+        assert await _state(sessions) == (75.0, 2)
+        async with sessions() as session:
+            amounts = (await session.execute(
+                select(BalanceTransaction.amount, BalanceTransaction.balance_after).order_by(BalanceTransaction.id)
+            )).all()
+        assert [tuple(row) for row in amounts] == [(-30.0, 70.0), (5.0, 75.0)]
+
+    with_database(test)
+
+
+def test_repeated_key_is_applied_once(with_database):
+    async def test(sessions):
+        await _create_user(sessions, 100.0)
+        async with sessions() as session:
+            await debit(session, USER_ID, 30.0, 'campaign', 'campaign:1')
+            await session.commit()
+
+        async with sessions() as session:
+            with pytest.raises(DuplicateTransactionError):
+                await debit(session, USER_ID, 30.0, 'campaign', 'campaign:1')
+            # Откатилась только точка сохранения: сессия остается рабочей
+            assert await credit(session, USER_ID, 10.0, 'topup', 'topup:1') == 80.0
+            await session.commit()
+
+        assert await _state(sessions) == (80.0, 2)
+
+    with_database(test)
+
+
+def test_debit_never_goes_negative(with_database):
+    async def test(sessions):
+        await _create_user(sessions, 20.0)
+        async with sessions() as session:
+            with pytest.raises(InsufficientFundsError):
+                await debit(session, USER_ID, 30.0, 'campaign', 'campaign:1')
+            await session.commit()
+
+        assert await _state(sessions) == (20.0, 0)
+
+        # Ключ отклоненного списания не занят: после пополнения та же операция проходит
+        async with sessions() as session:
+            await credit(session, USER_ID, 10.0, 'topup', 'topup:1')
+            assert await debit(session, USER_ID, 30.0, 'campaign', 'campaign:1') == 0.0
+            await session.commit()
+
+    with_database(test)
+
+
+def test_unknown_user(with_database):
+    async def test(sessions):
+        async with sessions() as session:
+            assert await credit(session, USER_ID, 10.0, 'topup') is None
+            with pytest.raises(InsufficientFundsError):
+                await debit(session, USER_ID, 10.0, 'campaign')
+
+    with_database(test)
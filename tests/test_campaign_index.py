@@ -0,0 +1,132 @@
+from campaign_index import CampaignIndex
+
+
+def build(campaigns, category_channels):
+    index = CampaignIndex()
+    index.rebuild(campaigns, category_channels)
+    return index
+
+
+def test_match_by_catalogue_channel():
+    index = build([(1, 10, "Еда"), (2, 10, "Спорт")], {"Еда": {100, 101}, "Спорт": {200}})
+
+    assert index.match(100, 10) == [(1, "Еда")]
+    assert index.match(200, 10) == [(2, "Спорт")]
+    assert index.match(300, 10) == []
+
+
+def test_match_only_campaigns_of_the_bot():
+    index = build([(1, 10, "Еда"), (2, 20, "Еда")], {"Еда": {100}})
+
+    assert index.match(100, 10) == [(1, "Еда")]
+    assert index.match(100, 20) == [(2, "Еда")]
+    assert index.match(100, 30) == []
+
+
+def test_channel_entries_are_per_bot():
+    index = build([(1, 10, "Еда"), (2, 20, "Еда"), (3, 20, "Еда")], {"Еда": {100}})
+
+    assert index._by_channel[100] == {10: {1}, 20: {2, 3}}
+
+    index.remove(1)
+    assert index._by_channel[100] == {20: {2, 3}}
+    assert sorted(index.match(100, 20)) == [(2, "Еда"), (3, "Еда")]
+
+    index.retain(set())
+    assert index.stats()['channels'] == 0
+
+
+def test_catalogue_of_category_without_campaigns_adds_no_channels():
+    index = build([], {})
+
+    index.set_category_channels("Еда", {100, 101})
+
+    assert index.stats()['channels'] == 0
+
+
+def test_category_without_catalogue_matches_any_channel():
+    index = build([(1, 10, "Мода")], {})
+
+    assert index.match(100, 10) == [(1, "Мода")]
+    assert index.match(None, 10) == [(1, "Мода")]
+    assert index.match(100, 20) == []
+
+
+def test_category_with_empty_catalogue_matches_any_channel():
+    index = build([(1, 10, "Еда")], {"Еда": set()})
+
+    assert index.match(555, 10) == [(1, "Еда")]
+
+    index.set_category_channels("Еда", set())
+    assert index.match(555, 10) == [(1, "Еда")]
+
+    index.set_category_channels("Еда", {100})
+    assert index.match(555, 10) == []
+    assert index.match(100, 10) == [(1, "Еда")]
+
+
+def test_add_and_remove():
+    index = build([], {"Еда": {100}})
+
+    index.add(1, 10, "Еда")
+    index.add(2, 10, "Мода")
+    assert 1 in index and len(index) == 2
+    assert sorted(index.match(100, 10)) == [(1, "Еда"), (2, "Мода")]
+
+    index.remove(1)
+    index.remove(2)
+    index.remove(3)
+    assert len(index) == 0
+    assert index.match(100, 10) == []
+    assert index.stats()['channels'] == 0
+
+
+def test_add_again_moves_campaign():
+    index = build([(1, 10, "Еда")], {"Еда": {100}, "Спорт": {200}})
+
+    index.add(1, 20, "Спорт")
+
+    assert index.match(100, 10) == []
+    assert index.match(200, 10) == []
+    assert index.match(200, 20) == [(1, "Спорт")]
+
+
+def test_retain_removes_ended_campaigns():
+    index = build([(1, 10, "Еда"), (2, 10, "Еда"), (3, 10, "Мода")], {"Еда": {100}})
+
+    assert index.retain({2}) == 2
+    assert index.match(100, 10) == [(2, "Еда")]
+
+
+def test_set_category_channels_moves_only_changed_channels():
+    index = build([(1, 10, "Еда")], {"Еда": {100, 101}})
+
+    index.set_category_channels("Еда", {101, 102})
+
+    assert index.match(100, 10) == []
+    assert index.match(101, 10) == [(1, "Еда")]
+    assert index.match(102, 10) == [(1, "Еда")]
+
+
+def test_set_category_channels_opens_and_closes_category():
+    index = build([(1, 10, "Еда")], {"Еда": {100}})
+
+    # Каталог категории опустел: кампания подходит к любому каналу
+    index.set_category_channels("Еда", set())
+    assert index.match(100, 10) == [(1, "Еда")]
+    assert index.match(500, 10) == [(1, "Еда")]
+
+    # Каталог появился снова: только его каналы
+    index.set_category_channels("Еда", {200})
+    assert index.match(500, 10) == []
+    assert index.match(200, 10) == [(1, "Еда")]
+
+
+def test_new_campaign_uses_current_category_channels():
+    index = build([], {})
+    index.set_category_channels("Еда", {100})
+
+    index.add(1, 10, "Еда")
+
+    assert index.match(100, 10) == [(1, "Еда")]
+    assert index.match(101, 10) == []
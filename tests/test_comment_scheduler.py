@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("telethon")
+
+from comment_scheduler import DAY, HOUR, CommentScheduler, _Account
+
+
+async def _noop():
+    pass
+
+
+def test_available_at_without_history_is_next_at():
+    account = _Account(1)
+    assert account.available_at(1000.0, daily=3, hourly=2) == 0.0
+
+    account.next_at = 1500.0
+    assert account.available_at(1000.0, daily=3, hourly=2) == 1500.0
+
+
+def test_record_sets_spacing():
+    account = _Account(1)
+    account.record(1000.0, spacing=180, jitter=0)
+
+    assert account.next_at == 1180.0
+    assert list(account.sent_hour) == [1000.0]
+    assert list(account.sent_day) == [1000.0]
+
+
+def test_hourly_budget_waits_for_oldest_send_in_window():
+    account = _Account(1)
+    for at in (1000.0, 1100.0, 1200.0):
+        account.record(at, spacing=0, jitter=0)
+
+    # Бюджет 3 в час исчерпан: следующий слот - через час после первой отправки окна
+    assert account.available_at(1300.0, daily=100, hourly=3) == 1000.0 + HOUR
+    # При бюджете 2 важна предпоследняя отправка
+    assert account.available_at(1300.0, daily=100, hourly=2) == 1100.0 + HOUR
+    # Бюджет не исчерпан: ограничивает только интервал
+    assert account.available_at(1300.0, daily=100, hourly=4) == 1200.0
+
+
+def test_daily_budget_waits_for_oldest_send_in_day():
+    account = _Account(1)
+    for at in (0.0, 2 * HOUR, 4 * HOUR):
+        account.record(at, spacing=0, jitter=0)
+
+    assert account.available_at(5 * HOUR, daily=3, hourly=100) == DAY
+    assert account.available_at(5 * HOUR, daily=4, hourly=100) == 4 * HOUR
+
+
+def test_old_sends_leave_the_windows():
+    account = _Account(1)
+    account.record(0.0, spacing=0, jitter=0)
+    account.record(10.0, spacing=0, jitter=0)
+
+    assert account.available_at(HOUR + 5, daily=100, hourly=2) == 10.0
+    assert list(account.sent_hour) == [10.0]
+
+    assert account.available_at(DAY + 20, daily=2, hourly=100) == 10.0
+    assert not account.sent_day
+
+
+def test_budget_and_spacing_combine():
+    account = _Account(1)
+    account.record(1000.0, spacing=600, jitter=0)
+
+    # Интервал позже, чем освобождение часового бюджета
+    assert account.available_at(1100.0, daily=100, hourly=1) == 1000.0 + HOUR
+    assert account.available_at(1100.0, daily=100, hourly=2) == 1600.0
+
+
+def test_forgotten_campaign_does_not_spend_budget():
+    scheduler = CommentScheduler(min_spacing=0, jitter=0)
+    paid_until = datetime.now() + timedelta(days=1)
+    scheduler.submit(1, 10, paid_until, _noop)
+    scheduler.submit(1, 10, paid_until, _noop)
+
+    scheduler.forget_campaign(10)
+    account = scheduler._accounts[1]
+    scheduler._dispatch(account, time.monotonic())
+
+    assert scheduler.cancelled == 2
+    assert scheduler.pending == 0
+    assert not account.sent_day
+    assert not scheduler._forgotten
+
+
+def test_resubmitted_campaign_is_not_cancelled():
+    scheduler = CommentScheduler(min_spacing=0, jitter=0)
+    paid_until = datetime.now() + timedelta(days=1)
+    scheduler.submit(1, 10, paid_until, _noop)
+
+    scheduler.forget_campaign(10)
+    scheduler.submit(1, 10, paid_until, _noop)
+    comment = scheduler._next_comment(scheduler._accounts[1], time.monotonic())
+
+    assert comment is not None and comment.campaign_id == 10
+    assert scheduler.cancelled == 0
+
+
+def test_queue_limit_drops_comments():
+    scheduler = CommentScheduler(max_pending=1)
+    paid_until = datetime.now() + timedelta(days=1)
+
+    assert scheduler.submit(1, 10, paid_until, _noop)
+    assert not scheduler.submit(1, 11, paid_until, _noop)
+    assert scheduler.dropped == 1
@@ -0,0 +1,122 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiogram")
+
+from sqlalchemy import select
+
+from database.models import UserBot, UserBotHealth
+from userbot_allocator import claim_userbot, confirm_userbot, leased_userbot, release_userbot, renew_lease
+
+ALICE = 1
+BOB = 2
+
+
+async def _create_bots(sessions, count):
+    async with sessions() as session:
+        bots = [
+            UserBot(owner_id=0, account_id=100 + number, session_name=f"bot{number}", isoccupied=False)
+            for number in range(count)
+        ]
+        session.add_all(bots)
+        await session.commit()
+        return [bot.id for bot in bots]
+
+
+async def _bot(sessions, bot_id):
+    async with sessions() as session:
+        return (await session.execute(
+            select(UserBot.isoccupied, UserBot.lease_owner, UserBot.lease_expires_at).where(UserBot.id == bot_id)
+        )).one()
+
+
+def test_claim_leases_distinct_bots(with_database):
+    async def test(sessions):
+        await _create_bots(sessions, 2)
+        async with sessions() as session:
+            alice = await claim_userbot(session, ALICE)
+            bob = await claim_userbot(session, BOB)
+            assert await claim_userbot(session, 3) is None
+            await session.commit()
+
+        assert alice.id != bob.id
+        assert (await _bot(sessions, alice.id)).lease_owner == ALICE
+        assert (await _bot(sessions, bob.id)).lease_owner == BOB
+
+    with_database(test)
+
+
+def test_claim_again_returns_the_leased_bot(with_database):
+    async def test(sessions):
+        await _create_bots(sessions, 2)
+        async with sessions() as session:
+            first = await claim_userbot(session, ALICE)
+            again = await claim_userbot(session, ALICE)
+            await session.commit()
+
+        assert again.id == first.id
+        async with sessions() as session:
+            assert (await leased_userbot(session, ALICE)).id == first.id
+            assert await leased_userbot(session, BOB) is None
+
+    with_database(test)
+
+
+def test_claim_skips_excluded_and_unhealthy_bots(with_database):
+    async def test(sessions):
+        first, second, third = await _create_bots(sessions, 3)
+        async with sessions() as session:
+            session.add(UserBotHealth(userbot_id=second, is_authorized=False))
+            await session.commit()
+
+        async with sessions() as session:
+            row = await claim_userbot(session, ALICE, exclude=[first])
+            await session.commit()
+
+        assert row.id == third
+
+    with_database(test)
+
+
+def test_confirm_requires_own_lease(with_database):
+    async def test(sessions):
+        free, leased = await _create_bots(sessions, 2)
+        async with sessions() as session:
+            assert (await claim_userbot(session, ALICE, exclude=[free])).id == leased
+
+            # Чужой арендованный и свободный без аренды бот не занимаются
+            assert not await confirm_userbot(session, leased, BOB)
+            assert not await confirm_userbot(session, free, ALICE)
+
+            assert await confirm_userbot(session, leased, ALICE)
+            assert not await confirm_userbot(session, leased, ALICE)
+            await session.commit()
+
+        assert tuple(await _bot(sessions, leased)) == (True, None, None)
+        assert tuple(await _bot(sessions, free)) == (False, None, None)
+
+    with_database(test)
+
+
+def test_release_and_renew_only_by_owner(with_database):
+    async def test(sessions):
+        (bot_id,) = await _create_bots(sessions, 1)
+        async with sessions() as session:
+            await claim_userbot(session, ALICE)
+            await session.commit()
+
+        async with sessions() as session:
+            assert await renew_lease(session, BOB) is None
+            assert await renew_lease(session, ALICE) == bot_id
+
+            await release_userbot(session, bot_id, BOB)
+            assert (await leased_userbot(session, ALICE)).id == bot_id
+
+            await release_userbot(session, bot_id, ALICE)
+            assert await leased_userbot(session, ALICE) is None
+            assert await renew_lease(session, ALICE) is None
+            await session.commit()
+
+        assert tuple(await _bot(sessions, bot_id)) == (False, None, None)
+
+    with_database(test)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Выделение свободных юзерботов под новые кампании.
+
+Бот закрепляется за пользователем одним запросом UPDATE ... RETURNING:
+кандидат выбирается по частичному индексу ix_userbots_free с
+FOR UPDATE SKIP LOCKED, поэтому параллельные пользователи никогда не
+получают одного и того же бота и не ждут друг друга. Закрепление
+оформляется арендой с временем истечения: мастер создания кампании
+продлевает ее, а фоновый сборщик возвращает в пул ботов из брошенных
+мастеров. Занятым (isoccupied) бот становится только при создании кампании.
+
+Источник истины о боте мастера - аренда в базе (leased_userbot), а не
+данные FSM: бот может быть заменен предварительной проверкой в фоне, пока
+обработчики мастера параллельно обновляют свои данные.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from aiogram import BaseMiddleware
+from sqlalchemy import and_, exists, or_, select, true, update
+
+from database.db import AsyncSession
+from database.models import UserBot, UserBotHealth
+
+logger = logging.getLogger(__name__)
+
+# Время аренды бота без действий пользователя и период работы сборщика
+USERBOT_LEASE_TTL = int(os.environ.get('USERBOT_LEASE_TTL', '900'))
+USERBOT_LEASE_REAP_INTERVAL = int(os.environ.get('USERBOT_LEASE_REAP_INTERVAL', '60'))
+
+
+def _is_free():
+    """Условие свободного бота; совпадает с условием частичного индекса ix_userbots_free."""
+    return and_(UserBot.isoccupied == False, UserBot.lease_owner.is_(None))
+
+
+def _is_healthy(now):
+    """Исключает ботов, которых фоновый мониторинг пометил недоступными."""
+    return ~exists().where(
+        UserBotHealth.userbot_id == UserBot.id,
+        or_(
+            UserBotHealth.is_authorized.is_(False),
+            UserBotHealth.is_restricted.is_(True),
+            UserBotHealth.spam_status == 'limited',
+            UserBotHealth.flood_wait_until > now
+        )
+    )
+
+
+def _held_by(owner_id):
+    """Бот арендован этим пользователем и еще не занят кампанией."""
+    return and_(UserBot.isoccupied == False, UserBot.lease_owner == owner_id)
+
+
+async def claim_userbot(session, owner_id, exclude=None):
+    """
+    Закрепляет за пользователем свободного юзербота.
+
+    Если у пользователя уже есть арендованный бот (например, мастер был
+    запущен повторно), аренда продлевается и возвращается тот же бот.
+
+    Args:
+        session (AsyncSession): Сессия базы данных текущего обновления
+        owner_id (int): Telegram ID пользователя
+        exclude (list, optional): ID ботов, которые выдавать нельзя (не прошли проверку)
+
+    Returns:
+        Row: (id, session_name) юзербота или None, если свободных ботов нет
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=USERBOT_LEASE_TTL)
+    allowed = UserBot.id.notin_(exclude) if exclude else true()
+
+    row = (await session.execute(
+        update(UserBot)
+        .where(_held_by(owner_id), allowed)
+        .values(lease_expires_at=expires_at)
+        .returning(UserBot.id, UserBot.session_name)
+    )).first()
+    if row:
+        return row
+
+    candidate = (
+        select(UserBot.id)
+        .where(_is_free(), _is_healthy(now), allowed)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    # Условие свободы повторяется во внешнем UPDATE, чтобы запрос оставался атомарным
+    # и в базах без SKIP LOCKED (SQLite сериализует запись сам)
+    row = (await session.execute(
+        update(UserBot)
+        .where(UserBot.id == candidate, _is_free())
+        .values(lease_owner=owner_id, lease_expires_at=expires_at)
+        .returning(UserBot.id, UserBot.session_name)
+    )).first()
+    if row:
+        logger.info(f"Юзербот {row.id} закреплен за пользователем {owner_id}")
+    return row
+
+
+async def leased_userbot(session, owner_id):
+    """
+    Возвращает бота, арендованного пользователем для мастера.
+
+    Returns:
+        Row: (id, session_name) юзербота или None, если аренды нет
+    """
+    return (await session.execute(
+        select(UserBot.id, UserBot.session_name).where(_held_by(owner_id)).limit(1)
+    )).first()
+
+
+async def renew_lease(session, owner_id):
+    """
+    Продлевает аренду бота пользователем.
+
+    Аренда, которую сборщик уже вернул в пул, не восстанавливается: бот мог
+    быть отклонен проверкой или выдан другому пользователю.
+
+    Returns:
+        int: ID бота или None, если аренды больше нет
+    """
+    return (await session.execute(
+        update(UserBot)
+        .where(_held_by(owner_id))
+        .values(lease_expires_at=datetime.now() + timedelta(seconds=USERBOT_LEASE_TTL))
+        .returning(UserBot.id)
+    )).scalar()
+
+
+async def confirm_userbot(session, bot_id, owner_id):
+    """
+    Помечает арендованного бота занятым при создании кампании.
+
+    Бот должен быть арендован именно этим пользователем: свободного бота без
+    аренды (например, отклоненного проверкой) занять нельзя.
+
+    Returns:
+        bool: True, если бот был закреплен за пользователем и теперь занят
+    """
+    row = (await session.execute(
+        update(UserBot)
+        .where(UserBot.id == bot_id, _held_by(owner_id))
+        .values(isoccupied=True, lease_owner=None, lease_expires_at=None)
+        .returning(UserBot.id)
+    )).first()
+    return row is not None
+
+
+async def release_userbot(session, bot_id, owner_id):
+    """Досрочно возвращает арендованного бота в пул (отмена мастера)."""
+    await session.execute(
+        update(UserBot)
+        .where(UserBot.id == bot_id, _held_by(owner_id))
+        .values(lease_owner=None, lease_expires_at=None)
+    )
+
+
+async def reap_expired_leases():
+    """
+    Возвращает в пул ботов с истекшей арендой.
+
+    Returns:
+        int: Количество освобожденных ботов
+    """
+    session = AsyncSession()
+    try:
+        result = await session.execute(
+            update(UserBot)
+            .where(
+                UserBot.lease_owner.isnot(None),
+                UserBot.lease_expires_at < datetime.now(),
+                UserBot.isoccupied == False
+            )
+            .values(lease_owner=None, lease_expires_at=None)
+        )
+        await session.commit()
+        return result.rowcount
+    except Exception as e:
+        logger.error(f"Ошибка при освобождении ботов с истекшей арендой: {e}")
+        await session.rollback()
+        return 0
+    finally:
+        await session.close()
+
+
+async def run_lease_reaper(interval=USERBOT_LEASE_REAP_INTERVAL):
+    """Бесконечный цикл возврата брошенных ботов в пул."""
+    while True:
+        reaped = await reap_expired_leases()
+        if reaped:
+            logger.info(f"Возвращено в пул юзерботов с истекшей арендой: {reaped}")
+        await asyncio.sleep(interval)
+
+
+class LeaseRenewalMiddleware(BaseMiddleware):
+    """
+    Продлевает аренду бота, пока пользователь проходит мастер создания кампании.
+
+    Аренда продлевается не на каждое обновление, а когда прошла треть ее срока.
+    """
+
+    def __init__(self, ttl=USERBOT_LEASE_TTL):
+        self.renew_every = ttl / 3
+        self._renewed_at = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        state = data.get('state')
+        if user and state and data.get('raw_state'):
+            now = time.monotonic()
+            if now - self._renewed_at.get(user.id, 0) >= self.renew_every:
+                self._renewed_at[user.id] = now
+                if await renew_lease(data['session'], user.id) is None:
+                    logger.warning(f"У пользователя {user.id} в мастере нет арендованного юзербота")
+        return await handler(event, data)
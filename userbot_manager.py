@@ -1,18 +1,34 @@
 #!/usr/bin/env python3
-from telethon import TelegramClient
+from telethon import TelegramClient, events, utils
+from telethon.errors import FloodWaitError, UnauthorizedError, UserNotParticipantError
+from telethon.sessions import StringSession
 from telethon.tl.functions.account import UpdateProfileRequest, UpdateUsernameRequest
+from telethon.tl.functions.channels import GetParticipantRequest
+from telethon.tl.functions.messages import GetDiscussionMessageRequest
 from telethon.tl.functions.photos import UploadProfilePhotoRequest
+from telethon.tl.functions.users import GetFullUserRequest
+from telethon.tl.types import (
+    ChannelParticipantAdmin, ChannelParticipantCreator, InputPeerSelf, InputUserSelf,
+    UpdateChannel, UpdateChannelParticipant
+)
 import asyncio
 import os
 import re
-from database.db import Session
+import time
+from database.db import AsyncSession
 from database.models import UserBot
+from sqlalchemy import select
 import logging
-import boto3
-from botocore.exceptions import ClientError
-import tempfile
 from urllib.parse import urlparse
 from dotenv import load_dotenv
+from client_pool import ClientPool
+from session_cache import SessionCache
+from storage import get_storage
+from string_sessions import decrypt_session_string
+from rpc_scheduler import rpc_scheduler
+from avatar_pipeline import prepare_avatar, content_hash, uploaded_avatars
+from ttl_cache import TTLCache
+from peer_cache import peer_cache
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -21,24 +37,36 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levellevelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Параметры для S3 Bucketeer
-BUCKETEER_AWS_ACCESS_KEY_ID = os.environ.get('BUCKETEER_AWS_ACCESS_KEY_ID')
-BUCKETEER_AWS_SECRET_ACCESS_KEY = os.environ.get('BUCKETEER_AWS_SECRET_ACCESS_KEY')
-BUCKETEER_BUCKET_NAME = os.environ.get('BUCKETEER_BUCKET_NAME')
-BUCKETEER_REGION = os.environ.get('BUCKETEER_REGION', 'us-east-1')
+# Общее хранилище объектов (S3 или локальная файловая система)
+storage = get_storage()
 
-# Инициализация клиента S3
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=BUCKETEER_AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=BUCKETEER_AWS_SECRET_ACCESS_KEY,
-    region_name=BUCKETEER_REGION
-) if all([BUCKETEER_AWS_ACCESS_KEY_ID, BUCKETEER_AWS_SECRET_ACCESS_KEY, BUCKETEER_BUCKET_NAME]) else None
+# Локальный кэш файлов сессий, сверяемый с хранилищем по ETag
+session_cache = SessionCache(storage)
 
-if s3_client:
-    logger.info(f"S3 клиент инициализирован для бакета {BUCKETEER_BUCKET_NAME}")
-else:
-    logger.warning("S3 клиент не инициализирован. Отсутствуют необходимые переменные окружения.")
+# Кэш проверок прав администратора: (аккаунт, ID канала) -> bool.
+# Отрицательный результат живет недолго, чтобы повторная проверка после
+# назначения бота администратором не ждала истечения кэша.
+ADMIN_VERDICT_TTL = int(os.environ.get('ADMIN_VERDICT_TTL', '600'))
+ADMIN_NEGATIVE_VERDICT_TTL = int(os.environ.get('ADMIN_NEGATIVE_VERDICT_TTL', '10'))
+admin_verdicts = TTLCache(ADMIN_VERDICT_TTL)
+
+# Успешные проверки доступности: ID юзербота -> результат get_me.
+# Предварительная проверка в начале мастера делает следующую проверку мгновенной.
+USERBOT_AVAILABILITY_TTL = int(os.environ.get('USERBOT_AVAILABILITY_TTL', '300'))
+available_userbots = TTLCache(USERBOT_AVAILABILITY_TTL)
+
+# Топология каналов: канал -> группа обсуждения и (канал, пост) -> сообщение ветки комментариев.
+# Группа канала меняется редко и сбрасывается по UpdateChannel.
+TOPOLOGY_LINKED_TTL = int(os.environ.get('TOPOLOGY_LINKED_TTL', str(12 * 3600)))
+TOPOLOGY_DISCUSSION_TTL = int(os.environ.get('TOPOLOGY_DISCUSSION_TTL', str(3 * 24 * 3600)))
+TOPOLOGY_MAX_ENTRIES = int(os.environ.get('TOPOLOGY_MAX_ENTRIES', '100000'))
+
+# Причины неудачных подключений: имя сессии -> (сессия отклонена Telegram, текст ошибки).
+# Позволяет отличить недействительную сессию от сетевого сбоя, когда пул вернул None.
+CONNECT_FAILURE_TTL = int(os.environ.get('CONNECT_FAILURE_TTL', '3600'))
+connect_failures = TTLCache(CONNECT_FAILURE_TTL)
+# Причина последней неудачной check_userbot_availability: ID юзербота -> (сессия отклонена, текст ошибки)
+availability_failures = TTLCache(CONNECT_FAILURE_TTL)
 
 # Пути к локальным директориям для резервного доступа
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -90,50 +118,6 @@ def extract_session_name(session_string):
     logger.debug(f"Извлечено имя сессии: {session_name}")
     return session_name
 
-async def download_session_from_s3(session_name):
-    """
-    Загружает файл сессии из S3 хранилища.
-    
-    Args:
-        session_name (str): Имя сессии
-        
-    Returns:
-        str: Путь к загруженному файлу или None если ошибка
-    """
-    if not s3_client:
-        logger.error("S3 клиент не инициализирован")
-        return None
-    
-    # Создаем временный файл для сохранения сессии
-    with tempfile.NamedTemporaryFile(suffix='.session', delete=False) as tmp_file:
-        temp_path = tmp_file.name
-        
-    try:
-        # Полный путь к файлу в S3
-        s3_key = f"sessions/{session_name}.session"
-        
-        logger.info(f"Загрузка сессии из S3: {BUCKETEER_BUCKET_NAME}/{s3_key}")
-        
-        # Загружаем файл из S3
-        s3_client.download_file(BUCKETEER_BUCKET_NAME, s3_key, temp_path)
-        
-        logger.info(f"Сессия успешно загружена из S3 во временный файл: {temp_path}")
-        return temp_path
-    
-    except ClientError as e:
-        logger.error(f"Ошибка при загрузке сессии из S3: {e}")
-        # Удаляем временный файл в случае ошибки
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
-        return None
-    
-    except Exception as e:
-        logger.error(f"Неизвестная ошибка при загрузке сессии из S3: {e}")
-        # Удаляем временный файл в случае ошибки
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
-        return None
-
 async def find_local_session_file(session_name):
     """
     Ищет локальный файл сессии в доступных директориях.
@@ -144,6 +128,12 @@ async def find_local_session_file(session_name):
     Returns:
         str: Путь к найденному файлу или None
     """
+    # Сначала проверяем локальный кэш сессий
+    cached_path = session_cache.cached_path(session_name)
+    if cached_path:
+        logger.info(f"Найден файл сессии в кэше: {cached_path}")
+        return cached_path
+    
     for dir_path in LOCAL_SESSIONS_DIRS:
         full_path = os.path.join(dir_path, f"{session_name}.session")
         if os.path.exists(full_path):
@@ -153,13 +143,14 @@ async def find_local_session_file(session_name):
     logger.warning(f"Локальный файл сессии '{session_name}.session' не найден")
     return None
 
-async def get_client_by_session_name(session_name):
+async def get_client_by_session_name(session_name, session_string=None):
     """
     Получает клиент Telethon по имени сессии.
-    Приоритет: S3 хранилище -> локальные файлы.
+    Приоритет: StringSession из базы данных -> кэш сессий, сверенный с хранилищем -> локальные файлы.
     
     Args:
         session_name (str): Имя сессии или URL к файлу сессии
+        session_string (str, optional): Зашифрованная StringSession из UserBot.session_string
         
     Returns:
         TelegramClient: Клиент Telethon
@@ -168,61 +159,229 @@ async def get_client_by_session_name(session_name):
     clean_name = extract_session_name(session_name)
     logger.info(f"Получение клиента для сессии: {clean_name}")
     
-    session_path = None
-    temp_file = None
+    # StringSession подключается из памяти, без скачивания файла сессии
+    if session_string:
+        plain_session = decrypt_session_string(session_string)
+        if plain_session:
+            # FloodWait не пережидается внутри Telethon, его обрабатывает планировщик запросов
+            client = TelegramClient(StringSession(plain_session), api_id=1, api_hash="x", flood_sleep_threshold=0)
+            return await _connect_client(client, clean_name)
+        logger.warning(f"StringSession для {clean_name} недоступна, используется файл сессии")
     
-    # Сначала пытаемся загрузить из S3
-    if s3_client:
-        temp_file = await download_session_from_s3(clean_name)
-        if temp_file:
-            session_path = temp_file
+    # Затем берем сессию из кэша (скачивается из хранилища только при изменении)
+    session_path = await session_cache.get(clean_name)
     
-    # Если не удалось загрузить из S3, ищем локально
+    # Если не удалось получить из хранилища, ищем локально
     if not session_path:
         session_path = await find_local_session_file(clean_name)
     
-    # Если файл сессии не найден ни в S3, ни локально
+    # Если файл сессии не найден ни в хранилище, ни локально
     if not session_path:
         logger.error(f"Файл сессии для {clean_name} не найден")
+        connect_failures.set(clean_name, (True, "Файл сессии не найден"))
         return None
     
     try:
-        # При использовании временного файла из S3, указываем путь без расширения
-        if temp_file:
-            client_session_path = temp_file[:-8]
-        else:
-            client_session_path = session_path[:-8] if session_path.endswith('.session') else session_path
-        
-        # Создаем клиент с указанием пути к сессии
-        client = TelegramClient(client_session_path, api_id=1, api_hash="x")
+        # Указываем путь без расширения
+        client_session_path = session_path[:-8] if session_path.endswith('.session') else session_path
         
+        # Создаем клиент с указанием пути к сессии (FloodWait обрабатывает планировщик запросов)
+        client = TelegramClient(client_session_path, api_id=1, api_hash="x", flood_sleep_threshold=0)
+    except Exception as e:
+        logger.error(f"Ошибка при создании клиента Telethon для {clean_name}: {e}")
+        return None
+    
+    return await _connect_client(client, clean_name)
+
+async def _connect_client(client, clean_name):
+    """
+    Подключает клиент и проверяет авторизацию.
+    
+    Returns:
+        TelegramClient: Подключенный клиент или None
+    """
+    try:
         # Подключаемся к Telegram
         await client.connect()
         
         # Проверяем авторизацию
         if not await client.is_user_authorized():
             logger.error(f"Сессия {clean_name} не авторизована")
+            connect_failures.set(clean_name, (True, "Сессия не авторизована"))
             await client.disconnect()
-            
-            # Удаляем временный файл если он был создан
-            if temp_file and os.path.exists(temp_file):
-                os.unlink(temp_file)
-            
             return None
         
+        # Сбрасываем кэш проверок прав при изменениях участников канала
+        client.add_event_handler(_on_channel_update, events.Raw(types=(UpdateChannelParticipant, UpdateChannel)))
+        
+        connect_failures.pop(clean_name)
         logger.info(f"Успешное подключение к сессии {clean_name}")
         return client
         
     except Exception as e:
-        logger.error(f"Ошибка при создании клиента Telethon для {clean_name}: {e}")
-        
-        # Удаляем временный файл если он был создан
-        if temp_file and os.path.exists(temp_file):
-            os.unlink(temp_file)
+        logger.error(f"Ошибка при подключении клиента Telethon для {clean_name}: {e}")
+        # Сетевые ошибки не означают, что сессия недействительна
+        connect_failures.set(clean_name, (isinstance(e, UnauthorizedError), str(e)[:255] or type(e).__name__))
+        return None
+
+async def _on_channel_update(update):
+    """Инвалидирует закэшированные проверки прав администратора и топологию канала."""
+    channel_id = update.channel_id
+    if admin_verdicts.pop_where(lambda key: key[1] == channel_id):
+        logger.info(f"Кэш прав администратора сброшен для канала {channel_id}")
+    # UpdateChannel приходит и при смене группы обсуждения
+    if isinstance(update, UpdateChannel):
+        channel_topology.forget(channel_id)
+
+class ChannelTopologyCache:
+    """
+    Кэш групп обсуждения каналов и сообщений веток комментариев.
+    
+    Для комментария нужны группа обсуждения канала и ID копии поста в ней.
+    Оба значения по возможности берутся из уже полученных обновлений: пост
+    канала содержит ID группы в replies.channel_id, а копия поста в группе -
+    ссылку на исходный пост в fwd_from. Промах кэша обслуживается одним
+    запросом через планировщик с лимитом аккаунта. Хранятся только ID, а
+    access_hash группы - в общем кэше сущностей аккаунта.
+    
+    Args:
+        linked_ttl (int): Время жизни связи канал -> группа в секундах
+        discussion_ttl (int): Время жизни связи пост -> сообщение ветки в секундах
+        max_entries (int): Максимальное количество записей каждого вида
+    """
+    
+    def __init__(self, linked_ttl=TOPOLOGY_LINKED_TTL, discussion_ttl=TOPOLOGY_DISCUSSION_TTL,
+                 max_entries=TOPOLOGY_MAX_ENTRIES):
+        self._linked = TTLCache(linked_ttl, max_entries=max_entries)  # ID канала -> ID группы
+        self._discussions = TTLCache(discussion_ttl, max_entries=max_entries)  # (канал, пост) -> ID сообщения
+        
+        # Счетчики для мониторинга
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.relinked = 0
+    
+    def learn(self, message):
+        """
+        Запоминает топологию из сообщения, пришедшего в обновлениях.
+        
+        Args:
+            message (Message): Пост канала или копия поста в группе обсуждения
+        """
+        channel_id = getattr(message.peer_id, 'channel_id', None)
+        if channel_id is None:
+            return
+        replies = message.replies
+        if message.post and replies and replies.comments and replies.channel_id:
+            self._set_linked(channel_id, replies.channel_id)
+            return
+        
+        forward = message.fwd_from
+        source = getattr(forward, 'saved_from_peer', None) if forward else None
+        source_id = getattr(source, 'channel_id', None)
+        if source_id and forward.saved_from_msg_id:
+            self._set_linked(source_id, channel_id)
+            self._discussions.set((source_id, forward.saved_from_msg_id), message.id)
+            self.learned += 1
+    
+    def _set_linked(self, channel_id, linked_chat_id):
+        previous = self._linked.get(channel_id)
+        if previous is not None and previous != linked_chat_id:
+            # Канал сменил группу обсуждения: старые ветки больше не действительны
+            self._discussions.pop_where(lambda key: key[0] == channel_id)
+            self.relinked += 1
+            logger.info(f"Канал {channel_id} сменил группу обсуждения: {previous} -> {linked_chat_id}")
+        if previous != linked_chat_id:
+            self.learned += 1
+        self._linked.set(channel_id, linked_chat_id)
+    
+    def forget(self, channel_id):
+        """Сбрасывает все записи канала."""
+        self._linked.pop(channel_id)
+        self._discussions.pop_where(lambda key: key[0] == channel_id)
+    
+    async def comment_target(self, client, account, channel, post_id):
+        """
+        Возвращает группу и сообщение, ответ на которое попадает в комментарии к посту.
+        
+        Args:
+            client (TelegramClient): Подключенный клиент аккаунта
+            account (str): Ключ аккаунта (имя сессии)
+            channel (InputPeerChannel): Канал поста
+            post_id (int): ID поста в канале
+            
+        Returns:
+            tuple: (InputPeer группы, ID сообщения для reply_to) или None, если у поста нет ветки комментариев
+        """
+        linked = self._linked.get(channel.channel_id)
+        message_id = self._discussions.get((channel.channel_id, post_id))
+        if linked and message_id is not None:
+            try:
+                target = await peer_cache.get_input_entity(client, account, linked)
+                self.hits += 1
+                return target, message_id
+            except ValueError:
+                # Группа известна по обновлениям, но access_hash для этого аккаунта еще не получен
+                pass
+        
+        self.misses += 1
+        result = await rpc_scheduler.call(
+            account, 'discussion', lambda: client(GetDiscussionMessageRequest(peer=channel, msg_id=post_id))
+        )
+        await peer_cache.remember_many(account, result.chats)
+        if not result.messages:
+            return None
+        # Первое сообщение ответа - копия поста в группе обсуждения
+        top = min(result.messages, key=lambda message: message.id)
+        linked = getattr(top.peer_id, 'channel_id', None)
+        chat = next((chat for chat in result.chats if chat.id == linked), None)
+        if chat is None:
+            return None
+        self._set_linked(channel.channel_id, linked)
+        self._discussions.set((channel.channel_id, post_id), top.id)
+        return utils.get_input_peer(chat), top.id
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            'learned': self.learned,
+            'relinked': self.relinked,
+        }
+
+# Общий кэш топологии каналов для всех аккаунтов процесса
+channel_topology = ChannelTopologyCache()
+
+async def _get_userbot_credentials(userbot_id, session=None):
+    """
+    Получает данные сессии юзербота из базы данных.
+    
+    Args:
+        userbot_id (int): ID юзербота в базе данных
+        session (AsyncSession, optional): Открытая сессия; без нее создается собственная
         
+    Returns:
+        tuple: (session_name, session_string) или None, если юзербот не найден
+    """
+    query = select(UserBot.session_name, UserBot.session_string).where(UserBot.id == userbot_id)
+    if session is not None:
+        row = (await session.execute(query)).first()
+    else:
+        async with AsyncSession() as own_session:
+            row = (await own_session.execute(query)).first()
+    
+    if not row:
+        logger.error(f"Юзербот с ID {userbot_id} не найден в базе данных")
         return None
+    
+    return row.session_name, row.session_string
 
-async def update_bot_profile(userbot_id, first_name=None, bio=None, photo_path=None):
+# Пул подключенных клиентов: повторные операции с аккаунтом не переподключаются
+client_pool = ClientPool(get_client_by_session_name)
+
+async def update_bot_profile(userbot_id, first_name=None, bio=None, photo_path=None, photo_bytes=None, session=None):
     """
     Обновляет профиль юзербота (имя, био, фото).
     
@@ -231,117 +390,148 @@ async def update_bot_profile(userbot_id, first_name=None, bio=None, photo_path=N
         first_name (str, optional): Новое имя для юзербота
         bio (str, optional): Новое описание для юзербота
         photo_path (str, optional): Путь к файлу фото для аватарки
+        photo_bytes (bytes, optional): Аватарка, подготовленная avatar_pipeline.prepare_avatar
+        session (AsyncSession, optional): Сессия базы данных текущего обновления
         
     Returns:
         bool: True в случае успеха, False в случае ошибки
     """
     # Получаем информацию о юзерботе из базы данных
-    session = Session()
-    try:
-        userbot = session.query(UserBot).filter(UserBot.id == userbot_id).first()
-        if not userbot:
-            logger.error(f"Юзербот с ID {userbot_id} не найден в базе данных")
-            return False
-        
-        session_name = userbot.session_name
-    finally:
-        session.close()
-    
-    # Получаем клиент Telethon
-    client = await get_client_by_session_name(session_name)
-    if not client:
+    credentials = await _get_userbot_credentials(userbot_id, session=session)
+    if not credentials:
         return False
+    session_name, session_string = credentials
+    account = extract_session_name(session_name)
     
-    try:
-        # Обновляем имя и био, если они указаны
-        if first_name or bio:
-            # Получаем текущие значения, если новые не указаны
-            me = await client.get_me()
+    # Берем клиент Telethon из пула
+    async with client_pool.acquire(session_name, session_string=session_string) as client:
+        if not client:
+            return False
+        
+        try:
+            # Обновляем имя и био, если они указаны
+            if first_name or bio:
+                # Получаем текущие значения, если новые не указаны
+                me = await rpc_scheduler.call(account, 'default', lambda: client.get_me())
             
-            # Безопасно получаем текущее имя и биографию
-            current_first_name = getattr(me, 'first_name', '') or ''
-            # В некоторых версиях Telethon, 'about' может называться 'bio' или отсутствовать
-            current_bio = ''
-            if hasattr(me, 'about'):
-                current_bio = me.about or ''
-            elif hasattr(me, 'bio'):
-                current_bio = me.bio or ''
+                # Безопасно получаем текущее имя и биографию
+                current_first_name = getattr(me, 'first_name', '') or ''
+                # В некоторых версиях Telethon, 'about' может называться 'bio' или отсутствовать
+                current_bio = ''
+                if hasattr(me, 'about'):
+                    current_bio = me.about or ''
+                elif hasattr(me, 'bio'):
+                    current_bio = me.bio or ''
             
-            await client(UpdateProfileRequest(
-                first_name=first_name if first_name else current_first_name,
-                about=bio if bio else current_bio
-            ))
-            logger.info(f"Обновлен профиль для юзербота {session_name}")
-        
-        # Обновляем фото профиля, если указан путь к файлу
-        if photo_path and os.path.exists(photo_path):
-            # Загружаем фото
-            result = await client(UploadProfilePhotoRequest(
-                file=await client.upload_file(photo_path)
-            ))
-            logger.info(f"Обновлена аватарка для юзербота {session_name}")
+                await rpc_scheduler.call(account, 'profile', lambda: client(UpdateProfileRequest(
+                    first_name=first_name if first_name else current_first_name,
+                    about=bio if bio else current_bio
+                )))
+                logger.info(f"Обновлен профиль для юзербота {session_name}")
+        
+            # Файл с диска приводим к формату профильного фото
+            if photo_bytes is None and photo_path and os.path.exists(photo_path):
+                with open(photo_path, 'rb') as f:
+                    photo_bytes, _ = await prepare_avatar(f.read())
+            
+            # Обновляем фото профиля
+            if photo_bytes:
+                await _upload_avatar(client, account, photo_bytes)
+                logger.info(f"Обновлена аватарка для юзербота {session_name}")
         
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка при обновлении профиля юзербота {session_name}: {e}")
-        return False
-    finally:
-        # Закрываем соединение
-        await client.disconnect()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении профиля юзербота {session_name}: {e}")
+            return False
 
-async def check_channel_admin(userbot_id, channel_username):
+async def _upload_avatar(client, account, photo_bytes):
+    """
+    Устанавливает аватарку, повторно используя уже загруженный файл с тем же содержимым.
+    """
+    digest = content_hash(photo_bytes)
+    uploaded = uploaded_avatars.get((account, digest))
+    if uploaded is not None:
+        logger.info(f"Аватарка {digest[:16]} уже загружена для {account}, повторная загрузка не нужна")
+        try:
+            await rpc_scheduler.call(account, 'profile', lambda: client(UploadProfilePhotoRequest(file=uploaded)))
+            return
+        except FloodWaitError:
+            # Долгий FloodWait не связан с файлом: повторная загрузка его только продлит
+            raise
+        except Exception as e:
+            # Загруженные части могли устареть на сервере: забываем файл и загружаем заново
+            uploaded_avatars.pop((account, digest))
+            logger.warning(f"Не удалось установить ранее загруженную аватарку {digest[:16]} для {account}: {e}")
+    
+    uploaded = await rpc_scheduler.call(
+        account, 'profile', lambda: client.upload_file(photo_bytes, file_name=f"{digest[:16]}.jpg")
+    )
+    await rpc_scheduler.call(account, 'profile', lambda: client(UploadProfilePhotoRequest(file=uploaded)))
+    # Файл запоминается только после успешной установки, чтобы повтор задания не взял неудачную загрузку
+    uploaded_avatars.set((account, digest), uploaded)
+
+async def check_channel_admin(userbot_id, channel_username, session=None):
     """
     Проверяет, является ли юзербот администратором указанного канала.
     
+    Запрашивается только собственная запись участника (GetParticipant), а не
+    весь список администраторов. Результат кэшируется по (аккаунт, канал) и
+    сбрасывается при обновлениях участников канала.
+    
     Args:
         userbot_id (int): ID юзербота в базе данных
         channel_username (str): Имя пользователя канала (без @)
+        session (AsyncSession, optional): Сессия базы данных текущего обновления
         
     Returns:
         bool: True если юзербот является администратором, False в противном случае
     """
     # Получаем информацию о юзерботе из базы данных
-    session = Session()
-    try:
-        userbot = session.query(UserBot).filter(UserBot.id == userbot_id).first()
-        if not userbot:
-            logger.error(f"Юзербот с ID {userbot_id} не найден в базе данных")
-            return False
-        
-        session_name = userbot.session_name
-    finally:
-        session.close()
-    
-    # Получаем клиент Telethon
-    client = await get_client_by_session_name(session_name)
-    if not client:
+    credentials = await _get_userbot_credentials(userbot_id, session=session)
+    if not credentials:
         return False
-    
-    try:
-        # Получаем информацию о канале
-        channel = await client.get_entity(channel_username)
-        
-        # Получаем список администраторов
-        admins = await client.get_participants(channel, filter='admins')
-        
-        # Проверяем, является ли наш юзербот администратором
-        me = await client.get_me()
-        is_admin = any(admin.id == me.id for admin in admins)
+    session_name, session_string = credentials
+    account = extract_session_name(session_name)
+    # Берем клиент Telethon из пула
+    async with client_pool.acquire(session_name, session_string=session_string) as client:
+        if not client:
+            return False
         
-        return is_admin
-    except Exception as e:
-        logger.error(f"Ошибка при проверке статуса администратора для юзербота {session_name} в канале {channel_username}: {e}")
-        return False
-    finally:
-        await client.disconnect()
+        try:
+            # Канал разрешается через общий кэш сущностей, а не ResolveUsername на каждый вызов
+            channel = await peer_cache.get_input_entity(client, account, channel_username)
+            verdict = admin_verdicts.get((account, channel.channel_id))
+            if verdict is not None:
+                return verdict
+            
+            # Запрашиваем только собственную запись участника
+            try:
+                result = await rpc_scheduler.call(
+                    account, 'participants', lambda: client(GetParticipantRequest(channel, InputPeerSelf()))
+                )
+                is_admin = isinstance(result.participant, (ChannelParticipantAdmin, ChannelParticipantCreator))
+            except UserNotParticipantError:
+                is_admin = False
+            
+            admin_verdicts.set(
+                (account, channel.channel_id), is_admin,
+                ttl=None if is_admin else ADMIN_NEGATIVE_VERDICT_TTL
+            )
+            return is_admin
+        except Exception as e:
+            logger.error(f"Ошибка при проверке статуса администратора для юзербота {session_name} в канале {channel_username}: {e}")
+            # Username мог перейти к другому каналу: в следующий раз разрешаем заново
+            await peer_cache.invalidate(account, channel_username)
+            return False
 
-async def add_channel_to_profile(userbot_id, channel_username):
+async def add_channel_to_profile(userbot_id, channel_username, session=None):
     """
     Добавляет канал в профиль юзербота (в поле about).
     
     Args:
         userbot_id (int): ID юзербота в базе данных
         channel_username (str): Имя пользователя канала (с @ или без)
+        session (AsyncSession, optional): Сессия базы данных текущего обновления
         
     Returns:
         bool: True в случае успеха, False в случае ошибки
@@ -351,93 +541,134 @@ async def add_channel_to_profile(userbot_id, channel_username):
         channel_username = f'@{channel_username}'
     
     # Получаем информацию о юзерботе из базы данных
-    session = Session()
-    try:
-        userbot = session.query(UserBot).filter(UserBot.id == userbot_id).first()
-        if not userbot:
-            logger.error(f"Юзербот с ID {userbot_id} не найден в базе данных")
-            return False
-        
-        session_name = userbot.session_name
-    finally:
-        session.close()
-    
-    # Получаем клиент Telethon
-    client = await get_client_by_session_name(session_name)
-    if not client:
+    credentials = await _get_userbot_credentials(userbot_id, session=session)
+    if not credentials:
         return False
+    session_name, session_string = credentials
+    account = extract_session_name(session_name)
     
-    try:
-        # Получаем текущую информацию о профиле
-        me = await client.get_me()
-        current_bio = me.about or ""
+    # Берем клиент Telethon из пула
+    async with client_pool.acquire(session_name, session_string=session_string) as client:
+        if not client:
+            return False
         
-        # Проверяем, есть ли уже ссылка на канал в профиле
-        if channel_username in current_bio:
-            logger.info(f"Канал {channel_username} уже добавлен в профиль юзербота {session_name}")
-            return True
+        try:
+            # Получаем текущее описание профиля (оно есть только в полной информации о пользователе)
+            full = await rpc_scheduler.call(account, 'default', lambda: client(GetFullUserRequest(InputUserSelf())))
+            current_bio = full.full_user.about or ""
         
-        # Добавляем канал в био
-        new_bio = f"{current_bio}\n{channel_username}".strip()
+            # Проверяем, есть ли уже ссылка на канал в профиле
+            if channel_username in current_bio:
+                logger.info(f"Канал {channel_username} уже добавлен в профиль юзербота {session_name}")
+                return True
         
-        # Обновляем профиль
-        await client(UpdateProfileRequest(about=new_bio))
+            # Добавляем канал в био
+            new_bio = f"{current_bio}\n{channel_username}".strip()
         
-        logger.info(f"Канал {channel_username} добавлен в профиль юзербота {session_name}")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка при добавлении канала в профиль юзербота {session_name}: {e}")
-        return False
-    finally:
-        await client.disconnect()
+            # Обновляем профиль
+            await rpc_scheduler.call(account, 'profile', lambda: client(UpdateProfileRequest(about=new_bio)))
+        
+            logger.info(f"Канал {channel_username} добавлен в профиль юзербота {session_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении канала в профиль юзербота {session_name}: {e}")
+            return False
 
 # Функция для проверки доступности юзербота
-async def check_userbot_availability(userbot_id):
+async def check_userbot_availability(userbot_id, session=None):
     """
     Проверяет, что юзербот доступен и авторизован.
     
     Args:
         userbot_id (int): ID юзербота в базе данных
+        session (AsyncSession, optional): Сессия базы данных текущего обновления
         
     Returns:
-        bool: True если юзербот доступен, False в противном случае
+        bool: True если юзербот доступен, False в противном случае.
+        Причина отказа сохраняется в availability_failures.
     """
+    # Недавняя успешная проверка: клиент уже подключен и авторизован в пуле
+    if available_userbots.get(userbot_id) is not None:
+        return True
+    
     # Получаем информацию о юзерботе из базы данных
-    session = Session()
-    try:
-        userbot = session.query(UserBot).filter(UserBot.id == userbot_id).first()
-        if not userbot:
-            logger.error(f"Юзербот с ID {userbot_id} не найден в базе данных")
+    credentials = await _get_userbot_credentials(userbot_id, session=session)
+    if not credentials:
+        availability_failures.set(userbot_id, (False, "Нет данных сессии"))
+        return False
+    session_name, session_string = credentials
+    account = extract_session_name(session_name)
+    
+    # Пытаемся подключиться к аккаунту через пул
+    async with client_pool.acquire(session_name, session_string=session_string) as client:
+        if not client:
+            availability_failures.set(userbot_id, connect_failures.get(account) or (False, "Не удалось подключиться"))
             return False
         
-        session_name = userbot.session_name
-    finally:
-        session.close()
-    
-    # Пытаемся подключиться к аккаунту
-    client = await get_client_by_session_name(session_name)
-    if not client:
-        return False
+        try:
+            # Проверяем, что аккаунт работает
+            me = await rpc_scheduler.call(account, 'default', lambda: client.get_me())
+            logger.info(f"Юзербот {session_name} доступен. ID: {me.id}, Имя: {me.first_name}")
+            available_userbots.set(userbot_id, me)
+            availability_failures.pop(userbot_id)
+            return True
+        except UnauthorizedError as e:
+            logger.error(f"Сессия юзербота {session_name} отозвана: {e}")
+            availability_failures.set(userbot_id, (True, str(e)[:255] or type(e).__name__))
+            await client_pool.discard(session_name)
+            return False
+        except Exception as e:
+            # FloodWait и сетевые сбои не означают, что сессия недействительна
+            logger.error(f"Ошибка при проверке доступности юзербота {session_name}: {e}")
+            availability_failures.set(userbot_id, (False, str(e)[:255] or type(e).__name__))
+            return False
+
+# Официальный бот для проверки ограничений аккаунта
+SPAMBOT_USERNAME = "SpamBot"
+
+async def check_spambot(client, account, timeout=5):
+    """
+    Проверяет ограничения аккаунта через @SpamBot.
     
-    try:
-        # Проверяем, что аккаунт работает
-        me = await client.get_me()
-        logger.info(f"Юзербот {session_name} доступен. ID: {me.id}, Имя: {me.first_name}")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка при проверке доступности юзербота {session_name}: {e}")
-        return False
-    finally:
-        await client.disconnect()
+    Args:
+        client (TelegramClient): Подключенный клиент юзербота
+        account (str): Ключ аккаунта для планировщика запросов (имя сессии)
+        timeout (int): Сколько секунд ждать ответа
+        
+    Returns:
+        tuple: (статус, текст ответа). Статус: 'ok' - ограничений нет,
+            'limited' - возможен спам-блок, 'answered' - ответ не распознан,
+            'unknown' - ответа не было
+    """
+    # Находим SpamBot через общий кэш сущностей
+    spam_bot = await peer_cache.get_input_entity(client, account, SPAMBOT_USERNAME)
+    
+    # Отправляем сообщение /start спам-боту
+    started_at = time.time()
+    await rpc_scheduler.call(account, 'messages', lambda: client.send_message(spam_bot, "/start"))
+    
+    # Ждем свежего ответа (пришедшего после нашего запроса)
+    while time.time() - started_at < timeout:
+        messages = await rpc_scheduler.call(account, 'default', lambda: client.get_messages(spam_bot, limit=1))
+        for message in messages:
+            if not message.out and message.date.timestamp() >= int(started_at):
+                spam_message = (message.text or "").lower()
+                if "good news" in spam_message or "не ограничен" in spam_message:
+                    return 'ok', message.text
+                if "спам" in spam_message or "spam" in spam_message:
+                    return 'limited', message.text
+                return 'answered', message.text
+        await asyncio.sleep(0.5)
+    
+    return 'unknown', None
 
 # Если файл запущен напрямую, выполняем тестовую функцию
 if __name__ == "__main__":
     # Тестовая функция для проверки работы модуля
     async def test_userbot_manager():
         # Получаем id первого юзербота из базы данных
-        session = Session()
-        userbot = session.query(UserBot).first()
-        session.close()
+        async with AsyncSession() as session:
+            userbot = await session.scalar(select(UserBot).limit(1))
         
         if userbot:
             userbot_id = userbot.id
@@ -451,6 +682,9 @@ if __name__ == "__main__":
                 # Обновляем имя и био
                 await update_bot_profile(userbot_id, first_name="Тестовый бот", bio="Это тестовый бот для проверки работы модуля")
                 print("Профиль обновлен")
+            
+            print(f"Статистика пула: {client_pool.stats()}")
+            await client_pool.close()
         else:
             print("Юзерботы не найдены в базе данных")
     
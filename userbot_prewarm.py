@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Предварительная проверка юзербота, пока пользователь оплачивает кампанию.
+
+Как только /new_campaign закрепил бота, в фоне выполняются загрузка сессии,
+подключение клиента в пул, авторизация и get_me. К вводу имени бота
+результат уже готов, а задержка подключения скрыта за временем, которое
+пользователь тратит на оплату и ввод данных. Если аккаунт не отвечает,
+мастеру незаметно выдается другой свободный бот. Недействительным в
+userbot_health бот помечается, только если Telegram отклонил сессию;
+после сетевого сбоя или FloodWait записывается лишь ошибка, а бот
+пропускается только в этом мастере. Замена меняет только аренду в базе: мастер берет
+бота через leased_userbot, поэтому параллельные обновления данных FSM не
+могут вернуть ему отклоненного бота.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from database.db import AsyncSession
+from database.models import UserBotHealth
+from userbot_allocator import claim_userbot, leased_userbot, release_userbot
+from userbot_manager import availability_failures, check_userbot_availability
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз можно заменить бота и сколько шаг мастера ждет незавершенной проверки
+USERBOT_PREWARM_MAX_SWAPS = int(os.environ.get('USERBOT_PREWARM_MAX_SWAPS', '3'))
+USERBOT_PREWARM_WAIT = float(os.environ.get('USERBOT_PREWARM_WAIT', '15'))
+
+
+async def _record_failure(userbot_id):
+    """
+    Записывает неудачную проверку в userbot_health.
+
+    Отклоненная сессия снимает бота с выдачи до следующего обхода мониторинга.
+    Временный сбой сохраняет прежнее значение is_authorized, как и в health_monitor.
+    """
+    rejected, error = availability_failures.get(userbot_id) or (False, "Не прошел предварительную проверку")
+    health = UserBotHealth(userbot_id=userbot_id, last_check_at=datetime.now(), last_error=error)
+    if rejected:
+        health.is_authorized = False
+    async with AsyncSession() as session:
+        await session.merge(health)
+        await session.commit()
+
+
+class Prewarmer:
+    """
+    Фоновые проверки ботов, закрепленных за пользователями в мастере.
+
+    Args:
+        max_swaps (int): Максимальное количество замен бота за один мастер
+    """
+
+    def __init__(self, max_swaps=USERBOT_PREWARM_MAX_SWAPS):
+        self.max_swaps = max_swaps
+        self._tasks = {}
+
+        # Счетчики для мониторинга
+        self.warmed = 0
+        self.swapped = 0
+        self.failed = 0
+
+    def start(self, owner_id, userbot_id):
+        """
+        Запускает проверку бота, только что закрепленного за пользователем.
+
+        Args:
+            owner_id (int): Telegram ID пользователя
+            userbot_id (int): ID юзербота
+        """
+        previous = self._tasks.get(owner_id)
+        if previous and not previous.done():
+            previous.cancel()
+        task = asyncio.create_task(self._run(owner_id, userbot_id))
+        self._tasks[owner_id] = task
+        task.add_done_callback(lambda done: self._tasks.pop(owner_id, None) if self._tasks.get(owner_id) is done else None)
+
+    async def wait(self, owner_id, timeout=USERBOT_PREWARM_WAIT):
+        """Дожидается незавершенной проверки, чтобы шаг мастера работал с итоговым ботом."""
+        task = self._tasks.get(owner_id)
+        if task:
+            await asyncio.wait({task}, timeout=timeout)
+
+    async def _run(self, owner_id, userbot_id):
+        rejected = []
+        try:
+            while True:
+                if await check_userbot_availability(userbot_id):
+                    self.warmed += 1
+                    return
+
+                # Бот с временным сбоем пропускается только в этом мастере
+                rejected.append(userbot_id)
+                await _record_failure(userbot_id)
+                if len(rejected) > self.max_swaps:
+                    break
+                replacement = await self._swap(owner_id, userbot_id, rejected)
+                if replacement is None:
+                    break
+                logger.info(f"Юзербот {userbot_id} не прошел проверку, пользователю {owner_id} выдан {replacement}")
+                self.swapped += 1
+                userbot_id = replacement
+
+            self.failed += 1
+            logger.warning(f"Не удалось подобрать рабочего юзербота для пользователя {owner_id}, проверено: {rejected}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка предварительной проверки юзербота {userbot_id}: {e}")
+
+    async def _swap(self, owner_id, userbot_id, rejected):
+        async with AsyncSession() as session:
+            # Пользователь мог отменить мастер или бот уже занят кампанией
+            current = await leased_userbot(session, owner_id)
+            if current is None or current.id != userbot_id:
+                return None
+            # Новый бот закрепляется до освобождения старого в той же транзакции:
+            # если замены нет, мастер сохраняет аренду
+            replacement = await claim_userbot(session, owner_id, exclude=rejected)
+            if replacement is None:
+                return None
+            await release_userbot(session, userbot_id, owner_id)
+            await session.commit()
+        return replacement.id
+
+    def stats(self):
+        return {'warmed': self.warmed, 'swapped': self.swapped, 'failed': self.failed, 'running': len(self._tasks)}
+
+
+# Общий экземпляр для процесса бота
+prewarmer = Prewarmer()
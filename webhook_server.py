@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Прием обновлений Telegram через webhook и обработка в нескольких процессах.
+
+Главный процесс (aiohttp) только принимает обновление и кладет его в
+очередь процесса-обработчика, выбранного по chat_id, поэтому обновления
+одного чата всегда обрабатываются одним процессом. Внутри процесса
+обновления одного чата идут строго по очереди, а общее число одновременно
+обрабатываемых обновлений ограничено параметром concurrency.
+
+Использование:
+    python webhook_server.py serve --app bot --workers 4 --concurrency 32
+    python webhook_server.py polling --app adminbot
+    python webhook_server.py serve --app bot --local
+    python webhook_server.py loadtest --url http://localhost:8080/webhook --updates 5000 --chats 200
+
+Если WEBHOOK_URL не задан (и не указан --local), serve переходит на поллинг
+в одном процессе.
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import statistics
+import sys
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Модуль бота и переменная окружения с его токеном
+APPS = {
+    'bot': ('bot.main', 'BOT_TOKEN'),
+    'adminbot': ('adminbot.main', 'BOT_TOKEN_ADMIN'),
+}
+
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # Публичный адрес сервера, например https://example.com
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '2'))
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', '32'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '10000'))
+WEBHOOK_STATS_INTERVAL = int(os.environ.get('WEBHOOK_STATS_INTERVAL', '60'))
+
+# Поля обновления, в которых есть сообщение с чатом
+MESSAGE_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                  'business_message', 'edited_business_message')
+
+
+def chat_id_of(update):
+    """
+    Определяет чат обновления для выбора процесса-обработчика.
+
+    Args:
+        update (dict): Обновление Telegram в виде JSON
+
+    Returns:
+        int: ID чата, пользователя или, если их нет, update_id
+    """
+    for field in MESSAGE_FIELDS:
+        if field in update:
+            return update[field]['chat']['id']
+    callback = update.get('callback_query')
+    if callback:
+        if callback.get('message'):
+            return callback['message']['chat']['id']
+        return callback['from']['id']
+    for value in update.values():
+        if isinstance(value, dict):
+            if 'chat' in value:
+                return value['chat']['id']
+            if 'from' in value:
+                return value['from']['id']
+    return update.get('update_id', 0)
+
+
+class ChatSerializer:
+    """
+    Выполняет обработку обновлений одного чата по очереди, а разных чатов - параллельно.
+
+    Args:
+        concurrency (int): Максимальное число одновременно обрабатываемых обновлений
+    """
+
+    def __init__(self, concurrency):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # chat_id -> [блокировка, число ожидающих]; запись удаляется, когда чат простаивает
+        self._locks = {}
+
+    async def run(self, chat_id, process):
+        entry = self._locks.get(chat_id)
+        if entry is None:
+            entry = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # Блокировка asyncio.Lock выдается в порядке ожидания, то есть в порядке поступления обновлений
+            async with entry[0]:
+                async with self.semaphore:
+                    return await process()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[chat_id]
+
+
+async def _process_update(dp, bot, payload, stats):
+    from aiogram.types import Update
+
+    started = time.monotonic()
+    try:
+        update = Update.model_validate(payload, context={"bot": bot})
+        await dp.feed_update(bot, update)
+        stats['processed'] += 1
+    except Exception as e:
+        stats['failed'] += 1
+        logger.error(f"Ошибка при обработке обновления {payload.get('update_id')}: {e}")
+    stats['busy_seconds'] += time.monotonic() - started
+
+
+async def _log_stats(index, stats, interval=WEBHOOK_STATS_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Обработчик {index}: {stats}")
+
+
+async def _worker_loop(app_name, index, workers, updates, concurrency):
+    module = importlib.import_module(APPS[app_name][0])
+    dp, bot = module.dp, module.bot
+    serializer = ChatSerializer(concurrency)
+    # Не забираем из очереди больше, чем успеваем обработать: остальное ждет в очереди главного процесса
+    intake = asyncio.Semaphore(concurrency * 4)
+    stats = {'processed': 0, 'failed': 0, 'busy_seconds': 0.0}
+    tasks = set()
+
+    background_tasks = [asyncio.create_task(_log_stats(index, stats))]
+    # Модуль бота сам решает, какие фоновые задачи нужны в каждом процессе, а какие только в первом
+    if hasattr(module, 'start_background_tasks'):
+        background_tasks.extend(module.start_background_tasks(index, workers))
+
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+    loop = asyncio.get_running_loop()
+    logger.info(f"Обработчик {index} ({app_name}) запущен, параллельность {concurrency}")
+    try:
+        while True:
+            await intake.acquire()
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                intake.release()
+                break
+            chat_id, payload = item
+            task = asyncio.create_task(
+                serializer.run(chat_id, lambda payload=payload: _process_update(dp, bot, payload, stats))
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: intake.release())
+
+        # Дорабатываем уже принятые обновления
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+        if hasattr(module, 'shutdown'):
+            # Модуль отменяет фоновые задачи и дожидается их до закрытия пула и хранилища, которыми они пользуются
+            await module.shutdown(background_tasks)
+        else:
+            for task in background_tasks:
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+        await bot.session.close()
+        logger.info(f"Обработчик {index} остановлен: {stats}")
+
+
+def _worker_main(app_name, index, workers, updates, concurrency):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_worker_loop(app_name, index, workers, updates, concurrency))
+
+
+async def handle_update(request):
+    """Принимает обновление и передает его процессу, закрепленному за чатом."""
+    secret = request.app['secret']
+    if secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+        return web.Response(status=401)
+
+    payload = await request.json()
+    chat_id = chat_id_of(payload)
+    updates = request.app['queues']
+    try:
+        updates[chat_id % len(updates)].put_nowait((chat_id, payload))
+    except queue.Full:
+        # Telegram повторит доставку позже
+        logger.warning(f"Очередь обработчика переполнена, обновление {payload.get('update_id')} отклонено")
+        return web.Response(status=503)
+    return web.Response()
+
+
+async def _set_webhook(app):
+    from aiogram import Bot
+
+    if not WEBHOOK_URL:
+        return
+    bot = Bot(token=os.getenv(APPS[app['app_name']][1]))
+    try:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + app['path'],
+            secret_token=app['secret'] or None,
+            max_connections=100
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL.rstrip('/')}{app['path']}")
+    finally:
+        await bot.session.close()
+
+
+async def _stop_workers(app):
+    for updates in app['queues']:
+        updates.put(None)
+    for process in app['processes']:
+        await asyncio.get_running_loop().run_in_executor(None, process.join, 30)
+
+
+def serve(app_name, workers=WEBHOOK_WORKERS, concurrency=WEBHOOK_CONCURRENCY,
+          host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    """
+    Запускает прием обновлений и процессы-обработчики.
+
+    Args:
+        app_name (str): bot или adminbot
+        workers (int): Количество процессов-обработчиков
+        concurrency (int): Параллельность внутри одного процесса
+        host (str): Адрес, на котором слушает сервер
+        port (int): Порт сервера
+        path (str): Путь webhook
+        secret (str): Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+    """
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue(WEBHOOK_QUEUE_SIZE) for _ in range(workers)]
+    processes = [
+        context.Process(target=_worker_main, args=(app_name, index, workers, queues[index], concurrency), daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    app = web.Application()
+    app['app_name'] = app_name
+    app['path'] = path
+    app['secret'] = secret
+    app['queues'] = queues
+    app['processes'] = processes
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(_set_webhook)
+    app.on_cleanup.append(_stop_workers)
+
+    logger.info(f"Прием обновлений {app_name} на {host}:{port}{path}, обработчиков: {workers}")
+    web.run_app(app, host=host, port=port)
+
+
+async def run_polling(app_name):
+    """Запасной режим: поллинг в одном процессе, как при запуске модуля бота напрямую."""
+    module = importlib.import_module(APPS[app_name][0])
+    # Поллинг не работает, пока у бота установлен webhook
+    await module.bot.delete_webhook()
+    await module.main()
+
+
+def fake_update(update_id, chat_id, text):
+    """Синтетическое обновление с текстовым сообщением в личном чате."""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Load'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+        },
+    }
+
+
+async def load_test(url, updates, chats, rate, text, secret=WEBHOOK_SECRET, chat_base=10 ** 12):
+    """
+    Отправляет синтетические обновления на webhook и печатает итоги.
+
+    Чаты несуществующие, поэтому ответы бота на них завершаются ошибкой
+    Telegram; нагрузка на прием, очереди, базу данных и кэши при этом реальная.
+
+    Args:
+        url (str): Адрес webhook
+        updates (int): Количество обновлений
+        chats (int): Количество различных чатов
+        rate (float): Обновлений в секунду (0 - без ограничения)
+        text (str): Текст сообщений
+        secret (str): Секрет webhook
+        chat_base (int): Начальный ID синтетических чатов
+    """
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    latencies = []
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(100)
+
+    async with ClientSession(headers=headers) as http:
+        async def send(update_id):
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    async with http.post(url, json=fake_update(update_id, chat_base + update_id % chats, text)) as response:
+                        statuses[response.status] += 1
+                except Exception as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.monotonic() - started)
+
+        started = time.monotonic()
+        tasks = []
+        for update_id in range(1, updates + 1):
+            tasks.append(asyncio.create_task(send(update_id)))
+            if rate:
+                await asyncio.sleep(1 / rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    print(f"Отправлено обновлений: {updates} за {elapsed:.1f} с ({updates / elapsed:.0f} в секунду)")
+    print(f"Ответы: {dict(statuses)}")
+    if latencies:
+        print(
+            f"Задержка приема: медиана {statistics.median(latencies) * 1000:.1f} мс, "
+            f"95-й перцентиль {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} мс"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Прием обновлений через webhook с обработкой в нескольких процессах")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="Запустить webhook и процессы-обработчики")
+    serve_parser.add_argument("--app", choices=APPS, default="bot")
+    serve_parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS)
+    serve_parser.add_argument("--concurrency", type=int, default=WEBHOOK_CONCURRENCY)
+    serve_parser.add_argument("--host", default=WEBHOOK_HOST)
+    serve_parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    serve_parser.add_argument("--local", action="store_true",
+                              help="Принимать обновления без установки webhook (для нагрузочного теста)")
+
+    polling_parser = subparsers.add_parser("polling", help="Запустить поллинг в одном процессе")
+    polling_parser.add_argument("--app", choices=APPS, default="bot")
+
+    loadtest_parser = subparsers.add_parser("loadtest", help="Отправить синтетические обновления на webhook")
+    loadtest_parser.add_argument("--url", default=f"http://localhost:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    loadtest_parser.add_argument("--updates", type=int, default=1000)
+    loadtest_parser.add_argument("--chats", type=int, default=100)
+    loadtest_parser.add_argument("--rate", type=float, default=0, help="Обновлений в секунду (0 - без ограничения)")
+    loadtest_parser.add_argument("--text", default="Мои кампании")
+
+    args = parser.parse_args()
+
+    if args.command == "loadtest":
+        asyncio.run(load_test(args.url, args.updates, args.chats, args.rate, args.text))
+    elif args.command == "serve" and (WEBHOOK_URL or args.local):
+        serve(args.app, workers=args.workers, concurrency=args.concurrency, host=args.host, port=args.port)
+    elif args.command in ("serve", "polling"):
+        if args.command == "serve":
+            logger.warning("WEBHOOK_URL не задан, используется поллинг")
+        asyncio.run(run_polling(args.app))
+    else:
+        parser.print_help()